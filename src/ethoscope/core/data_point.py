@@ -1,16 +1,136 @@
-import collections
-import copy
-
 __author__ = 'quentin'
 
 
-class DataPoint(collections.OrderedDict):
+class DataPointSchema(object):
+    # the schemas already made, by variable classes, so that data points with the same variables share their schema
+    _schemas = {}
+
+    def __init__(self, variable_classes):
+        """
+        The layout of a :class:`~ethoscope.core.data_point.DataPoint`: the ordered variable types it contains.
+        The header names, SQL types and functional types of the variables are declared once, in the schema,
+        rather than in each data point.
+        Schemas should be obtained with :meth:`~ethoscope.core.data_point.DataPointSchema.get`, so that they are shared.
+
+        >>> from ethoscope.core.variables import XPosVariable, YPosVariable
+        >>> schema = DataPointSchema.get([XPosVariable, YPosVariable])
+        >>> data = schema.data_point(32, 18)
+        >>> print data["x"]
+
+        :param variable_classes: the variable types, in order
+        :type variable_classes: list(class)
+        """
+        self._variable_classes = tuple(variable_classes)
+        self._header_names = tuple([c.header_name for c in self._variable_classes])
+        if len(set(self._header_names)) != len(self._header_names):
+            raise ValueError("Variables must have different header names: %s" % str(self._header_names))
+        self._index = dict([(n, i) for i, n in enumerate(self._header_names)])
+        self._extended = {}
+
+    @classmethod
+    def get(cls, variable_classes):
+        """
+        :param variable_classes: the variable types, in order
+        :type variable_classes: list(class)
+        :return: the (shared) schema of these variable types
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        variable_classes = tuple(variable_classes)
+        try:
+            return cls._schemas[variable_classes]
+        except KeyError:
+            schema = DataPointSchema(variable_classes)
+            cls._schemas[variable_classes] = schema
+            return schema
+
+    def __reduce__(self):
+        # schemas are shared within each process
+        return _schema, (self._variable_classes,)
+
+    def __len__(self):
+        return len(self._variable_classes)
+
+    @property
+    def header_names(self):
+        return self._header_names
+
+    @property
+    def variable_classes(self):
+        return self._variable_classes
+
+    def index(self, header_name):
+        """
+        :param header_name: the header name of a variable
+        :type header_name: str
+        :return: the position of the variable in data points, or ``None`` if it is not in this schema
+        :rtype: int
+        """
+        return self._index.get(header_name)
+
+    def extended(self, variable_class):
+        """
+        :param variable_class: a variable type, not in this schema
+        :type variable_class: class
+        :return: the schema with an additional (last) variable
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        try:
+            return self._extended[variable_class]
+        except KeyError:
+            schema = DataPointSchema.get(self._variable_classes + (variable_class,))
+            self._extended[variable_class] = schema
+            return schema
+
+    def data_point(self, *values):
+        """
+        Make a data point from the (integer) values of the variables, without making variable objects.
+
+        :param values: the value of each variable, in order
+        :type values: int
+        :return: a new data point
+        :rtype: :class:`~ethoscope.core.data_point.DataPoint`
+        """
+        if len(values) != len(self._variable_classes):
+            raise ValueError("Expected %i values, got %i" % (len(self._variable_classes), len(values)))
+        return _data_point(self, [int(v) for v in values])
+
+    def sql_fields(self):
+        """
+        :return: the SQL definition of each variable (e.g. ``"x SMALLINT"``)
+        :rtype: list(str)
+        """
+        return ["%s %s" % (c.header_name, c.sql_data_type) for c in self._variable_classes]
+
+    def var_map(self):
+        """
+        :return: the header name, SQL type and functional type of each variable
+        :rtype: list((str, str, str))
+        """
+        return [(c.header_name, c.sql_data_type, c.functional_type) for c in self._variable_classes]
+
+
+def _schema(variable_classes):
+    return DataPointSchema.get(variable_classes)
+
+
+def _data_point(schema, values):
+    out = DataPoint.__new__(DataPoint)
+    out._schema = schema
+    out._values = values
+    return out
+
+
+class DataPoint(object):
+    __slots__ = ("_schema", "_values")
 
     def __init__(self, data):
         """
-        A container to store variables. It derived from :class:`~collections.OrderedDict`.
-        Variables are accessible by header name, which is an individual identifier
-        of a variable type (see :class:`~ethoscope.core.variables.BaseIntVariable`):
+        A container to store variables. Variables are accessible by header name, which is an individual identifier
+        of a variable type (see :class:`~ethoscope.core.variables.BaseIntVariable`).
+        It is a fixed-layout record: its variable types are described by a shared
+        :class:`~ethoscope.core.data_point.DataPointSchema`, and it only stores their (integer) values.
+        It has the read methods of a dictionary. Reading a value returns an ``int``,
+        whilst ``values()`` and ``items()`` return variable objects:
 
         >>> from ethoscope.core.variables import DataPoint, XPosVariable, YPosVariable, HeightVariable
         >>> y = YPosVariable(18)
@@ -25,26 +145,96 @@ class DataPoint(collections.OrderedDict):
         :param data: a list of data points
         :type data: list(:class:`~ethoscope.core.variables.BaseIntVariable`)
         """
-        collections.OrderedDict.__init__(self)
+        self._schema = DataPointSchema.get([])
+        self._values = []
         for i in data:
-            self.__setitem__(i.header_name, i)
+            self.append(i)
+
+    @property
+    def schema(self):
+        """
+        :return: the variable types of this data point
+        :rtype: :class:`~ethoscope.core.data_point.DataPointSchema`
+        """
+        return self._schema
 
     def copy(self):
         """
-        Deep copy a data point. Copying using the `=` operator will simply create an alias to a `DataPoint`
+        Copy a data point. Copying using the `=` operator will simply create an alias to a `DataPoint`
         object (i.e. allow modification of the original object).
 
         :return: a copy of this object
         :rtype: :class:`~ethoscope.core.data_point.DataPoint`
         """
-        return DataPoint(copy.deepcopy(self.values()))
+        return _data_point(self._schema, list(self._values))
+
+    def __reduce__(self):
+        # this makes data points picklable, so they can be sent to/from other processes
+        return _data_point, (self._schema, self._values)
 
     def append(self, item):
         """
         Add a new variable in the `DataPoint` The order is preserved.
+        If the data point already has a variable with the same header name, its value is replaced.
 
         :param item: A variable to be added.
         :param item: :class:`~ethoscope.core.variables.BaseIntVariable`
         :return:
         """
-        self.__setitem__(item.header_name, item)
\ No newline at end of file
+        i = self._schema.index(item.header_name)
+        if i is None:
+            self._schema = self._schema.extended(type(item))
+            self._values.append(int(item))
+        else:
+            self._values[i] = int(item)
+
+    def to_tuple(self):
+        """
+        :return: the values of the variables, in order
+        :rtype: tuple(int)
+        """
+        return tuple(self._values)
+
+    def __getitem__(self, key):
+        i = self._schema.index(key)
+        if i is None:
+            raise KeyError(key)
+        return self._values[i]
+
+    def get(self, key, default=None):
+        i = self._schema.index(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def __contains__(self, key):
+        return self._schema.index(key) is not None
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._schema.header_names)
+
+    def keys(self):
+        return list(self._schema.header_names)
+
+    def values(self):
+        return [c(v) for c, v in zip(self._schema.variable_classes, self._values)]
+
+    def items(self):
+        return zip(self._schema.header_names, self.values())
+
+    def __eq__(self, other):
+        if not isinstance(other, DataPoint):
+            return NotImplemented
+        return self._schema.header_names == other._schema.header_names and self._values == other._values
+
+    def __ne__(self, other):
+        out = self.__eq__(other)
+        if out is NotImplemented:
+            return out
+        return not out
+
+    def __repr__(self):
+        return "DataPoint(%s)" % str(zip(self._schema.header_names, self._values))
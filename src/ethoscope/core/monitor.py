@@ -70,6 +70,23 @@ class Monitor(object):
         time_from_start = self._last_time_stamp / 1e3
         return time_from_start
 
+    @property
+    def n_dropped_frames(self):
+        """
+        :return: The number of frames captured by the camera, but dropped before being acquired (see :attr:`~ethoscope.hardware.input.cameras.BaseCamera.n_dropped_frames`).
+        :rtype: int
+        """
+        return self._camera.n_dropped_frames
+
+    @property
+    def n_skipped_roi_frames(self):
+        """
+        :return: The number of ROI-frames (i.e. one ROI in one frame) that were not analysed, as the ROI did not change
+            (see motion gating in :class:`~ethoscope.trackers.trackers.BaseTracker`).
+        :rtype: int
+        """
+        return sum([u.tracker.n_skipped_frames for u in self._unit_trackers])
+
     @property
     def last_frame_idx(self):
         """
@@ -84,6 +101,20 @@ class Monitor(object):
         """
         self._force_stop = True
 
+    def _track_units(self, t, frame):
+        """
+        Track all the ROIs in a frame, one after the other.
+
+        :param t: the time stamp associated to the frame (in ms).
+        :type t: int
+        :param frame: the entire frame to analyse
+        :type frame: :class:`~numpy.ndarray`
+        :return: pairs of tracking unit and resulting data rows, in the order of the tracking units
+        :rtype: generator((:class:`~ethoscope.core.tracking_unit.TrackingUnit`, list(:class:`~ethoscope.core.data_point.DataPoint`)))
+        """
+        for track_u in self._unit_trackers:
+            yield track_u, track_u.track(t, frame)
+
     def run(self, result_writer = None, drawer = None):
         """
         Runs the monitor indefinitely.
@@ -108,8 +139,7 @@ class Monitor(object):
                 self._last_time_stamp = t
                 self._frame_buffer = frame
 
-                for j,track_u in enumerate(self._unit_trackers):
-                    data_rows = track_u.track(t, frame)
+                for track_u, data_rows in self._track_units(t, frame):
                     if len(data_rows) == 0:
                         self._last_positions[track_u.roi.idx] = []
                         continue
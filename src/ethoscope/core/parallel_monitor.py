@@ -0,0 +1,222 @@
+__author__ = 'quentin'
+
+import ctypes
+import logging
+import multiprocessing
+import traceback
+
+import numpy as np
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.trackers.trackers import BaseTracker
+from ethoscope.utils.debug import EthoscopeException
+
+
+class _RemoteTracker(BaseTracker):
+    def __init__(self, roi, *args, **kwargs):
+        """
+        A stand-in for a tracker that runs in another process.
+        It does not analyse images. Instead, it is given the data points computed remotely and keeps the same
+        history (positions, times, ...) as the actual tracker would, so that stimulators and drawers can use it.
+
+        :param roi: The Region Of Interest of the remote tracker.
+        :type roi: :class:`~ethoscope.core.roi.ROI`
+        :param args: ignored (used by the remote tracker)
+        :param kwargs: ignored (used by the remote tracker)
+        """
+        self._next_points = []
+        self._next_skipped = False
+        super(_RemoteTracker, self).__init__(roi)
+
+    def set_next_points(self, points, skipped=False):
+        self._next_points = points
+        self._next_skipped = skipped
+
+    def track(self, t, img):
+        points, self._next_points = self._next_points, []
+        self._last_time_point = t
+        # whether the remote tracker skipped the frame (motion gating)
+        self._last_frame_skipped = self._next_skipped
+        if self._next_skipped:
+            self._n_skipped_frames += 1
+        if len(points) == 0:
+            return []
+        self._update_history(t, points)
+        return points
+
+
+class _TrackingWorker(multiprocessing.Process):
+    def __init__(self, tracker_class, rois, frame_buffer, frame_shape, connection, *args, **kwargs):
+        """
+        A process that owns the trackers of a subset of ROIs.
+        For each frame, it reads the shared frame buffer and sends back the data points of each of its ROIs.
+
+        :param tracker_class: The algorithm that will be used for tracking.
+        :type tracker_class: class
+        :param rois: the ROIs tracked by this worker
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param frame_buffer: a shared memory array where the parent process publishes frames
+        :type frame_buffer: :class:`~multiprocessing.RawArray`
+        :param frame_shape: the shape of the frames
+        :type frame_shape: tuple
+        :param connection: the end of a pipe used to receive time stamps and send back results
+        :type connection: :class:`~multiprocessing.Connection`
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        self._tracker_class = tracker_class
+        self._rois = rois
+        self._frame_buffer = frame_buffer
+        self._frame_shape = frame_shape
+        self._connection = connection
+        self._tracker_args = args
+        self._tracker_kwargs = kwargs
+        super(_TrackingWorker, self).__init__()
+
+    def run(self):
+        trackers = [self._tracker_class(r, *self._tracker_args, **self._tracker_kwargs) for r in self._rois]
+        frame = np.frombuffer(self._frame_buffer, dtype=np.uint8).reshape(self._frame_shape)
+        try:
+            while True:
+                t = self._connection.recv()
+                if t is None:
+                    break
+                try:
+                    out = [(tr.track(t, frame), tr.last_frame_skipped) for tr in trackers]
+                except Exception as e:
+                    self._connection.send(("error", traceback.format_exc(e)))
+                    break
+                self._connection.send(("ok", out))
+        except (KeyboardInterrupt, EOFError):
+            pass
+        finally:
+            self._connection.close()
+
+
+class ParallelMonitor(Monitor):
+    def __init__(self, camera, tracker_class,
+                 rois = None, stimulators=None, n_processes=None,
+                 *args, **kwargs  # extra arguments for the tracker objects
+                 ):
+        r"""
+        A monitor that shards the tracking of the ROIs across several worker processes.
+        For each frame, the frame is copied once in a shared memory buffer, all workers track their ROIs in parallel,
+        and results are gathered in ROI order. Stimulators, result writing and drawing happen in the calling process,
+        in the same order as :class:`~ethoscope.core.monitor.Monitor`.
+
+        Note that a state shared, within a process, by several trackers (e.g. the class-level
+        ``fg_model`` of :class:`~ethoscope.trackers.adaptive_bg_tracker.AdaptiveBGModel`) is only shared among the ROIs
+        of the same worker.
+
+        :param camera: a camera object responsible of acquiring frames and associated time stamps
+        :type camera: :class:`~ethoscope.hardware.input.cameras.BaseCamera`
+        :param tracker_class: The algorithm that will be used for tracking. It must inherit from :class:`~ethoscope.trackers.trackers.BaseTracker`
+        :type tracker_class: class
+        :param rois: A list of region of interest.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
+        :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param n_processes: The number of worker processes. `None` means one per CPU core (but not more than ROIs).
+        :type n_processes: int
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+
+        if rois is None:
+            raise NotImplementedError("rois must exist (cannot be None)")
+
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        if n_processes < 1:
+            raise ValueError("There must be at least one worker process")
+
+        self._n_processes = min(n_processes, len(rois))
+        self._tracker_class = tracker_class
+        self._tracker_args = args
+        self._tracker_kwargs = kwargs
+        self._workers = []
+        self._connections = []
+        self._shards = []
+        self._shared_frame = None
+        self._shared_frame_buffer = None
+
+        super(ParallelMonitor, self).__init__(camera, _RemoteTracker, rois, stimulators)
+
+    @property
+    def n_processes(self):
+        """
+        :return: The number of worker processes used for tracking
+        :rtype: int
+        """
+        return self._n_processes
+
+    def _start_workers(self, frame):
+        if frame.dtype != np.uint8:
+            raise EthoscopeException("Parallel tracking only supports `uint8` frames", frame)
+
+        self._shared_frame_buffer = multiprocessing.RawArray(ctypes.c_uint8, frame.size)
+        self._shared_frame = np.frombuffer(self._shared_frame_buffer, dtype=np.uint8).reshape(frame.shape)
+
+        unit_indices = range(len(self._unit_trackers))
+        self._shards = [unit_indices[i::self._n_processes] for i in range(self._n_processes)]
+
+        for shard in self._shards:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            rois = [self._unit_trackers[i].roi for i in shard]
+            w = _TrackingWorker(self._tracker_class, rois, self._shared_frame_buffer, frame.shape, child_conn,
+                                *self._tracker_args, **self._tracker_kwargs)
+            w.daemon = True
+            w.start()
+            child_conn.close()
+            self._workers.append(w)
+            self._connections.append(parent_conn)
+        logging.info("Started %i tracking processes" % len(self._workers))
+
+    def _stop_workers(self):
+        for c in self._connections:
+            try:
+                c.send(None)
+            except (IOError, EOFError):
+                pass
+        for w in self._workers:
+            w.join(10)
+            if w.is_alive():
+                logging.warning("Tracking process did not stop. Terminating it")
+                w.terminate()
+        for c in self._connections:
+            c.close()
+        self._workers = []
+        self._connections = []
+        self._shared_frame = None
+        logging.info("Tracking processes stopped")
+
+    def _track_units(self, t, frame):
+        if self._shared_frame is None:
+            self._start_workers(frame)
+
+        if frame.shape != self._shared_frame.shape:
+            raise EthoscopeException("Frame shape changed during parallel tracking", frame)
+
+        np.copyto(self._shared_frame, frame)
+
+        for c in self._connections:
+            c.send(t)
+
+        # we wait for all workers before yielding anything, so the shared frame is not overwritten whilst in use
+        all_points = [None] * len(self._unit_trackers)
+        for c, shard in zip(self._connections, self._shards):
+            status, out = c.recv()
+            if status != "ok":
+                raise EthoscopeException("A tracking process failed:\n%s" % out)
+            for i, points_skipped in zip(shard, out):
+                all_points[i] = points_skipped
+
+        for track_u, (points, skipped) in zip(self._unit_trackers, all_points):
+            track_u.tracker.set_next_points(points, skipped)
+            yield track_u, track_u.track(t, frame)
+
+    def run(self, result_writer = None, drawer = None):
+        try:
+            super(ParallelMonitor, self).run(result_writer, drawer)
+        finally:
+            self._stop_workers()
@@ -0,0 +1,317 @@
+__author__ = 'quentin'
+
+import collections
+import logging
+import sys
+import threading
+import traceback
+
+from ethoscope.core.monitor import Monitor
+
+
+class StageQueue(object):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    _policies = {BLOCK, DROP_OLDEST, DROP_NEWEST}
+
+    class _End(object):
+        pass
+    END = _End()
+
+    def __init__(self, name, maxsize=8, overflow_policy=BLOCK):
+        """
+        A bounded, thread safe, queue connecting two stages of a :class:`~ethoscope.core.pipelined_monitor.PipelinedMonitor`.
+        When it is full, new items are handled according to an overflow policy:
+
+        * ``"block"``: the producer waits until there is room in the queue.
+        * ``"drop_oldest"``: the oldest item in the queue is discarded.
+        * ``"drop_newest"``: the new item is discarded.
+
+        The queue also keeps counters (see :attr:`~ethoscope.core.pipelined_monitor.StageQueue.stats`).
+
+        :param name: the name of the stage consuming this queue
+        :type name: str
+        :param maxsize: the maximal number of items in the queue
+        :type maxsize: int
+        :param overflow_policy: what to do when the queue is full
+        :type overflow_policy: str
+        """
+        if overflow_policy not in self._policies:
+            raise ValueError("Unknown overflow policy '%s'. Possible values are %s" % (overflow_policy, sorted(self._policies)))
+        if maxsize < 1:
+            raise ValueError("Queues must have a size of at least one")
+        self._name = name
+        self._maxsize = maxsize
+        self._overflow_policy = overflow_policy
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._aborted = False
+
+        self._n_put = 0
+        self._n_got = 0
+        self._n_dropped = 0
+        self._max_depth = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def stats(self):
+        """
+        :return: The counters of this queue: its current and maximal depth, its capacity, the number of items
+            put, got and dropped, and the overflow policy.
+        :rtype: dict
+        """
+        with self._condition:
+            return {"depth": len(self._items),
+                    "max_depth": self._max_depth,
+                    "capacity": self._maxsize,
+                    "n_put": self._n_put,
+                    "n_got": self._n_got,
+                    "n_dropped": self._n_dropped,
+                    "overflow_policy": self._overflow_policy}
+
+    def put(self, item):
+        """
+        Add an item to the queue, applying the overflow policy if it is full.
+
+        :param item: the item to add
+        :return: whether the item was added to the queue
+        :rtype: bool
+        """
+        with self._condition:
+            while len(self._items) >= self._maxsize and not self._aborted:
+                if self._overflow_policy == self.DROP_NEWEST:
+                    self._n_dropped += 1
+                    return False
+                elif self._overflow_policy == self.DROP_OLDEST:
+                    self._items.popleft()
+                    self._n_dropped += 1
+                else:
+                    self._condition.wait(1)
+
+            if self._aborted:
+                return False
+            self._items.append(item)
+            self._n_put += 1
+            self._max_depth = max(self._max_depth, len(self._items))
+            self._condition.notify_all()
+            return True
+
+    def get(self):
+        """
+        Wait for, and remove, the next item of the queue.
+
+        :return: the next item, or :attr:`~ethoscope.core.pipelined_monitor.StageQueue.END` if the queue is closed and empty
+            (or aborted).
+        """
+        with self._condition:
+            while len(self._items) == 0 and not self._closed and not self._aborted:
+                self._condition.wait(1)
+            if self._aborted or len(self._items) == 0:
+                return self.END
+            item = self._items.popleft()
+            self._n_got += 1
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """
+        Signal that no more item will be put. Consumers get the remaining items and then ``END``.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def abort(self):
+        """
+        Stop the queue immediately. Pending items are discarded, and both producers and consumers are released.
+        """
+        with self._condition:
+            self._aborted = True
+            self._items.clear()
+            self._condition.notify_all()
+
+
+class PipelinedMonitor(Monitor):
+    _default_overflow_policies = {"track": StageQueue.BLOCK,
+                                  "write": StageQueue.BLOCK,
+                                  "draw": StageQueue.DROP_OLDEST}
+
+    def __init__(self, camera, tracker_class,
+                 rois = None, stimulators=None, max_queue_size=8, overflow_policies=None,
+                 *args, **kwargs  # extra arguments for the tracker objects
+                 ):
+        r"""
+        A monitor in which acquisition, tracking, result writing and drawing are separate stages running concurrently.
+        Stages are connected by bounded queues (:class:`~ethoscope.core.pipelined_monitor.StageQueue`),
+        so that a slow stage (e.g. drawing or writing) does not stall frame acquisition.
+        Tracking and stimulation happen, for all ROIs, in the thread calling
+        :meth:`~ethoscope.core.pipelined_monitor.PipelinedMonitor.run`.
+
+        Frames are copied when acquired, as cameras may reuse the same buffer for the next frame.
+
+        :param camera: a camera object responsible of acquiring frames and associated time stamps
+        :type camera: :class:`~ethoscope.hardware.input.cameras.BaseCamera`
+        :param tracker_class: The algorithm that will be used for tracking. It must inherit from :class:`~ethoscope.trackers.trackers.BaseTracker`
+        :type tracker_class: class
+        :param rois: A list of region of interest.
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param stimulators: The class that will be used to analyse the position of the object and interact with the system/hardware.
+        :type stimulators: list(:class:`~ethoscope.stimulators.stimulators.BaseInteractor`
+        :param max_queue_size: The capacity of each queue, in frames.
+        :type max_queue_size: int
+        :param overflow_policies: The overflow policy of the queues feeding the "track", "write" and "draw" stages.
+            Missing stages use the default policies: "block" for tracking and writing and "drop_oldest" for drawing.
+        :type overflow_policies: dict
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        policies = self._default_overflow_policies.copy()
+        if overflow_policies is not None:
+            for k in overflow_policies.keys():
+                if k not in policies:
+                    raise ValueError("Unknown stage '%s'. Possible stages are %s" % (k, sorted(policies.keys())))
+            policies.update(overflow_policies)
+
+        self._max_queue_size = max_queue_size
+        self._overflow_policies = policies
+        self._queues = None
+        self._make_queues()
+
+        self._stage_errors = []
+        super(PipelinedMonitor, self).__init__(camera, tracker_class, rois, stimulators, *args, **kwargs)
+
+    def _make_queues(self):
+        self._queues = collections.OrderedDict()
+        for name in ["track", "write", "draw"]:
+            self._queues[name] = StageQueue(name, self._max_queue_size, self._overflow_policies[name])
+
+    @property
+    def queue_stats(self):
+        """
+        :return: The counters of the queue feeding each stage (see :attr:`~ethoscope.core.pipelined_monitor.StageQueue.stats`).
+            A queue that is often full indicates that its stage is a bottleneck.
+        :rtype: dict
+        """
+        return dict([(name, q.stats) for name, q in self._queues.items()])
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except Exception:
+            self._stage_errors.append(sys.exc_info())
+            logging.error("Pipeline stage failed:\n%s" % traceback.format_exc())
+            self._force_stop = True
+            for q in self._queues.values():
+                q.abort()
+
+    def _acquire(self):
+        queue = self._queues["track"]
+        try:
+            for i, (t, frame) in enumerate(self._camera):
+                if self._force_stop:
+                    logging.info("Monitor object stopped from external request")
+                    break
+                queue.put((i, t, frame.copy()))
+        finally:
+            queue.close()
+
+    def _track(self, result_writer, drawer):
+        try:
+            while True:
+                item = self._queues["track"].get()
+                if item is StageQueue.END or self._force_stop:
+                    break
+                i, t, frame = item
+                self._last_frame_idx = i
+                self._last_time_stamp = t
+                self._frame_buffer = frame
+
+                results = []
+                for track_u, data_rows in self._track_units(t, frame):
+                    if len(data_rows) == 0:
+                        self._last_positions[track_u.roi.idx] = []
+                        continue
+                    self._last_positions[track_u.roi.idx] = track_u.get_last_positions(absolute=True)
+                    # trackers may modify these data points later (e.g. when inferring positions), so we pass copies
+                    results.append((track_u.roi, [dr.copy() for dr in data_rows]))
+
+                if result_writer is not None:
+                    self._queues["write"].put((t, frame, results))
+                if drawer is not None:
+                    self._queues["draw"].put((frame, dict(self._last_positions)))
+                self._last_t = t
+        finally:
+            # releases the acquisition stage, in case it is waiting for room in the queue
+            self._queues["track"].abort()
+            self._queues["write"].close()
+            self._queues["draw"].close()
+
+    def _write(self, result_writer):
+        queue = self._queues["write"]
+        while True:
+            item = queue.get()
+            if item is StageQueue.END:
+                break
+            t, frame, results = item
+            for roi, data_rows in results:
+                result_writer.write(t, roi, data_rows)
+            result_writer.flush(t, frame)
+
+    def _draw(self, drawer):
+        queue = self._queues["draw"]
+        while True:
+            item = queue.get()
+            if item is StageQueue.END:
+                break
+            frame, positions = item
+            drawer.draw(frame, positions, self._unit_trackers)
+
+    def run(self, result_writer = None, drawer = None):
+        """
+        Runs the monitor indefinitely, with each stage in its own thread.
+
+        :param result_writer: A result writer used to control how data are saved. `None` means no results will be saved.
+        :type result_writer: :class:`~ethoscope.utils.io.ResultWriter`
+        :param drawer: A drawer to plot the data on frames, display frames and/or save videos. `None` means none of the aforementioned actions will performed.
+        :type drawer: :class:`~ethoscope.drawers.drawers.BaseDrawer`
+        """
+        threads = [threading.Thread(target=self._run_stage, args=(self._acquire,), name="acquire")]
+        if result_writer is not None:
+            threads.append(threading.Thread(target=self._run_stage, args=(self._write, result_writer), name="write"))
+        if drawer is not None:
+            threads.append(threading.Thread(target=self._run_stage, args=(self._draw, drawer), name="draw"))
+
+        try:
+            logging.info("Pipelined monitor starting a run")
+            self._is_running = True
+            self._stage_errors = []
+            self._make_queues()
+            for th in threads:
+                th.daemon = True
+                th.start()
+
+            self._run_stage(self._track, result_writer, drawer)
+
+            for th in threads:
+                th.join()
+
+            if len(self._stage_errors) > 0:
+                exc_type, exc_value, exc_tb = self._stage_errors[0]
+                raise exc_type, exc_value, exc_tb
+
+        except Exception as e:
+            logging.error("Monitor closing with an exception: '%s'" % traceback.format_exc(e))
+            raise e
+
+        finally:
+            # stops the other stages if the tracking stage was interrupted
+            for q in self._queues.values():
+                q.abort()
+            self._is_running = False
+            logging.info("Queue statistics: %s" % str(self.queue_stats))
+            logging.info("Monitor closing")
@@ -141,7 +141,8 @@ class ROI(object):
         """
         Cut an image where the ROI is defined.
 
-        :param img: An image. Typically either one or three channels `uint8`.
+        :param img: An image. Typically either one (greyscale) or three (BGR) channels `uint8`.
+            The result has the same number of channels, and is a view (not a copy) of the image.
         :type img: :class:`~numpy.ndarray`
         :return: a tuple containing the resulting cropped image and the associated mask (both have the same dimension).
         :rtype: (:class:`~numpy.ndarray`, :class:`~numpy.ndarray`)
@@ -0,0 +1,284 @@
+__author__ = 'quentin'
+
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import traceback
+
+import cv2
+try:
+    from cv2.cv import CV_CAP_PROP_FRAME_COUNT as CAP_PROP_FRAME_COUNT
+    from cv2.cv import CV_CAP_PROP_POS_MSEC as CAP_PROP_POS_MSEC
+    from cv2.cv import CV_CAP_PROP_POS_FRAMES as CAP_PROP_POS_FRAMES
+    from cv2.cv import CV_CAP_PROP_FPS as CAP_PROP_FPS
+except ImportError:
+    from cv2 import CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_POS_FRAMES, CAP_PROP_FPS
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.io import SQLiteResultWriter
+
+
+class _SegmentResultWriter(SQLiteResultWriter):
+    def __init__(self, db_credentials, rois, start_t=None, end_t=None, *args, **kwargs):
+        """
+        A result writer that only saves data within a time segment, ``start_t <= t < end_t``.
+        Data acquired before the segment (i.e. during warm-up) or after it are ignored.
+
+        :param db_credentials: the path to the result file
+        :type db_credentials: str
+        :param rois: the ROIs to track
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param start_t: the start of the segment, in ms. `None` means the start of the video.
+        :type start_t: int
+        :param end_t: the end of the segment, in ms (excluded). `None` means the end of the video.
+        :type end_t: int
+        :param args: additional arguments passed to :class:`~ethoscope.utils.io.SQLiteResultWriter`
+        :param kwargs: additional keyword arguments passed to :class:`~ethoscope.utils.io.SQLiteResultWriter`
+        """
+        self._start_t = start_t
+        self._end_t = end_t
+        super(_SegmentResultWriter, self).__init__(db_credentials, rois, *args, **kwargs)
+
+    def _in_segment(self, t):
+        if self._start_t is not None and t < self._start_t:
+            return False
+        if self._end_t is not None and t >= self._end_t:
+            return False
+        return True
+
+    def write(self, t, roi, data_rows):
+        if self._in_segment(t):
+            super(_SegmentResultWriter, self).write(t, roi, data_rows)
+
+    def flush(self, t, img=None):
+        if self._in_segment(t):
+            return super(_SegmentResultWriter, self).flush(t, img)
+        return False
+
+
+class _SegmentWorker(multiprocessing.Process):
+    def __init__(self, video_path, rois, tracker_class, result_file, start_frame, start_t, end_t,
+                 camera_kwargs, result_writer_kwargs, *args, **kwargs):
+        """
+        A process that tracks one segment of a video and saves the results in its own file.
+
+        :param video_path: the path to the video file
+        :type video_path: str
+        :param rois: the ROIs to track
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param tracker_class: The algorithm that will be used for tracking.
+        :type tracker_class: class
+        :param result_file: the path to the result file of this segment
+        :type result_file: str
+        :param start_frame: the first frame to read (i.e. the start of the warm-up)
+        :type start_frame: int
+        :param start_t: the start of the segment, in ms. `None` means the start of the video.
+        :type start_t: int
+        :param end_t: the end of the segment, in ms. `None` means the end of the video.
+        :type end_t: int
+        :param camera_kwargs: additional keyword arguments passed to :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera`
+        :type camera_kwargs: dict
+        :param result_writer_kwargs: additional keyword arguments passed to the result writer
+        :type result_writer_kwargs: dict
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        self._video_path = video_path
+        self._rois = rois
+        self._tracker_class = tracker_class
+        self._result_file = result_file
+        self._start_frame = start_frame
+        self._start_t = start_t
+        self._end_t = end_t
+        self._camera_kwargs = camera_kwargs
+        self._result_writer_kwargs = result_writer_kwargs
+        self._tracker_args = args
+        self._tracker_kwargs = kwargs
+        super(_SegmentWorker, self).__init__()
+
+    def run(self):
+        camera = None
+        try:
+            max_duration = None
+            if self._end_t is not None:
+                max_duration = self._end_t / 1e3
+            camera = MovieVirtualCamera(self._video_path, start_frame=self._start_frame, max_duration=max_duration,
+                                        **self._camera_kwargs)
+            monit = Monitor(camera, self._tracker_class, self._rois, *self._tracker_args, **self._tracker_kwargs)
+            with _SegmentResultWriter(self._result_file, self._rois, self._start_t, self._end_t,
+                                      **self._result_writer_kwargs) as rw:
+                monit.run(rw)
+        except Exception as e:
+            logging.error("Segment analysis failed: %s" % traceback.format_exc(e))
+            raise e
+        finally:
+            if camera is not None:
+                camera._close()
+
+
+def merge_result_files(segment_files, result_file):
+    """
+    Stitch the SQLite result files of consecutive segments into a single result file, with the same table layout.
+    The data tables (e.g. ``ROI_1``, ``ROI_2``, ...) of all segments are concatenated, in order.
+    The other tables (``ROI_MAP``, ``VAR_MAP``, ``METADATA`` and ``START_EVENTS``) are taken from the first segment,
+    except the stop time in ``METADATA``, which is the one of the last segment.
+
+    :param segment_files: the result files of each segment, in chronological order
+    :type segment_files: list(str)
+    :param result_file: the path to the merged result file
+    :type result_file: str
+    """
+    single_tables = {"ROI_MAP", "VAR_MAP", "METADATA", "START_EVENTS"}
+    shutil.copyfile(segment_files[0], result_file)
+    conn = sqlite3.connect(result_file)
+    try:
+        for f in segment_files[1:]:
+            conn.execute("ATTACH DATABASE ? AS segment", (f,))
+            existing = set([r[0] for r in conn.execute("SELECT name FROM main.sqlite_master WHERE type='table'")])
+            tables = conn.execute("SELECT name, sql FROM segment.sqlite_master WHERE type='table'").fetchall()
+            for name, sql in tables:
+                if name not in existing:
+                    conn.execute(sql)
+                elif name in single_tables:
+                    # a segment without any data has an empty VAR_MAP
+                    if name != "VAR_MAP" or conn.execute("SELECT COUNT(*) FROM main.VAR_MAP").fetchone()[0] > 0:
+                        continue
+                conn.execute("INSERT INTO main.%s SELECT * FROM segment.%s" % (name, name))
+
+            if "METADATA" in existing:
+                stop = conn.execute("SELECT value FROM segment.METADATA WHERE field = 'stop_date_time'").fetchone()
+                if stop is not None:
+                    conn.execute("UPDATE main.METADATA SET value = ? WHERE field = 'stop_date_time'", stop)
+            conn.commit()
+            conn.execute("DETACH DATABASE segment")
+    finally:
+        conn.close()
+
+
+class SegmentedVideoAnalysis(object):
+    def __init__(self, video_path, tracker_class, rois, n_segments=None, n_processes=None, warm_up_duration=300,
+                 camera_kwargs=None,
+                 *args, **kwargs  # extra arguments for the tracker objects
+                 ):
+        r"""
+        Offline analysis of a single (long) video, in which time segments of the video are tracked in parallel processes.
+        Each segment starts with a warm-up period, overlapping the previous segment,
+        so that the adaptive models of the trackers (background, object model, ...) converge before the segment starts.
+        Data from the warm-up period are discarded. Then, the results of all segments are stitched into one result file,
+        with the same tables as :class:`~ethoscope.utils.io.SQLiteResultWriter` would produce.
+
+        Results can slightly differ from a sequential analysis, as, at the start of each segment, the state of the
+        trackers is the one reached after the warm-up, rather than after the whole previous part of the video.
+
+        :param video_path: the path to the video file. Its number of frames must be known.
+        :type video_path: str
+        :param tracker_class: The algorithm that will be used for tracking. It must inherit from :class:`~ethoscope.trackers.trackers.BaseTracker`
+        :type tracker_class: class
+        :param rois: A list of region of interest (e.g. built from the first frames of the video).
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param n_segments: The number of segments. `None` means one per process.
+        :type n_segments: int
+        :param n_processes: The maximal number of segments analysed simultaneously. `None` means one per CPU core.
+        :type n_processes: int
+        :param warm_up_duration: The duration of the warm-up before each segment, in seconds.
+        :type warm_up_duration: float
+        :param camera_kwargs: additional keyword arguments passed to :class:`~ethoscope.hardware.input.cameras.MovieVirtualCamera` (e.g. ``drop_each``)
+        :type camera_kwargs: dict
+        :param args: additional arguments passed to the tracking algorithm
+        :param kwargs: additional keyword arguments passed to the tracking algorithm
+        """
+        if n_processes is None:
+            n_processes = multiprocessing.cpu_count()
+        if n_segments is None:
+            n_segments = n_processes
+        if n_processes < 1 or n_segments < 1:
+            raise ValueError("There must be at least one segment and one process")
+
+        self._video_path = video_path
+        self._tracker_class = tracker_class
+        self._rois = rois
+        self._n_segments = n_segments
+        self._n_processes = n_processes
+        self._warm_up_duration = warm_up_duration
+        self._camera_kwargs = camera_kwargs if camera_kwargs is not None else {}
+        self._tracker_args = args
+        self._tracker_kwargs = kwargs
+
+    def _segments(self):
+        capture = cv2.VideoCapture(self._video_path)
+        try:
+            n_frames = int(capture.get(CAP_PROP_FRAME_COUNT))
+            fps = capture.get(CAP_PROP_FPS)
+            if n_frames <= 0 or fps <= 0:
+                raise EthoscopeException("Cannot split '%s' in segments: unknown number of frames" % self._video_path)
+
+            boundaries = [n_frames * i // self._n_segments for i in range(self._n_segments)]
+            # the time stamps of the first frame of each segment, as `MovieVirtualCamera` would yield them
+            start_ts = [None]
+            for b in boundaries[1:]:
+                capture.set(CAP_PROP_POS_FRAMES, b - 1)
+                capture.grab()
+                start_ts.append(int(1000 * (capture.get(CAP_PROP_POS_MSEC) / 1e3)))
+        finally:
+            capture.release()
+
+        warm_up_frames = int(self._warm_up_duration * fps)
+        end_ts = start_ts[1:] + [None]
+        return [(max(0, b - warm_up_frames), s, e) for b, s, e in zip(boundaries, start_ts, end_ts)]
+
+    def run(self, result_file, *args, **kwargs):
+        """
+        Analyses all segments and saves the merged results.
+
+        :param result_file: the path to the result file (SQLite)
+        :type result_file: str
+        :param args: additional arguments passed to the result writers
+        :param kwargs: additional keyword arguments passed to the result writers (e.g. ``metadata``)
+        """
+        if len(args) > 0:
+            raise TypeError("Result writer options must be passed as keyword arguments")
+
+        tmp_dir = tempfile.mkdtemp(prefix="ethoscope_segments_")
+        workers = []
+        try:
+            segments = self._segments()
+            segment_files = []
+            for i, (start_frame, start_t, end_t) in enumerate(segments):
+                f = os.path.join(tmp_dir, "segment_%04d.db" % i)
+                segment_files.append(f)
+                workers.append(_SegmentWorker(self._video_path, self._rois, self._tracker_class, f,
+                                              start_frame, start_t, end_t, self._camera_kwargs, kwargs,
+                                              *self._tracker_args, **self._tracker_kwargs))
+
+            logging.info("Analysing %i segments in up to %i processes" % (len(workers), self._n_processes))
+            pending = list(workers)
+            running = []
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < self._n_processes:
+                    w = pending.pop(0)
+                    w.start()
+                    running.append(w)
+                for w in list(running):
+                    if w.is_alive():
+                        continue
+                    w.join()
+                    running.remove(w)
+                    if w.exitcode != 0:
+                        raise EthoscopeException("The analysis of a segment failed (exit code %s)" % str(w.exitcode))
+                time.sleep(.1)
+
+            logging.info("Merging segment results in %s" % result_file)
+            merge_result_files(segment_files, result_file)
+
+        finally:
+            for w in workers:
+                if w.is_alive():
+                    w.terminate()
+                    w.join()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -41,6 +41,14 @@ class TrackingUnit(object):
         """
         return self._stimulator
 
+    @property
+    def tracker(self):
+        """
+        :return: A reference to the tracker used by this `TrackingUnit`
+        :rtype: :class:`~ethoscope.trackers.trackers.BaseTracker`
+        """
+        return self._tracker
+
     @property
     def roi(self):
         """
@@ -60,7 +60,7 @@ class BaseDrawer(object):
         """
         Draw results on a frame.
 
-        :param img: the frame that was just processed
+        :param img: the frame that was just processed. Either a BGR or a greyscale image.
         :type img: :class:`~numpy.ndarray`
         :param positions: a list of positions resulting from analysis of the frame by a tracker
         :type positions: list(:class:`~ethoscope.core.data_point.DataPoint`)
@@ -69,7 +69,11 @@ class BaseDrawer(object):
         :return:
         """
 
-        self._last_drawn_frame = img.copy()
+        if len(img.shape) == 2:
+            # single channel frames are converted, so annotations can be coloured
+            self._last_drawn_frame = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        else:
+            self._last_drawn_frame = img.copy()
 
         self._annotate_frame(self._last_drawn_frame, positions,tracking_units)
 
@@ -1,2 +1,3 @@
 __author__ = 'quentin'
-import cameras
\ No newline at end of file
+import cameras
+import frame_ring
@@ -6,35 +6,76 @@ try:
     from cv2.cv import CV_CAP_PROP_FRAME_HEIGHT as CAP_PROP_FRAME_HEIGHT
     from cv2.cv import CV_CAP_PROP_FRAME_COUNT as CAP_PROP_FRAME_COUNT
     from cv2.cv import CV_CAP_PROP_POS_MSEC as CAP_PROP_POS_MSEC
+    from cv2.cv import CV_CAP_PROP_POS_FRAMES as CAP_PROP_POS_FRAMES
     from cv2.cv import CV_CAP_PROP_FPS as CAP_PROP_FPS
 
 except ImportError:
-    from cv2 import CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_FPS
+    from cv2 import CAP_PROP_FRAME_WIDTH, CAP_PROP_FRAME_HEIGHT, CAP_PROP_FRAME_COUNT, CAP_PROP_POS_MSEC, CAP_PROP_POS_FRAMES, CAP_PROP_FPS
 
 import time
 import logging
 import os
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.hardware.input.frame_ring import SharedFrameRing
 import multiprocessing
+import threading
 import traceback
 
+try:
+    from time import monotonic as monotonic_time
+except ImportError:
+    # python 2 has no monotonic clock in the standard library
+    import ctypes
+    import ctypes.util
+
+    class _TimeSpec(ctypes.Structure):
+        _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+    _CLOCK_MONOTONIC = 1
+    try:
+        _clock_gettime = ctypes.CDLL(ctypes.util.find_library("rt") or "librt.so.1", use_errno=True).clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_TimeSpec)]
+    except (OSError, AttributeError):
+        _clock_gettime = None
+
+    def monotonic_time():
+        """
+        :return: The time, in seconds, of a monotonic clock (i.e. that is not affected by system time updates).
+            It is shared between processes, so it can be used to compare time stamps from different processes.
+            It falls back to the wall clock if no monotonic clock is available.
+        :rtype: float
+        """
+        if _clock_gettime is None:
+            return time.time()
+        ts = _TimeSpec()
+        if _clock_gettime(_CLOCK_MONOTONIC, ctypes.pointer(ts)) != 0:
+            return time.time()
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+
+
 class BaseCamera(object):
     capture = None
     _resolution = None
     _frame_idx = 0
+    _frame_seq = -1
+    _n_dropped_frames = 0
 
-    def __init__(self,drop_each=1, max_duration=None, *args, **kwargs):
+    def __init__(self,drop_each=1, max_duration=None, greyscale=False, *args, **kwargs):
         """
         The template class to generate and use video streams.
 
-        :param drop_each: keep only ``1/drop_each``'th frame
+        :param drop_each: keep only ``1/drop_each``'th frame. Other frames are skipped without being decoded, when the source allows it.
         :param max_duration: stop the video stream if ``t > max_duration`` (in seconds).
+        :param greyscale: whether frames are single channel (greyscale) images, rather than BGR images.
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
 
         self._drop_each = drop_each
         self._max_duration = max_duration
+        self._greyscale = greyscale
+        self._frame_seq = -1
+        self._n_dropped_frames = 0
 
     def __exit__(self):
         logging.info("Closing camera")
@@ -55,14 +96,18 @@ class BaseCamera(object):
                 if not at_least_one_frame:
                     raise EthoscopeException("Camera could not read the first frame")
                 break
+            if (self._frame_idx + 1) % self._drop_each != 0:
+                if not self._skip_image():
+                    break
+                continue
+
             t,out = self._next_time_image()
             if out is None:
                 break
             t_ms = int(1000*t)
             at_least_one_frame = True
 
-            if (self._frame_idx % self._drop_each) == 0:
-                yield t_ms,out
+            yield t_ms,out
 
             if self._max_duration is not None and t > self._max_duration:
                 break
@@ -76,6 +121,31 @@ class BaseCamera(object):
         """
         return self._resolution
 
+    @property
+    def frame_seq(self):
+        """
+        :return: The sequence number, given by the source, of the last acquired frame (-1 before the first frame).
+        :rtype: int
+        """
+        return self._frame_seq
+
+    @property
+    def n_dropped_frames(self):
+        """
+        :return: The number of frames that were captured by the source but never reached this camera object
+            (e.g. because the consumer was too slow). They are inferred from gaps in the frame sequence numbers.
+        :rtype: int
+        """
+        return self._n_dropped_frames
+
+    @property
+    def greyscale(self):
+        """
+        :return: Whether the frames are single channel (greyscale) images, rather than BGR images.
+        :rtype: bool
+        """
+        return self._greyscale
+
     @property
     def width(self):
         """
@@ -93,11 +163,38 @@ class BaseCamera(object):
         return self._resolution[1]
 
     def _next_time_image(self):
+        """
+        Acquire the next frame, along with its time stamp.
+        Sources that know when, and in which order, frames were captured override this method
+        and call :meth:`~ethoscope.hardware.input.cameras.BaseCamera._register_frame` with the sequence number of each frame.
+
+        :return: the time (in s) at which the frame was captured and the frame.
+        :rtype: (float, :class:`~numpy.ndarray`)
+        """
         time = self._time_stamp()
         im = self._next_image()
-        self._frame_idx += 1
+        self._register_frame(self._frame_idx)
         return time, im
 
+    def _skip_image(self):
+        """
+        Move past the next frame, which will not be used (see ``drop_each``).
+        By default, the frame is acquired and discarded. Sources that can skip a frame without decoding it override this method.
+
+        :return: Whether a frame was skipped. `False` means the stream has ended.
+        :rtype: bool
+        """
+        _, im = self._next_time_image()
+        return im is not None
+
+    def _register_frame(self, sequence_number):
+        if self._frame_seq >= 0:
+            gap = sequence_number - self._frame_seq - 1
+            if gap > 0:
+                self._n_dropped_frames += gap
+        self._frame_seq = sequence_number
+        self._frame_idx += 1
+
     def is_last_frame(self):
         raise NotImplementedError
 
@@ -122,10 +219,11 @@ class MovieVirtualCamera(BaseCamera):
     _description = {"overview":  "Class to acquire frames from a video file.",
                     "arguments": [
                                     {"type": "filepath", "name": "path", "description": "The path to the video file to use as virtual camera","default":"/home/gg/Desktop/demo_monitor_x5.avi.mp4"},
+                                    {"type": "number", "min": 0, "max": 64, "step": 1, "name": "prefetch", "description": "The number of frames decoded ahead, in a background thread. 0 decodes frames on demand","default":0},
                                    ]}
                                    
 
-    def __init__(self, path, use_wall_clock = False, *args, **kwargs ):
+    def __init__(self, path, use_wall_clock = False, prefetch=0, start_frame=0, *args, **kwargs ):
         """
         Class to acquire frames from a video file.
 
@@ -134,6 +232,13 @@ class MovieVirtualCamera(BaseCamera):
         :param use_wall_clock: whether to use the real time from the machine (True) or from the video file (False).\
             The former can be useful for prototyping.
         :type use_wall_clock: bool
+        :param prefetch: the number of frames to decode ahead. When greater than 0, a background thread decodes frames
+            (and reads their time stamps) into a ring of preallocated frames
+            (:class:`~ethoscope.hardware.input.frame_ring.SharedFrameRing`), so that decoding overlaps with tracking.
+            The returned frame is then a slot of the ring, which is valid until the next frame is requested.
+        :type prefetch: int
+        :param start_frame: the index of the first frame to read. Frames are indexed and time stamped as if the video was read from its start.
+        :type start_frame: int
         :param args: additional arguments.
         :param kwargs: additional keyword arguments.
         """
@@ -142,6 +247,8 @@ class MovieVirtualCamera(BaseCamera):
         self._frame_idx = 0
         self._path = path
         self._use_wall_clock = use_wall_clock
+        self._prefetch = prefetch
+        self._start_frame = start_frame
 
 
         if not (isinstance(path, str) or isinstance(path, unicode)):
@@ -161,6 +268,13 @@ class MovieVirtualCamera(BaseCamera):
 
         self._resolution = (int(w),int(h))
 
+        if start_frame > 0:
+            # The time stamp of the first frame after seeking is wrong.
+            # So we seek to the frame before and grab it (time stamps are read before each frame)
+            self.capture.set(CAP_PROP_POS_FRAMES, start_frame - 1)
+            self.capture.grab()
+            self._frame_idx = start_frame
+
         super(MovieVirtualCamera, self).__init__(*args, **kwargs)
 
         # emulates v4l2 (real time camera) from video file
@@ -169,6 +283,70 @@ class MovieVirtualCamera(BaseCamera):
         else:
             self._start_time = 0
 
+        self._decoder = None
+        if self._prefetch > 0:
+            self._start_decoder()
+
+    def _start_decoder(self):
+        if self._greyscale:
+            frame_shape = (self._resolution[1], self._resolution[0])
+        else:
+            frame_shape = (self._resolution[1], self._resolution[0], 3)
+        # one more slot than prefetched frames, as the frame in use holds a slot
+        self._frame_ring = SharedFrameRing(frame_shape, self._prefetch + 1)
+        self._decoder_stop = threading.Event()
+        self._decoder_done = threading.Event()
+        self._decoder_error = None
+        self._decoder = threading.Thread(target=self._decode, args=(self._frame_idx,), name="movie_decoder")
+        self._decoder.daemon = True
+        self._decoder.start()
+
+    def _stop_decoder(self):
+        if self._decoder is None:
+            return
+        self._decoder_stop.set()
+        self._decoder.join()
+        self._frame_ring.release()
+        self._decoder = None
+
+    def _decode(self, i):
+        # runs in the decoder thread. Frames are skipped or decoded in the same order as `BaseCamera.__iter__` would
+        try:
+            while not self._decoder_stop.is_set():
+                if (i + 1) % self._drop_each != 0:
+                    if not self.capture.grab():
+                        break
+                    i += 1
+                    continue
+
+                time_s = self.capture.get(CAP_PROP_POS_MSEC) / 1e3
+                _, frame = self.capture.read()
+                if frame is None:
+                    break
+                if self._greyscale:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                while not self._frame_ring.put(frame, time_s, i, timeout=0.5):
+                    if self._decoder_stop.is_set():
+                        return
+                i += 1
+        except Exception as e:
+            logging.error("Movie decoder failed: %s" % traceback.format_exc(e))
+            self._decoder_error = e
+        finally:
+            self._decoder_done.set()
+
+    def _next_prefetched(self):
+        while True:
+            out = self._frame_ring.get(timeout=0.5)
+            if out is not None:
+                return out
+            if self._decoder_done.is_set():
+                # the last frames may have been put between our timeout and the end of the decoder
+                out = self._frame_ring.get(timeout=0)
+                if out is None and self._decoder_error is not None:
+                    raise EthoscopeException("Could not decode video: %s" % str(self._decoder_error))
+                return out
+
     @property
     def start_time(self):
         return self._start_time
@@ -181,11 +359,40 @@ class MovieVirtualCamera(BaseCamera):
         return True
 
     def restart(self):
-        self.__init__(self._path, use_wall_clock=self._use_wall_clock, drop_each=self._drop_each, max_duration = self._max_duration)
+        self._stop_decoder()
+        self.capture.release()
+        self.__init__(self._path, use_wall_clock=self._use_wall_clock, prefetch=self._prefetch, start_frame=self._start_frame, drop_each=self._drop_each,
+                      max_duration = self._max_duration, greyscale=self._greyscale)
+
+    def _next_time_image(self):
+        if self._decoder is None:
+            return super(MovieVirtualCamera, self)._next_time_image()
+
+        out = self._next_prefetched()
+        if out is None:
+            return None, None
+        frame, time_s, sequence_number = out
+        self._register_frame(sequence_number)
+        if self._use_wall_clock:
+            time_s = self._time_stamp()
+        return time_s, frame
 
 
+    def _skip_image(self):
+        if self._decoder is not None:
+            # the decoder thread skips the same frames
+            self._register_frame(self._frame_idx)
+            return True
+        # grabbing without retrieving does not decode the frame
+        if not self.capture.grab():
+            return False
+        self._register_frame(self._frame_idx)
+        return True
+
     def _next_image(self):
         _, frame = self.capture.read()
+        if self._greyscale and frame is not None:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         return frame
 
     def _time_stamp(self):
@@ -201,6 +408,7 @@ class MovieVirtualCamera(BaseCamera):
         return False
 
     def _close(self):
+        self._stop_decoder()
         self.capture.release()
 
 
@@ -251,6 +459,7 @@ class V4L2Camera(BaseCamera):
             raise EthoscopeException("Error whist retrieving video frame. Got None instead. Camera not plugged?")
 
         self._frame = im
+        self._grey_frame = None
 
         assert(len(im.shape) >1)
 
@@ -263,7 +472,9 @@ class V4L2Camera(BaseCamera):
 
 
         super(V4L2Camera, self).__init__(*args, **kwargs)
+        self._capture_time = None
         self._start_time = time.time()
+        self._start_monotonic = monotonic_time()
 
     def _warm_up(self):
         logging.info("%s is warming up" % (str(self)))
@@ -271,7 +482,9 @@ class V4L2Camera(BaseCamera):
 
     def restart(self):
         self._frame_idx = 0
+        self._frame_seq = -1
         self._start_time = time.time()
+        self._start_monotonic = monotonic_time()
 
     def is_opened(self):
         return self.capture.isOpened()
@@ -280,38 +493,59 @@ class V4L2Camera(BaseCamera):
         return False
 
     def _time_stamp(self):
-        now = time.time()
+        now = monotonic_time()
         # relative time stamp
-        return now - self._start_time
+        return now - self._start_monotonic
+
+    def _next_time_image(self):
+        im = self._next_image()
+        self._register_frame(self._frame_idx)
+        # the time at which the frame was grabbed, rather than the time at which it is returned
+        return self._capture_time - self._start_monotonic, im
+
     @property
     def start_time(self):
         return self._start_time
 
     def _close(self):
         self.capture.release()
+
+    def _skip_image(self):
+        self._grab()
+        self._register_frame(self._frame_idx)
+        return True
+
     def _next_image(self):
+        self._grab()
+        self.capture.retrieve(self._frame)
+        if self._greyscale:
+            self._grey_frame = cv2.cvtColor(self._frame, cv2.COLOR_BGR2GRAY, self._grey_frame)
+            return self._grey_frame
+        return self._frame
+
+    def _grab(self):
+        # grabs the frame expected at the current frame index, without decoding it
         if self._frame_idx >0 :
-            expected_time =  self._start_time + self._frame_idx / self._target_fps
-            now = time.time()
+            expected_time =  self._start_monotonic + self._frame_idx / self._target_fps
+            now = monotonic_time()
             to_sleep = expected_time - now
             # Warnings if the fps is so high that we cannot grab fast enough
             if to_sleep < 0:
                 if self._frame_idx % 5000 == 0:
-                    logging.warning("The target FPS (%f) could not be reached. Effective FPS is about %f" % (self._target_fps, self._frame_idx/(now - self._start_time)))
+                    logging.warning("The target FPS (%f) could not be reached. Effective FPS is about %f" % (self._target_fps, self._frame_idx/(now - self._start_monotonic)))
                 self.capture.grab()
 
             # we simply drop frames until we go above expected time
             while now < expected_time:
                 self.capture.grab()
-                now = time.time()
+                now = monotonic_time()
         else:
             self.capture.grab()
-        self.capture.retrieve(self._frame)
-        return self._frame
+        self._capture_time = monotonic_time()
 
 class PiFrameGrabber(multiprocessing.Process):
 
-    def __init__(self, target_fps, target_resolution, queue,stop_queue, *args, **kwargs):
+    def __init__(self, target_fps, target_resolution, frame_ring, stop_queue, drop_each=1, *args, **kwargs):
         """
         Class to grab frames from pi camera. Designed to be used within :class:`~ethoscope.hardware.camreras.camreras.OurPiCameraAsync`
         This allows to get frames asynchronously as acquisition is a bottleneck.
@@ -320,24 +554,64 @@ class PiFrameGrabber(multiprocessing.Process):
         :type target_fps: int
         :param target_resolution: the desired resolution (w, h)
         :type target_resolution: (int, int)
-        :param queue: a queue that stores frame and makes them available to the parent process
-        :type queue: :class:`~multiprocessing.JoinableQueue`
+        :param frame_ring: a shared memory ring that stores frames and makes them available to the parent process
+        :type frame_ring: :class:`~ethoscope.hardware.input.frame_ring.SharedFrameRing`
         :param stop_queue: a queue that can stop the async acquisition
         :type stop_queue: :class:`~multiprocessing.JoinableQueue`
+        :param drop_each: only publish ``1/drop_each``'th frame. The others are discarded at the source, before any conversion.
+            The first frame is always published.
+        :type drop_each: int
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
 
-        self._queue = queue
+        self._frame_ring = frame_ring
+        self._drop_each = drop_each
         self._stop_queue = stop_queue
         self._target_fps = target_fps
         self._target_resolution = target_resolution
         super(PiFrameGrabber, self).__init__()
 
+    @classmethod
+    def frame_shape(cls, target_resolution, *args, **kwargs):
+        """
+        :param target_resolution: the desired resolution (w, h)
+        :type target_resolution: (int, int)
+        :return: the shape of the (greyscale) frames this grabber will produce
+        :rtype: (int, int)
+        """
+        w, h = target_resolution
+        return h, w
+
+    def _is_dropped(self, i):
+        return i % self._drop_each != 0
+
+    def _stop_requested(self):
+        if not self._stop_queue.empty():
+            logging.warning("The stop queue is not empty. Stop acquiring frames")
+            self._stop_queue.get()
+            self._stop_queue.task_done()
+            logging.warning("Stop Task Done")
+            return True
+        return False
+
+    def _publish(self, frame, sequence_number, time_stamp):
+        """
+        Put a frame in the ring, waiting for a free slot unless a stop is requested.
+
+        :param frame: the frame
+        :param sequence_number: the index of the frame in the stream of the camera
+        :param time_stamp: the time at which the frame was captured, from :func:`~ethoscope.hardware.input.cameras.monotonic_time`
+        :return: whether acquisition should go on
+        """
+        while not self._frame_ring.put(frame, time_stamp, sequence_number, timeout=1):
+            if self._stop_requested():
+                return False
+        return True
 
     def run(self):
         """
-        Initialise pi camera, get frames, convert them fo greyscale, and make them available in a queue.
+        Initialise pi camera, get frames, convert them fo greyscale, and make them available in a shared frame ring.
         Run stops if the _stop_queue is not empty.
         """
 
@@ -357,24 +631,26 @@ class PiFrameGrabber(multiprocessing.Process):
                 capture.framerate = self._target_fps
                 raw_capture = PiRGBArray(capture, size=self._target_resolution)
 
-                for frame in capture.capture_continuous(raw_capture, format="bgr", use_video_port=True):
-                    if not self._stop_queue.empty():
-                        logging.warning("The stop queue is not empty. Stop acquiring frames")
-
-                        self._stop_queue.get()
-                        self._stop_queue.task_done()
-                        logging.warning("Stop Task Done")
+                for i, frame in enumerate(capture.capture_continuous(raw_capture, format="bgr", use_video_port=True)):
+                    capture_time = monotonic_time()
+                    if self._stop_requested():
                         break
+                    if self._is_dropped(i):
+                        raw_capture.truncate(0)
+                        continue
+                    # the index of the frame in the encoder stream. Gaps reveal frames dropped by the camera
+                    frame_info = capture.frame
+                    sequence_number = frame_info.index if frame_info is not None and frame_info.index is not None else i
                     raw_capture.truncate(0)
                     # out = np.copy(frame.array)
                     out = cv2.cvtColor(frame.array,cv2.COLOR_BGR2GRAY)
                     #fixme here we could actually pass a JPG compressed file object (http://docs.scipy.org/doc/scipy-0.16.0/reference/generated/scipy.misc.imsave.html)
                     # This way, we would manage to get faster FPS
-                    self._queue.put(out)
+                    if not self._publish(out, sequence_number, capture_time):
+                        break
         finally:
             logging.warning("Closing frame grabber process")
             self._stop_queue.close()
-            self._queue.close()
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
 
@@ -384,10 +660,16 @@ class OurPiCameraAsync(BaseCamera):
                                    
 
     _frame_grabber_class = PiFrameGrabber
+    _n_frame_ring_slots = 4
     def __init__(self, target_fps=20, target_resolution=(1280, 960), *args, **kwargs):
         """
         Class to acquire frames from the raspberry pi camera asynchronously.
-        At the moment, frames are only greyscale images.
+        Frames are acquired as greyscale images. Unless ``greyscale=True`` is passed,
+        they are converted back to BGR images.
+        Frames are passed from the grabbing process through a ring of shared memory slots
+        (:class:`~ethoscope.hardware.input.frame_ring.SharedFrameRing`).
+        In greyscale mode, the returned frame is the shared slot itself, which is valid until the next frame is requested.
+        Frames dropped because of ``drop_each`` are discarded by the grabbing process, so they are neither converted nor passed.
 
         :param target_fps: the desired number of frames par second (FPS)
         :type target_fps: int
@@ -403,29 +685,28 @@ class OurPiCameraAsync(BaseCamera):
             raise EthoscopeException("FPS must be an integer number")
         self._args = args
         self._kwargs = kwargs
-        self._queue = multiprocessing.Queue(maxsize=1)
+        frame_shape = self._frame_grabber_class.frame_shape(target_resolution, *args, **kwargs)
+        self._frame_ring = SharedFrameRing(frame_shape, self._n_frame_ring_slots)
         self._stop_queue = multiprocessing.JoinableQueue(maxsize=1)
-        self._p = self._frame_grabber_class(target_fps,target_resolution,self._queue,self._stop_queue, *args, **kwargs)
+        self._p = self._frame_grabber_class(target_fps,target_resolution,self._frame_ring,self._stop_queue, *args, **kwargs)
         self._p.daemon = True
         self._p.start()
-        try:
-            im = self._queue.get(timeout=10)
-        except Exception as e:
+
+        out = self._frame_ring.get(timeout=10)
+        if out is None:
             logging.error("Could not get any frame from the camera")
             self._stop_queue.cancel_join_thread()
-            self._queue.cancel_join_thread()
             logging.warning("Stopping stop queue")
             self._stop_queue.close()
-            logging.warning("Stopping queue")
-            self._queue.close()
             logging.warning("Joining process")
             # we kill the frame grabber if it does not reply within 10s
             self._p.join(10)
             logging.warning("Process joined")
-            raise e
-        self._frame = cv2.cvtColor(im,cv2.COLOR_GRAY2BGR)
+            raise EthoscopeException("Could not get any frame from the camera")
+        im, _, first_frame_seq = out
         if len(im.shape) < 2:
             raise EthoscopeException("The camera image is corrupted (less that 2 dimensions)")
+        self._frame = cv2.cvtColor(im,cv2.COLOR_GRAY2BGR)
         self._resolution = (im.shape[1], im.shape[0])
         if self._resolution != target_resolution:
             if w > 0 and h > 0:
@@ -433,12 +714,17 @@ class OurPiCameraAsync(BaseCamera):
             else:
                 logging.info('Maximal effective resolution is "%s"' % str(self._resolution))
         super(OurPiCameraAsync, self).__init__(*args, **kwargs)
+        # the frame used to initialise the camera is not counted as dropped
+        self._frame_seq = first_frame_seq
         self._start_time = time.time()
+        self._start_monotonic = monotonic_time()
         logging.info("Camera initialised")
 
     def restart(self):
         self._frame_idx = 0
+        self._frame_seq = -1
         self._start_time = time.time()
+        self._start_monotonic = monotonic_time()
 
     def __getstate__(self):
         return {"args": self._args,
@@ -450,6 +736,7 @@ class OurPiCameraAsync(BaseCamera):
         self.__init__(*state["args"], **state["kwargs"])
         self._frame_idx = int(state["frame_idx"])
         self._start_time = int(state["start_time"])
+        self._start_monotonic = monotonic_time() - (time.time() - self._start_time)
 
     def is_opened(self):
         return True
@@ -459,9 +746,30 @@ class OurPiCameraAsync(BaseCamera):
         return False
 
     def _time_stamp(self):
-        now = time.time()
+        now = monotonic_time()
         # relative time stamp
-        return now - self._start_time
+        return now - self._start_monotonic
+
+    def _skip_image(self):
+        # the grabber process already discarded this frame at the source
+        if self._frame_seq < 0:
+            self._frame_idx += 1
+        else:
+            self._register_frame(self._frame_seq + 1)
+        return True
+
+    def _next_time_image(self):
+        out = self._frame_ring.get(timeout=30)
+        if out is None:
+            raise EthoscopeException("Could not get frame from camera")
+        g, capture_time, sequence_number = out
+        self._register_frame(sequence_number)
+        # the time at which the frame was captured, rather than the time at which it is dequeued
+        t = capture_time - self._start_monotonic
+        if self._greyscale:
+            return t, g
+        cv2.cvtColor(g,cv2.COLOR_GRAY2BGR,self._frame)
+        return t, self._frame
 
     @property
     def start_time(self):
@@ -470,30 +778,18 @@ class OurPiCameraAsync(BaseCamera):
     def _close(self):
         logging.info("Requesting grabbing process to stop!")
         self._stop_queue.put(None)
-        while not self._queue.empty():
-             self._queue.get()
+        self._frame_ring.release()
         logging.info("Joining stop queue")
         self._stop_queue.cancel_join_thread()
-        self._queue.cancel_join_thread()
         logging.info("Stopping stop queue")
         self._stop_queue.close()
-        logging.info("Stopping queue")
-        self._queue.close()
         logging.info("Joining process")
         self._p.join()
         logging.info("All joined ok")
 
-    def _next_image(self):
-        try:
-            g = self._queue.get(timeout=30)
-            cv2.cvtColor(g,cv2.COLOR_GRAY2BGR,self._frame)
-            return self._frame
-        except Exception as e:
-            raise EthoscopeException("Could not get frame from camera\n%s", traceback.format_exc(e))
 
-
-class DummyFrameGrabber(multiprocessing.Process):
-    def __init__(self, target_fps, target_resolution, queue, stop_queue, path, *args, **kwargs):
+class DummyFrameGrabber(PiFrameGrabber):
+    def __init__(self, target_fps, target_resolution, frame_ring, stop_queue, path, drop_each=1, *args, **kwargs):
         """
         Class to mimic the behaviour of :class:`~ethoscope.hardware.input.cameras.PiFrameGrabber`.
         This is intended for testing purposes.
@@ -503,36 +799,53 @@ class DummyFrameGrabber(multiprocessing.Process):
         :type target_fps: int
         :param target_fps: the desired resolution (W x H)
         :param target_resolution: (int,int)
+        :param frame_ring: a shared memory ring that stores frames and makes them available to the parent process
+        :type frame_ring: :class:`~ethoscope.hardware.input.frame_ring.SharedFrameRing`
+        :param stop_queue: a queue that can stop the async acquisition
+        :type stop_queue: :class:`~multiprocessing.JoinableQueue`
+        :param path: the path to the video file
+        :type path: str
+        :param drop_each: only publish ``1/drop_each``'th frame. The others are grabbed, but not decoded.
+        :type drop_each: int
         :param args: additional arguments
         :param kwargs: additional keyword arguments
         """
-        self._queue = queue
-        self._stop_queue = stop_queue
-        self._target_fps = target_fps
-        self._target_resolution = target_resolution
         self._video_file = path
-        super(DummyFrameGrabber, self).__init__()
+        super(DummyFrameGrabber, self).__init__(target_fps, target_resolution, frame_ring, stop_queue, drop_each)
+
+    @classmethod
+    def frame_shape(cls, target_resolution, path, *args, **kwargs):
+        cap = cv2.VideoCapture(path)
+        try:
+            w = int(cap.get(CAP_PROP_FRAME_WIDTH))
+            h = int(cap.get(CAP_PROP_FRAME_HEIGHT))
+        finally:
+            cap.release()
+        return h, w
+
     def run(self):
         try:
 
             cap = cv2.VideoCapture(self._video_file)
+            i = 0
             while True:
-                if not self._stop_queue.empty():
-
-                    logging.warning("The stop queue is not empty. Stop acquiring frames")
-                    self._stop_queue.get()
-                    self._stop_queue.task_done()
-                    logging.warning("Stop Task Done")
+                if self._stop_requested():
                     break
+                if self._is_dropped(i):
+                    cap.grab()
+                    i += 1
+                    continue
                 _, out = cap.read()
+                capture_time = monotonic_time()
                 #todo sleep here
                 out = cv2.cvtColor(out, cv2.COLOR_BGR2GRAY)
-                self._queue.put(out)
+                if not self._publish(out, i, capture_time):
+                    break
+                i += 1
 
         finally:
             logging.warning("Closing frame grabber process")
             self._stop_queue.close()
-            self._queue.close()
             logging.warning("Camera Frame grabber stopped acquisition cleanly")
 
 class DummyPiCameraAsync(OurPiCameraAsync):
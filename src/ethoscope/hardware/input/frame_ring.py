@@ -0,0 +1,117 @@
+__author__ = 'quentin'
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+
+class SharedFrameRing(object):
+
+    def __init__(self, frame_shape, n_slots=4):
+        """
+        A ring of preallocated frame slots in shared memory, to pass frames from one producer process
+        (e.g. :class:`~ethoscope.hardware.input.cameras.PiFrameGrabber`) to one consumer process without pickling or copying
+        them through a pipe. Each slot stores a frame, along with its time stamp and sequence number.
+
+        The producer copies each frame in the next free slot (:meth:`~ethoscope.hardware.input.frame_ring.SharedFrameRing.put`).
+        The consumer reads frames in place (:meth:`~ethoscope.hardware.input.frame_ring.SharedFrameRing.get`).
+        The slot of the frame returned to the consumer stays in use until the next call to ``get()``.
+        The ring must be made before the producer process is started, so that both processes share it.
+
+        :param frame_shape: The shape of all frames (e.g. ``(h, w)`` for greyscale images)
+        :type frame_shape: tuple
+        :param n_slots: The number of slots in the ring. At least two.
+        :type n_slots: int
+        """
+        if n_slots < 2:
+            raise ValueError("A frame ring needs at least two slots")
+
+        self._frame_shape = tuple(frame_shape)
+        self._n_slots = n_slots
+        frame_size = int(np.prod(self._frame_shape))
+
+        self._frame_buffer = multiprocessing.RawArray(ctypes.c_uint8, n_slots * frame_size)
+        self._time_stamps = multiprocessing.RawArray(ctypes.c_double, n_slots)
+        self._sequence_numbers = multiprocessing.RawArray(ctypes.c_longlong, n_slots)
+
+        self._free_slots = multiprocessing.Semaphore(n_slots)
+        self._filled_slots = multiprocessing.Semaphore(0)
+
+        # Each of these indices is only used by one side (producer or consumer), in its own process
+        self._write_idx = 0
+        self._read_idx = 0
+        self._holds_slot = False
+        self._frames = None
+
+    @property
+    def frame_shape(self):
+        return self._frame_shape
+
+    @property
+    def n_slots(self):
+        return self._n_slots
+
+    def _slots(self):
+        # numpy views are made lazily, in the process that uses them
+        if self._frames is None:
+            self._frames = np.frombuffer(self._frame_buffer, dtype=np.uint8).reshape((self._n_slots,) + self._frame_shape)
+        return self._frames
+
+    def put(self, frame, time_stamp, sequence_number, timeout=None):
+        """
+        Copy a frame in the next free slot. To be called by the producer process.
+
+        :param frame: The frame. It must have the shape of the ring.
+        :type frame: :class:`~numpy.ndarray`
+        :param time_stamp: The time at which the frame was acquired (in s)
+        :type time_stamp: float
+        :param sequence_number: The index of the frame in the stream of the producer
+        :type sequence_number: int
+        :param timeout: How long to wait, in seconds, for a free slot. `None` means forever.
+        :type timeout: float
+        :return: Whether the frame was put in the ring (i.e. `False` if no slot was free before ``timeout``).
+        :rtype: bool
+        """
+        if frame.shape != self._frame_shape:
+            raise ValueError("Frame shape %s does not match the shape of the ring %s" % (str(frame.shape), str(self._frame_shape)))
+
+        if not self._free_slots.acquire(True, timeout):
+            return False
+
+        slot = self._write_idx % self._n_slots
+        np.copyto(self._slots()[slot], frame)
+        self._time_stamps[slot] = time_stamp
+        self._sequence_numbers[slot] = sequence_number
+        self._write_idx += 1
+        self._filled_slots.release()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Get the next frame. To be called by the consumer process.
+        This releases the slot of the previously returned frame, so this frame must not be used after this call.
+
+        :param timeout: How long to wait, in seconds, for a frame. `None` means forever.
+        :type timeout: float
+        :return: The frame (a view on the shared slot), its time stamp and sequence number. `None` if no frame arrived before ``timeout``.
+        :rtype: (:class:`~numpy.ndarray`, float, int)
+        """
+        self.release()
+
+        if not self._filled_slots.acquire(True, timeout):
+            return None
+
+        slot = self._read_idx % self._n_slots
+        self._read_idx += 1
+        self._holds_slot = True
+        return self._slots()[slot], self._time_stamps[slot], self._sequence_numbers[slot]
+
+    def release(self):
+        """
+        Give back the slot of the last frame returned by ``get()`` (if any), so the producer can reuse it.
+        To be called by the consumer process.
+        """
+        if self._holds_slot:
+            self._holds_slot = False
+            self._free_slots.release()
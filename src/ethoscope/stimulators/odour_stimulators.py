@@ -23,16 +23,16 @@ class HasChangedSideStimulator(BaseStimulator):
         super(HasChangedSideStimulator, self).__init__(hardware_connection)
 
     def _has_changed_side(self):
-        positions = self._tracker.positions
+        last = self._tracker.history.last(2)
 
-        if len(positions ) <2 :
+        if len(last) <2 :
             return False
 
         w = float(self._tracker._roi.get_feature_dict()["w"])
-        if len(positions[-1]) != 1:
+        if last["t"][-1] == last["t"][-2]:
             raise Exception("This stimulator can only work with a single animal per ROI")
-        x0 = positions[-1][0]["x"] / w
-        xm1 = positions[-2][0]["x"] / w
+        x0 = last["x"][-1] / w
+        xm1 = last["x"][-2] / w
 
 
         if x0 > self._middle_line:
@@ -32,26 +32,24 @@ class IsMovingStimulator(BaseStimulator):
 
     def _has_moved(self):
 
-        positions = self._tracker.positions
+        last = self._tracker.history.last(2)
 
-        if len(positions ) <2 :
+        if len(last) <2 :
             return False
 
 
-        if len(positions[-1]) != 1:
+        if last["t"][-1] == last["t"][-2]:
             raise Exception("This stimulator can only work with a single animal per ROI")
-        tail_m = positions[-1][0]
 
-        times = self._tracker.times
-        last_time_for_position = times[-1]
+        last_time_for_position = last["t"][-1]
         last_time = self._tracker.last_time_point
 
         # we assume no movement if the animal was not spotted
         if last_time != last_time_for_position:
             return False
 
-        dt_s = abs(times[-1] - times[-2]) / 1000.0
-        dist = 10.0 ** (tail_m["xy_dist_log10x1000"]/1000.0)
+        dt_s = abs(last["t"][-1] - last["t"][-2]) / 1000.0
+        dist = 10.0 ** (last["xy_dist_log10x1000"][-1]/1000.0)
         velocity = dist / dt_s
 
         if velocity > self._velocity_threshold:
@@ -337,17 +335,17 @@ class MiddleCrossingStimulator(BaseStimulator):
         except KeyError:
             return HasInteractedVariable(False), {}
 
-        positions = self._tracker.positions
+        last = self._tracker.history.last(2)
 
-        if len(positions) < 2:
+        if len(last) < 2:
             return HasInteractedVariable(False), {}
 
-        if len(positions[-1]) != 1:
+        if last["t"][-1] == last["t"][-2]:
             raise Exception("This stimulator can only work with a single animal per ROI")
 
         roi_w = float(self._tracker._roi.longest_axis)
-        x_t_zero = positions[-1][0]["x"] / roi_w - 0.5
-        x_t_minus_one = positions[-2][0]["x"] / roi_w - 0.5
+        x_t_zero = last["x"][-1] / roi_w - 0.5
+        x_t_minus_one = last["x"][-2] / roi_w - 0.5
 
         # if roi_id == 12:
         #     print (roi_id, channel, roi_w, positions[-1][0]["x"], positions[-2][0]["x"], x_t_zero, x_t_minus_one)
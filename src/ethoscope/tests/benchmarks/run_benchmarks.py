@@ -0,0 +1,222 @@
+"""
+A throughput and accuracy benchmark of the trackers, on synthetic arenas (no camera or video file needed).
+
+For each tracker, it reports:
+
+* the end-to-end number of frames per second;
+* the time spent, per frame, acquiring frames, tracking and (optionally) writing results,
+  and the tracking time per ROI;
+* the number of detections (i.e. positions that are not inferred) per animal and frame, and the position error, in pixels;
+* the proportion of ROI-frames skipped by motion gating.
+
+A warning is logged for trackers that (almost) never detect animals, since their throughput is then meaningless.
+AdaptiveBGModelOneObject expects a whole frame ROI, so it is benchmarked on a single tube, in a whole frame ROI
+(see ``TRACKER_ARENA_KWARGS``).
+
+Example::
+
+    python -m ethoscope.tests.benchmarks.run_benchmarks --duration 60 --n-rows 10 --n-cols 2 --write
+    python -m ethoscope.tests.benchmarks.run_benchmarks -t AdaptiveBGModel -k '{"full_search_interval": 1000}'
+"""
+
+__author__ = 'quentin'
+
+import json
+import logging
+import os
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from ethoscope.core.tracking_unit import TrackingUnit
+from ethoscope.tests.benchmarks.synthetic_arena import SyntheticArena, SyntheticArenaCamera
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.batched_tracker import BatchedAdaptiveBGModel, ROIBatch
+from ethoscope.trackers.connected_components_tracker import ConnectedComponentsTracker
+from ethoscope.trackers.multi_fly_tracker import MultiFlyTracker
+from ethoscope.trackers.single_roi_tracker import AdaptiveBGModelOneObject
+from ethoscope.utils.io import SQLiteResultWriter
+
+TRACKERS = dict([(c.__name__, c) for c in [AdaptiveBGModel, BatchedAdaptiveBGModel, ConnectedComponentsTracker,
+                                           MultiFlyTracker, AdaptiveBGModelOneObject]])
+
+# arena keyword arguments that override the command line ones, for trackers that cannot track a grid of tubes.
+# AdaptiveBGModelOneObject rejects foregrounds larger than a small proportion of its ROI (i.e. a tube),
+# so it tracks a single animal in a whole frame ROI
+TRACKER_ARENA_KWARGS = {"AdaptiveBGModelOneObject": {"n_rows": 1, "n_cols": 1, "n_animals_per_roi": 1,
+                                                     "whole_frame_roi": True}}
+
+# below this number of detections per animal and frame, a tracker is considered not to track the arena
+MIN_DETECTIONS_PER_ANIMAL = .05
+
+
+def benchmark_tracker(tracker_class, arena_kwargs, fps=10., duration=60., warm_up=10., write=False, greyscale=False,
+                      tracker_kwargs=None):
+    """
+    Track a synthetic arena, and measure the time spent in each stage and the tracking error.
+
+    :param tracker_class: the tracker to benchmark
+    :type tracker_class: class
+    :param arena_kwargs: keyword arguments used to build the :class:`~ethoscope.tests.benchmarks.synthetic_arena.SyntheticArena`
+    :type arena_kwargs: dict
+    :param fps: the number of frames per second of the synthetic camera
+    :type fps: float
+    :param duration: the duration of the run, in seconds (of synthetic time)
+    :type duration: float
+    :param warm_up: the time, in seconds, after which positions are used to compute the error (i.e. once models converged)
+    :type warm_up: float
+    :param write: whether to also write results in a (temporary) SQLite file
+    :type write: bool
+    :param greyscale: whether the camera returns greyscale frames
+    :type greyscale: bool
+    :param tracker_kwargs: additional keyword arguments passed to the tracker
+    :type tracker_kwargs: dict
+    :return: the benchmark results
+    :rtype: dict
+    """
+    if tracker_kwargs is None:
+        tracker_kwargs = {}
+    if issubclass(tracker_class, BatchedAdaptiveBGModel):
+        # all the trackers share the same batch
+        tracker_kwargs = dict(tracker_kwargs, batch=ROIBatch())
+    arena = SyntheticArena(**arena_kwargs)
+    camera = SyntheticArenaCamera(arena, fps=fps, duration=duration, greyscale=greyscale)
+    rois = arena.rois
+    units = [TrackingUnit(tracker_class, r, None, **tracker_kwargs) for r in rois]
+
+    timers = {"acquire": 0., "track": 0., "write": 0.}
+    errors = []
+    n_frames = 0
+    n_detections = 0
+    n_expected = 0
+
+    tmp_file = None
+    result_writer = None
+    if write:
+        tmp_file = tempfile.mktemp(prefix="ethoscope_benchmark_", suffix=".db")
+        result_writer = SQLiteResultWriter(tmp_file, rois)
+
+    try:
+        start = time.time()
+        tick = time.time()
+        for t, frame in camera:
+            now = time.time()
+            timers["acquire"] += now - tick
+            tick = now
+
+            truth = camera.last_positions
+            outputs = [u.track(t, frame) for u in units]
+            now = time.time()
+            timers["track"] += now - tick
+            tick = now
+
+            if result_writer is not None:
+                for u, data_rows in zip(units, outputs):
+                    if len(data_rows) > 0:
+                        result_writer.write(t, u.roi, data_rows)
+                result_writer.flush(t, frame)
+                now = time.time()
+                timers["write"] += now - tick
+                tick = now
+
+            n_frames += 1
+            if t < warm_up * 1000:
+                continue
+            for u, data_rows, true_pos in zip(units, outputs, truth):
+                n_expected += len(true_pos)
+                ox, oy = u.roi.offset
+                for dr in data_rows:
+                    if dr["is_inferred"]:
+                        continue
+                    n_detections += 1
+                    x, y = dr["x"] + ox, dr["y"] + oy
+                    errors.append(min([np.hypot(x - tx, y - ty) for tx, ty in true_pos]))
+
+        total = time.time() - start
+    finally:
+        if result_writer is not None:
+            result_writer.__exit__(None, None, None)
+            os.remove(tmp_file)
+
+    if len(errors) > 0:
+        errors = np.array(errors)
+        error_stats = (float(np.mean(errors)), float(np.median(errors)), float(np.percentile(errors, 95)))
+    else:
+        # no detection, so no error
+        error_stats = (float("nan"),) * 3
+    out = {"tracker": tracker_class.__name__,
+           "n_frames": n_frames,
+           "n_rois": len(rois),
+           "fps": n_frames / total,
+           "detections_per_animal": n_detections / float(max(n_expected, 1)),
+           "skipped_roi_frames": sum([u.tracker.n_skipped_frames for u in units]) / float(n_frames * len(rois)),
+           "mean_error_px": error_stats[0],
+           "median_error_px": error_stats[1],
+           "p95_error_px": error_stats[2]}
+    for k, v in timers.items():
+        out["%s_ms_per_frame" % k] = 1e3 * v / n_frames
+    out["track_us_per_roi"] = 1e6 * timers["track"] / (n_frames * len(rois))
+    if out["detections_per_animal"] < MIN_DETECTIONS_PER_ANIMAL:
+        # its throughput is meaningless, since it tracks (almost) nothing
+        logging.warning("%s has %.3f detections per animal and frame. It does not track this arena" %
+                        (out["tracker"], out["detections_per_animal"]))
+    return out
+
+
+def print_results(results):
+    columns = ["tracker", "n_rois", "fps", "acquire_ms_per_frame", "track_ms_per_frame", "track_us_per_roi", "write_ms_per_frame",
+               "detections_per_animal", "skipped_roi_frames", "mean_error_px", "p95_error_px"]
+    print " | ".join(columns)
+    for r in results:
+        print " | ".join([("%.3f" % r[c]) if isinstance(r[c], float) else str(r[c]) for c in columns])
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-t", "--trackers", dest="trackers", default=",".join(sorted(TRACKERS.keys())),
+                      help="Comma separated trackers to benchmark, among: %s" % ", ".join(sorted(TRACKERS.keys())))
+    parser.add_option("--width", dest="width", default=1280, type="int", help="The width of frames")
+    parser.add_option("--height", dest="height", default=960, type="int", help="The height of frames")
+    parser.add_option("--n-rows", dest="n_rows", default=10, type="int", help="The number of rows of ROIs")
+    parser.add_option("--n-cols", dest="n_cols", default=2, type="int", help="The number of columns of ROIs")
+    parser.add_option("--n-animals", dest="n_animals", default=1, type="int", help="The number of animals per ROI")
+    parser.add_option("--noise", dest="noise", default=4., type="float", help="The standard deviation of the pixel noise")
+    parser.add_option("--lighting-drift", dest="lighting_drift", default=.15, type="float",
+                      help="The relative amplitude of the lighting variations")
+    parser.add_option("--fps", dest="fps", default=10., type="float", help="The frame rate of the synthetic camera")
+    parser.add_option("--duration", dest="duration", default=60., type="float", help="The duration of each run, in seconds")
+    parser.add_option("--warm-up", dest="warm_up", default=10., type="float",
+                      help="The time, in seconds, before which positions are not used to compute errors")
+    parser.add_option("--seed", dest="seed", default=1, type="int", help="The seed of the synthetic arena")
+    parser.add_option("--greyscale", dest="greyscale", default=False, action="store_true", help="Use greyscale frames")
+    parser.add_option("--write", dest="write", default=False, action="store_true", help="Also write results in a SQLite file")
+    parser.add_option("--json", dest="json", default=None, help="Save the results in this json file")
+    parser.add_option("-k", "--tracker-kwargs", dest="tracker_kwargs", default="{}",
+                      help="Keyword arguments passed to the trackers, as a json object. E.g. '{\"full_search_interval\": 1000}'")
+
+    (options, args) = parser.parse_args()
+    option_dict = vars(options)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    arena_kwargs = {"resolution": (option_dict["width"], option_dict["height"]),
+                    "n_rows": option_dict["n_rows"],
+                    "n_cols": option_dict["n_cols"],
+                    "n_animals_per_roi": option_dict["n_animals"],
+                    "noise_sd": option_dict["noise"],
+                    "lighting_drift": option_dict["lighting_drift"],
+                    "seed": option_dict["seed"]}
+
+    results = []
+    for name in option_dict["trackers"].split(","):
+        tracker_arena_kwargs = dict(arena_kwargs, **TRACKER_ARENA_KWARGS.get(name, {}))
+        results.append(benchmark_tracker(TRACKERS[name], tracker_arena_kwargs,
+                                         fps=option_dict["fps"], duration=option_dict["duration"],
+                                         warm_up=option_dict["warm_up"], write=option_dict["write"],
+                                         greyscale=option_dict["greyscale"],
+                                         tracker_kwargs=json.loads(option_dict["tracker_kwargs"])))
+    print_results(results)
+    if option_dict["json"] is not None:
+        with open(option_dict["json"], "w") as f:
+            json.dump({"options": option_dict, "results": results}, f, indent=2)
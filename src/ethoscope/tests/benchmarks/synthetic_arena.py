@@ -0,0 +1,220 @@
+"""
+Synthetic arenas with animals moving along known trajectories, to benchmark trackers without any camera or video file.
+"""
+
+__author__ = 'quentin'
+
+import cv2
+import numpy as np
+
+from ethoscope.core.roi import ROI
+from ethoscope.hardware.input.cameras import BaseCamera
+
+
+class SyntheticArena(object):
+    _background_level = 70
+    _tube_level = 200
+    _target_level = 20
+    _animal_level = 60
+
+    def __init__(self, resolution=(1280, 960), n_rows=10, n_cols=2, n_animals_per_roi=1, animal_size=(24, 10),
+                 noise_sd=4., lighting_drift=.15, lighting_period=120., seed=1, whole_frame_roi=False):
+        """
+        A synthetic sleep-monitor-like arena: a grid of bright tubes, each being a ROI, with dark animals moving in them,
+        and three dark targets in the corners.
+        Frames are a deterministic function of time (and of the seed), and the true position of each animal is known.
+
+        :param resolution: the size of the frames (W x H)
+        :type resolution: (int, int)
+        :param n_rows: the number of rows of tubes
+        :type n_rows: int
+        :param n_cols: the number of columns of tubes
+        :type n_cols: int
+        :param n_animals_per_roi: the number of animals in each tube
+        :type n_animals_per_roi: int
+        :param animal_size: the length and width of animals, in pixels
+        :type animal_size: (int, int)
+        :param noise_sd: the standard deviation of the gaussian pixel noise
+        :type noise_sd: float
+        :param lighting_drift: the relative amplitude of the (sinusoidal) variation of the overall lighting
+        :type lighting_drift: float
+        :param lighting_period: the period of the lighting variation, in seconds
+        :type lighting_period: float
+        :param seed: the seed used to draw the trajectories and the noise
+        :type seed: int
+        :param whole_frame_roi: whether the arena has a single ROI, covering the whole frame, rather than one ROI per tube
+            (e.g. for trackers that expect a whole-frame ROI). The arena must then have a single tube
+        :type whole_frame_roi: bool
+        """
+        self._resolution = resolution
+        self._animal_size = animal_size
+        self._noise_sd = noise_sd
+        self._lighting_drift = lighting_drift
+        self._lighting_period = lighting_period
+        self._rng = np.random.RandomState(seed)
+        cv2.setRNGSeed(seed)
+
+        w, h = resolution
+        margin_x, margin_y = int(w * .08), int(h * .08)
+        cell_w = (w - 2 * margin_x) // n_cols
+        cell_h = (h - 2 * margin_y) // n_rows
+        tube_h = max(int(cell_h * .6), animal_size[1] + 4)
+        tube_w = int(cell_w * .9)
+
+        self._background = np.full((h, w), self._background_level, np.uint8)
+        target_radius = max(margin_x, margin_y) // 4
+        for cx, cy in [(margin_x // 2, margin_y // 2), (w - margin_x // 2, margin_y // 2), (margin_x // 2, h - margin_y // 2)]:
+            cv2.circle(self._background, (cx, cy), target_radius, self._target_level, -1, cv2.LINE_AA)
+
+        self._rois = []
+        self._tubes = []
+        idx = 1
+        for c in range(n_cols):
+            for r in range(n_rows):
+                x0 = margin_x + c * cell_w + (cell_w - tube_w) // 2
+                y0 = margin_y + r * cell_h + (cell_h - tube_h) // 2
+                cv2.rectangle(self._background, (x0, y0), (x0 + tube_w - 1, y0 + tube_h - 1), self._tube_level, -1)
+                polygon = np.array([[x0, y0], [x0 + tube_w - 1, y0], [x0 + tube_w - 1, y0 + tube_h - 1], [x0, y0 + tube_h - 1]])
+                self._rois.append(ROI(polygon, idx))
+                self._tubes.append((x0, y0, tube_w, tube_h))
+                idx += 1
+
+        if whole_frame_roi:
+            if len(self._tubes) != 1:
+                raise ValueError("A whole frame ROI requires a single tube, got %i" % len(self._tubes))
+            self._rois = [ROI(np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]]), 1)]
+
+        # each animal moves along its tube according to a sum of sinusoids, and rests when the sum is low
+        n_animals = len(self._tubes) * n_animals_per_roi
+        self._n_animals_per_roi = n_animals_per_roi
+        self._freqs = self._rng.uniform(.005, .1, (n_animals, 3))
+        self._phases = self._rng.uniform(0, 2 * np.pi, (n_animals, 3))
+        # the lateral position depends on the position along the tube, so resting animals are completely still
+        self._lateral_cycles = self._rng.uniform(1, 4, n_animals)
+        self._rest_thresholds = self._rng.uniform(-.5, .5, n_animals)
+
+        self._noise = np.empty((h, w), np.int16)
+        self._frame = np.empty((h, w), np.uint8)
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @property
+    def rois(self):
+        """
+        :return: The ROIs of the arena (one per tube, or a single whole frame ROI)
+        :rtype: list(:class:`~ethoscope.core.roi.ROI`)
+        """
+        return self._rois
+
+    def _progress(self, t):
+        # the position of each animal along its tube, in [0, 1], at time t (in s)
+        waves = np.sin(2 * np.pi * self._freqs * t + self._phases).sum(axis=1) / 3.
+        # the animals stay still whilst the wave is below a threshold
+        waves = np.maximum(waves, self._rest_thresholds)
+        return .5 + .45 * waves
+
+    def positions(self, t):
+        """
+        :param t: the time, in seconds
+        :type t: float
+        :return: the true positions (x, y) of the animals of each ROI, in the frame.
+        :rtype: list(list((float, float)))
+        """
+        progress = self._progress(t)
+        lateral = np.sin(2 * np.pi * self._lateral_cycles * progress)
+        out = []
+        length, width = self._animal_size
+        for i, (x0, y0, tube_w, tube_h) in enumerate(self._tubes):
+            roi_pos = []
+            for j in range(i * self._n_animals_per_roi, (i + 1) * self._n_animals_per_roi):
+                x = x0 + length / 2. + progress[j] * (tube_w - length - 1)
+                y = y0 + tube_h / 2. + lateral[j] * (tube_h - width - 2) / 2.
+                roi_pos.append((x, y))
+            out.append(roi_pos)
+        return out
+
+    def frame(self, t):
+        """
+        Render the arena at a given time.
+
+        :param t: the time, in seconds
+        :type t: float
+        :return: the frame (greyscale) and the true positions of the animals (see :meth:`positions`).
+            The frame is reused by the next call.
+        :rtype: (:class:`~numpy.ndarray`, list(list((float, float))))
+        """
+        positions = self.positions(t)
+        dt = 1e-2
+        next_positions = self.positions(t + dt)
+        np.copyto(self._frame, self._background)
+        length, width = self._animal_size
+        for roi_pos, roi_next in zip(positions, next_positions):
+            for (x, y), (nx, ny) in zip(roi_pos, roi_next):
+                # resting animals keep lying along their tube
+                angle = np.degrees(np.arctan2(ny - y, abs(nx - x) + .05))
+                # sub pixel drawing
+                shift = 4
+                center = (int(round(x * 2 ** shift)), int(round(y * 2 ** shift)))
+                axes = (int(length * 2 ** (shift - 1)), int(width * 2 ** (shift - 1)))
+                cv2.ellipse(self._frame, center, axes, angle, 0, 360, self._animal_level, -1, cv2.LINE_AA, shift)
+
+        lighting = 1 + self._lighting_drift * np.sin(2 * np.pi * t / self._lighting_period)
+        cv2.convertScaleAbs(self._frame, self._frame, lighting)
+        if self._noise_sd > 0:
+            cv2.randn(self._noise, 0, self._noise_sd)
+            cv2.add(self._frame, self._noise, self._frame, dtype=cv2.CV_8U)
+        return self._frame, positions
+
+
+class SyntheticArenaCamera(BaseCamera):
+    def __init__(self, arena, fps=10., duration=60., *args, **kwargs):
+        """
+        A camera filming a :class:`~ethoscope.tests.benchmarks.synthetic_arena.SyntheticArena`.
+        The true positions of the animals in the last frame are available through :attr:`last_positions`.
+
+        :param arena: the synthetic arena
+        :type arena: :class:`~ethoscope.tests.benchmarks.synthetic_arena.SyntheticArena`
+        :param fps: the number of frames per second
+        :type fps: float
+        :param duration: the duration of the "video", in seconds
+        :type duration: float
+        :param args: additional arguments
+        :param kwargs: additional keyword arguments
+        """
+        self._arena = arena
+        self._fps = float(fps)
+        self._n_frames = int(duration * fps)
+        self._resolution = arena.resolution
+        self._last_positions = None
+        self._bgr_frame = None
+        self.canbepickled = False
+        super(SyntheticArenaCamera, self).__init__(*args, **kwargs)
+
+    @property
+    def last_positions(self):
+        return self._last_positions
+
+    def is_opened(self):
+        return True
+
+    def is_last_frame(self):
+        return self._frame_idx >= self._n_frames
+
+    def restart(self):
+        self._frame_idx = 0
+
+    def _time_stamp(self):
+        return self._frame_idx / self._fps
+
+    def _skip_image(self):
+        self._register_frame(self._frame_idx)
+        return True
+
+    def _next_image(self):
+        frame, self._last_positions = self._arena.frame(self._frame_idx / self._fps)
+        if self._greyscale:
+            return frame
+        self._bgr_frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, self._bgr_frame)
+        return self._bgr_frame
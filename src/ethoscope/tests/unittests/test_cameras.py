@@ -0,0 +1,36 @@
+__author__ = 'quentin'
+
+import os
+import unittest
+
+import numpy as np
+
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+
+VIDEO = os.path.join(os.path.dirname(__file__), "../static_files/videos/arena_10x2_sortTubes.mp4")
+
+
+class TestMovieVirtualCamera(unittest.TestCase):
+
+    def _read(self, **kwargs):
+        cam = MovieVirtualCamera(VIDEO, max_duration=5, **kwargs)
+        try:
+            # frames may be reused by the camera, so we keep copies
+            return [(t, f.copy()) for t, f in cam]
+        finally:
+            cam._close()
+
+    def test_prefetch(self):
+        for drop_each in [1, 3]:
+            ref = self._read(drop_each=drop_each)
+            out = self._read(drop_each=drop_each, prefetch=3)
+            self.assertEqual([t for t, _ in ref], [t for t, _ in out])
+            for (_, f_ref), (_, f_out) in zip(ref, out):
+                self.assertTrue(np.array_equal(f_ref, f_out))
+
+    def test_drop_each(self):
+        ref = [t for t, _ in self._read()][2::3]
+        out = [t for t, _ in self._read(drop_each=3)]
+        # the last kept frame may be after max_duration
+        self.assertEqual(ref, out[:len(ref)])
+        self.assertTrue(len(out) - len(ref) <= 1)
@@ -0,0 +1,40 @@
+__author__ = 'quentin'
+
+import pickle
+import unittest
+
+from ethoscope.core.data_point import DataPoint, DataPointSchema
+from ethoscope.core.variables import XPosVariable, YPosVariable, IsInferredVariable, XYDistance
+
+
+class TestDataPoint(unittest.TestCase):
+
+    def test_schema_and_variables(self):
+        schema = DataPointSchema.get([XPosVariable, YPosVariable])
+        self.assertIs(schema, DataPointSchema.get([XPosVariable, YPosVariable]))
+        self.assertRaises(ValueError, schema.data_point, 1)
+
+        point = schema.data_point(32.0, 18)
+        # the same data point as the one made from variables
+        self.assertEqual(point, DataPoint([XPosVariable(32), YPosVariable(18)]))
+        self.assertEqual(point["x"], 32)
+        self.assertEqual(point.get("w", -1), -1)
+        self.assertRaises(KeyError, point.__getitem__, "w")
+
+        point.append(IsInferredVariable(True))
+        copy = point.copy()
+        point.append(XPosVariable(3))
+        self.assertEqual(point.keys(), ["x", "y", "is_inferred"])
+        self.assertEqual(point.to_tuple(), (3, 18, 1))
+        self.assertEqual(dict(copy), {"x": 32, "y": 18, "is_inferred": 1})
+        self.assertIs(point.schema, schema.extended(IsInferredVariable))
+        self.assertEqual([type(v) for v in point.values()], [XPosVariable, YPosVariable, IsInferredVariable])
+
+        self.assertEqual(point.schema.sql_fields(), ["x SMALLINT", "y SMALLINT", "is_inferred BOOLEAN"])
+        self.assertEqual(point.schema.var_map()[2], ("is_inferred", "BOOLEAN", "bool"))
+
+    def test_pickle(self):
+        point = DataPoint([XPosVariable(1), YPosVariable(2), XYDistance(-2000)])
+        unpickled = pickle.loads(pickle.dumps(point, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(unpickled, point)
+        self.assertIs(unpickled.schema, point.schema)
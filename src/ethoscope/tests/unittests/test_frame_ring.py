@@ -0,0 +1,45 @@
+__author__ = 'quentin'
+
+import multiprocessing
+import unittest
+
+import numpy as np
+
+from ethoscope.hardware.input.frame_ring import SharedFrameRing
+
+
+def _produce(ring, n):
+    for i in range(n):
+        ring.put(np.full(ring.frame_shape, i, np.uint8), float(i), i)
+
+
+class TestSharedFrameRing(unittest.TestCase):
+
+    def test_frames_across_processes(self):
+        ring = SharedFrameRing((4, 6), n_slots=3)
+        p = multiprocessing.Process(target=_produce, args=(ring, 20))
+        p.start()
+        for i in range(20):
+            frame, t, seq = ring.get(timeout=10)
+            self.assertEqual(seq, i)
+            self.assertEqual(t, float(i))
+            self.assertTrue(np.all(frame == i))
+        ring.release()
+        p.join()
+        self.assertIsNone(ring.get(timeout=0.1))
+
+    def test_full_ring(self):
+        ring = SharedFrameRing((2, 2), n_slots=2)
+        frame = np.zeros((2, 2), np.uint8)
+        self.assertTrue(ring.put(frame, 0, 0))
+        self.assertTrue(ring.put(frame, 1, 1))
+        self.assertFalse(ring.put(frame, 2, 2, timeout=0.1))
+        ring.get()
+        # the slot of the frame we hold is not free yet
+        self.assertFalse(ring.put(frame, 2, 2, timeout=0.1))
+        ring.get()
+        self.assertTrue(ring.put(frame, 2, 2, timeout=0.1))
+
+    def test_wrong_shape(self):
+        ring = SharedFrameRing((2, 2))
+        self.assertRaises(ValueError, ring.put, np.zeros((3, 2), np.uint8), 0, 0)
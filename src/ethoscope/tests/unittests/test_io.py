@@ -0,0 +1,120 @@
+__author__ = 'quentin'
+
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from ethoscope.core.data_point import DataPointSchema
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, IsInferredVariable
+from ethoscope.utils.io import SQLiteResultWriter, MessageSpool
+from ethoscope.utils.row_ring import SharedRowRing
+
+
+class _SmallQueueResultWriter(SQLiteResultWriter):
+    # most messages are spooled
+    _max_queue_size = 1
+
+
+def _consume(ring, queue, out_queue):
+    for notice in iter(queue.get, None):
+        out_queue.put(ring.rows(notice))
+
+
+class TestSharedRowRing(unittest.TestCase):
+
+    def test_rows_across_processes(self):
+        ring = SharedRowRing(block_size=4, max_n_columns=3, n_slots=2)
+        self.assertRaises(ValueError, ring.put, [(1, 2, 3, 4)])
+        self.assertRaises(ValueError, ring.put, [(1, 2)] * 5)
+
+        queue, out_queue = multiprocessing.Queue(), multiprocessing.Queue()
+        p = multiprocessing.Process(target=_consume, args=(ring, queue, out_queue))
+        p.start()
+        try:
+            for i in range(10):
+                rows = [(i, j, 2 ** 40) for j in range(i % 4 + 1)]
+                notice = ring.put(rows)
+                self.assertIsNotNone(notice)
+                queue.put(notice)
+                self.assertEqual(out_queue.get(timeout=10), [list(r) for r in rows])
+        finally:
+            queue.put(None)
+            p.join()
+
+        # blocks not read yet keep their slot
+        ring.put([(1, 2)])
+        ring.put([(3, 4)])
+        self.assertIsNone(ring.put([(5, 6)]))
+
+
+class TestMessageSpool(unittest.TestCase):
+
+    def test_first_in_first_out(self):
+        spool = MessageSpool()
+        self.assertEqual(spool.size, 0)
+        try:
+            for i in range(3):
+                spool.append(("command %i" % i, [(i, "it's")], i * 100))
+            self.assertEqual(len(spool), 3)
+            self.assertTrue(os.path.exists(spool.path))
+            self.assertEqual(spool.peek(), spool.pop())
+            spool.append(("command 3", None))
+            self.assertEqual([spool.pop()[0] for _ in range(3)], ["command 1", "command 2", "command 3"])
+            self.assertEqual((len(spool), spool.size), (0, 0))
+            self.assertRaises(IndexError, spool.pop)
+            # the file is reused once it is empty
+            spool.append(("command 4", None))
+            self.assertEqual(spool.pop(), ("command 4", None))
+        finally:
+            spool.close()
+        self.assertFalse(os.path.exists(spool.path))
+
+
+class TestSQLiteResultWriter(unittest.TestCase):
+
+    def test_batched_inserts(self):
+        self._test_writer(SQLiteResultWriter)
+
+    def test_spooled_inserts(self):
+        self._test_writer(_SmallQueueResultWriter)
+
+    def _test_writer(self, writer_class):
+        rois = [ROI(((0, 0), (0, 10), (20, 10), (20, 0)), idx=i + 1) for i in range(2)]
+        schema = DataPointSchema.get([XPosVariable, YPosVariable, IsInferredVariable])
+        db_file = tempfile.mktemp(prefix="ethoscope_test_", suffix=".db")
+        # values that used to break string-built statements
+        metadata = {"comment": "it's a \"quoted\" value"}
+        try:
+            with writer_class(db_file, rois, metadata=metadata) as rw:
+                for t in range(0, 10000, 100):
+                    rw.write(t, rois[0], [schema.data_point(t // 100, 5, 0), schema.data_point(3, 4, 1)])
+                    rw.write(t, rois[1], [schema.data_point(1, 2, 0)])
+                    rw.flush(t)
+
+            # rows were committed in groups
+            stats = rw.stats
+            self.assertGreaterEqual(stats["n_rows"], 300)
+            self.assertGreater(stats["rows_per_commit"], 30)
+            self.assertEqual(stats["n_rows"], round(stats["n_commits"] * stats["rows_per_commit"]))
+            self.assertEqual((stats["spool_n_messages"], stats["lag"]), (0, 0))
+
+            conn = sqlite3.connect(db_file)
+            try:
+                c = conn.cursor()
+                rows = c.execute("SELECT t, x, y, is_inferred FROM ROI_1 ORDER BY t, x").fetchall()
+                self.assertEqual(len(rows), 200)
+                self.assertEqual(rows[0:2], [(0, 0, 5, 0), (0, 3, 4, 1)])
+                self.assertEqual(rows[-1], (9900, 99, 5, 0))
+                self.assertEqual(c.execute("SELECT COUNT(*) FROM ROI_2").fetchone()[0], 100)
+                var_map = c.execute("SELECT var_name FROM VAR_MAP").fetchall()
+                self.assertEqual([v for v, in var_map], ["x", "y", "is_inferred"])
+                comment = c.execute("SELECT value FROM METADATA WHERE field = 'comment'").fetchone()[0]
+                self.assertEqual(comment, metadata["comment"])
+            finally:
+                conn.close()
+        finally:
+            if os.path.exists(db_file):
+                os.remove(db_file)
@@ -0,0 +1,42 @@
+__author__ = 'quentin'
+
+import unittest
+from ethoscope.core.pipelined_monitor import StageQueue
+
+
+class TestStageQueue(unittest.TestCase):
+
+    def _fill(self, policy):
+        q = StageQueue("test", maxsize=3, overflow_policy=policy)
+        for i in range(5):
+            q.put(i)
+        q.close()
+        out = []
+        while True:
+            item = q.get()
+            if item is StageQueue.END:
+                break
+            out.append(item)
+        return out, q.stats
+
+    def test_drop_oldest(self):
+        out, stats = self._fill(StageQueue.DROP_OLDEST)
+        self.assertEqual(out, [2, 3, 4])
+        self.assertEqual(stats["n_dropped"], 2)
+        self.assertEqual(stats["max_depth"], 3)
+
+    def test_drop_newest(self):
+        out, stats = self._fill(StageQueue.DROP_NEWEST)
+        self.assertEqual(out, [0, 1, 2])
+        self.assertEqual(stats["n_dropped"], 2)
+        self.assertEqual(stats["n_put"], 3)
+
+    def test_abort_releases_producer(self):
+        q = StageQueue("test", maxsize=1, overflow_policy=StageQueue.BLOCK)
+        q.put(0)
+        q.abort()
+        self.assertFalse(q.put(1))
+        self.assertIs(q.get(), StageQueue.END)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, StageQueue, "test", 3, "drop_all")
@@ -0,0 +1,72 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from ethoscope.core.data_point import DataPointSchema
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, IsInferredVariable
+from ethoscope.utils.io import SQLiteResultWriter
+from ethoscope.utils.result_log import ResultLogWriter, AsyncResultLogWriter, ResultLogReader, convert_result_log
+
+
+class _SmallSegmentsAsyncWriter(AsyncResultLogWriter):
+    _max_segment_size = 2000
+    _index_interval = 50
+
+
+class _SmallSegmentsResultLogWriter(ResultLogWriter):
+    _async_writing_class = _SmallSegmentsAsyncWriter
+
+
+class TestResultLog(unittest.TestCase):
+
+    def _write(self, writer_class, path, rois):
+        schema = DataPointSchema.get([XPosVariable, YPosVariable, IsInferredVariable])
+        with writer_class(path, rois, metadata={"comment": "it's a test"}) as rw:
+            for t in range(0, 10000, 100):
+                rw.write(t, rois[0], [schema.data_point(t // 100, 5, 0), schema.data_point(3, 4, 1)])
+                rw.write(t, rois[1], [schema.data_point(1, -2, 0)])
+                rw.flush(t)
+
+    def _tables(self, db_file):
+        conn = sqlite3.connect(db_file)
+        try:
+            c = conn.cursor()
+            out = {"schema": sorted(c.execute("SELECT name, sql FROM sqlite_master").fetchall())}
+            for table in ("ROI_1", "ROI_2", "ROI_MAP", "VAR_MAP"):
+                out[table] = c.execute("SELECT * FROM %s" % table).fetchall()
+            out["METADATA"] = c.execute("SELECT field FROM METADATA").fetchall()
+            out["START_EVENTS"] = c.execute("SELECT id, event FROM START_EVENTS").fetchall()
+            return out
+        finally:
+            conn.close()
+
+    def test_log_as_database(self):
+        rois = [ROI(((0, 0), (0, 10), (20, 10), (20, 0)), idx=i + 1) for i in range(2)]
+        tmp_dir = tempfile.mkdtemp(prefix="ethoscope_test_")
+        log_dir = os.path.join(tmp_dir, "log")
+        try:
+            self._write(_SmallSegmentsResultLogWriter, log_dir, rois)
+
+            log = ResultLogReader(log_dir)
+            self.assertGreater(len(log.segments), 2)
+            self.assertGreater(len(log.segments[0].index), 0)
+            self.assertEqual(log.metadata["comment"], "it's a test")
+            self.assertIn("stop_date_time", log.metadata)
+            self.assertEqual([v["var_name"] for v in log.var_map], ["x", "y", "is_inferred"])
+            self.assertEqual(len(log.select()), 300)
+            records = log.select(1, 2000, 3000)
+            self.assertEqual(records["t"].tolist(), sorted(range(2000, 3000, 100) * 2))
+            self.assertEqual(log.select(2, 9900)[["t", "y"]].tolist(), [(9900, -2)])
+
+            # the converted log is the same as the database of a SQLite writer
+            convert_result_log(log_dir, os.path.join(tmp_dir, "log.db"))
+            self._write(SQLiteResultWriter, os.path.join(tmp_dir, "sqlite.db"), rois)
+            self.assertEqual(self._tables(os.path.join(tmp_dir, "log.db")),
+                             self._tables(os.path.join(tmp_dir, "sqlite.db")))
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,48 @@
+__author__ = 'quentin'
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from ethoscope.core.segmented_analysis import merge_result_files
+
+
+class TestMergeResultFiles(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp(prefix="ethoscope_test_")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _make_segment(self, name, rows, stop):
+        path = os.path.join(self._dir, name)
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE ROI_MAP (roi_idx SMALLINT, roi_value SMALLINT, x SMALLINT,y SMALLINT,w SMALLINT,h SMALLINT)")
+        conn.execute("INSERT INTO ROI_MAP VALUES (1, 1, 0, 0, 10, 10)")
+        conn.execute("CREATE TABLE VAR_MAP (var_name CHAR(100), sql_type CHAR(100), functional_type CHAR(100))")
+        conn.execute("CREATE TABLE METADATA (field CHAR(100), value VARCHAR(3000))")
+        conn.execute("INSERT INTO METADATA VALUES ('stop_date_time', ?)", (stop,))
+        if len(rows) > 0:
+            conn.execute("INSERT INTO VAR_MAP VALUES ('x', 'SMALLINT', 'distance')")
+            conn.execute("CREATE TABLE ROI_1 (id INT PRIMARY KEY, t INT, x SMALLINT)")
+            conn.executemany("INSERT INTO ROI_1 VALUES (NULL, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_merge(self):
+        files = [self._make_segment("a.db", [], "1"),
+                 self._make_segment("b.db", [(0, 1), (50, 2)], "2"),
+                 self._make_segment("c.db", [(100, 3)], "3")]
+        out = os.path.join(self._dir, "out.db")
+        merge_result_files(files, out)
+
+        conn = sqlite3.connect(out)
+        self.assertEqual(conn.execute("SELECT t, x FROM ROI_1").fetchall(), [(0, 1), (50, 2), (100, 3)])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM ROI_MAP").fetchone()[0], 1)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM VAR_MAP").fetchone()[0], 1)
+        self.assertEqual(conn.execute("SELECT value FROM METADATA").fetchall(), [("3",)])
+        conn.close()
@@ -0,0 +1,350 @@
+__author__ = 'quentin'
+
+import itertools
+import unittest
+
+import cv2
+import numpy as np
+
+from ethoscope.tests.benchmarks.run_benchmarks import benchmark_tracker
+from ethoscope.tests.benchmarks.synthetic_arena import SyntheticArena
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+from ethoscope.trackers.batched_tracker import BatchedAdaptiveBGModel, ROIBatch
+from ethoscope.trackers.connected_components_tracker import ConnectedComponentsTracker
+from ethoscope.trackers.identity import IdentityAssigner, linear_assignment
+from ethoscope.trackers.multi_fly_tracker import MultiFlyTracker
+from ethoscope.core.data_point import DataPoint
+from ethoscope.core.roi import ROI
+from ethoscope.core.variables import XPosVariable, YPosVariable, Label
+from ethoscope.trackers.trackers import KalmanMotionModel, PositionHistory
+
+
+def _back_and_forth(t, x0, speed, x_min=30, x_max=370):
+    # the position, at time t (in ms), of an animal moving at a constant speed (in px/s) between two positions
+    span = x_max - x_min
+    d = (x0 - x_min + speed * t / 1000.) % (2 * span)
+    return x_min + (d if d < span else 2 * span - d)
+
+
+class _EagerIdentityAssigner(IdentityAssigner):
+    # identities are labelled as soon as they are detected
+    _min_detections = 1
+
+
+class _SmallLabelsIdentityAssigner(_EagerIdentityAssigner):
+    _max_label = 9
+
+
+class TestObjectModel(unittest.TestCase):
+
+    def _brute_force_distance(self, model, features):
+        # the original, non incremental, computation
+        last_row = model._history_length if model.is_ready else model._ring_buff_idx + 1
+        buff = model._ring_buff[:last_row]
+        means = np.mean(buff, 0)
+        stds = np.mean(np.abs(buff - means), 0)
+        if (stds == 0).any():
+            return 0
+        likelihoods = 1 / (stds * np.sqrt(2 * np.pi)) * np.exp(- (features - means) ** 2 / (2 * stds ** 2))
+        if np.any(likelihoods == 0):
+            return 0
+        return -np.sum(np.log10(likelihoods)) / len(likelihoods)
+
+    def test_distances(self):
+        rng = np.random.RandomState(1)
+        model = ObjectModel(history_length=50)
+        # we bypass `compute_features`, which needs images
+        model.compute_features = lambda img, contour: contour
+
+        candidates = rng.normal(5, 2, (4, 3))
+        for t in range(120):
+            model.update(None, rng.normal(5, 1, 3), t)
+            expected = [self._brute_force_distance(model, c) for c in candidates]
+            np.testing.assert_allclose(model.distances(candidates, t), expected, rtol=1e-4)
+            self.assertAlmostEqual(model.distance(candidates[0], t), expected[0], places=4)
+
+        # the model resets when it is not updated for too long
+        np.testing.assert_array_equal(model.distances(candidates, 10 ** 6), [0, 0, 0, 0])
+        self.assertFalse(model.is_ready)
+
+
+class TestKalmanMotionModel(unittest.TestCase):
+
+    def test_constant_velocity(self):
+        rng = np.random.RandomState(1)
+        model = KalmanMotionModel(acceleration_sd=10, measurement_sd=1)
+        self.assertFalse(model.is_ready)
+        # 20 px/s along x, 10 px/s along y, with a noisy measure every 200ms
+        for t in range(0, 10000, 200):
+            model.update(100 + .02 * t + rng.normal(0, 1), 50 + .01 * t + rng.normal(0, 1), t)
+        self.assertTrue(model.is_ready)
+
+        x, y, sd = model.predict(10200)
+        self.assertAlmostEqual(x, 100 + .02 * 10200, delta=2)
+        self.assertAlmostEqual(y, 50 + .01 * 10200, delta=2)
+        self.assertLess(sd, 3)
+        # the velocity is only extrapolated for a limited time
+        x_far, _, sd_far = model.predict(20000)
+        self.assertAlmostEqual(x_far, 100 + .02 * 10300, delta=2)
+        self.assertGreater(sd_far, sd)
+
+        distances = model.distances([[x, y], [x + 20, y], [x, y - 40]], 10200)
+        self.assertEqual(np.argmin(distances), 0)
+
+    def test_reset_on_jump(self):
+        model = KalmanMotionModel(acceleration_sd=10, measurement_sd=1)
+        for t in range(0, 2000, 200):
+            model.update(100, 50, t)
+        # another object, far away: the model starts again from it, without velocity
+        model.update(300, 50, 2200)
+        self.assertFalse(model.is_ready)
+        self.assertEqual(model.predict(2400)[0], 300)
+
+
+class TestIdentityAssigner(unittest.TestCase):
+
+    def test_linear_assignment(self):
+        rng = np.random.RandomState(1)
+        for n, m in [(1, 1), (2, 3), (4, 4), (3, 6), (5, 5)]:
+            cost = rng.uniform(0, 10, (n, m))
+            cols = linear_assignment(cost)
+            self.assertEqual(len(set(cols)), n)
+            best = min([sum(cost[range(n), list(p)]) for p in itertools.permutations(range(m), n)])
+            self.assertAlmostEqual(cost[range(n), cols].sum(), best)
+        self.assertRaises(ValueError, linear_assignment, np.zeros((3, 2)))
+
+    def test_stable_labels(self):
+        rng = np.random.RandomState(1)
+        assigner = IdentityAssigner(max_distance=40, min_sd=3, acceleration_sd=20, feature_sd=[.1])
+        # three animals, two of which cross each other, detected in a shuffled order
+        start = np.array([[10., 50.], [100., 50.], [50., 150.]])
+        velocity = np.array([[.05, 0], [-.05, 0], [0, -.01]])
+        features = np.array([[1.], [1.5], [2.]])
+        labels = None
+        for t in range(0, 4000, 100):
+            order = rng.permutation(3)
+            positions = start + velocity * t + rng.normal(0, .5, (3, 2))
+            out = assigner.assign(positions[order], features[order] + rng.normal(0, .05, (3, 1)), t)
+            frame_labels = [None] * 3
+            for k, (label, _) in zip(order, out):
+                frame_labels[k] = label
+            if t < 200:
+                # not labelled until detected three times
+                self.assertEqual(frame_labels, [None] * 3)
+                continue
+            if labels is None:
+                labels = frame_labels
+            self.assertEqual(frame_labels, labels)
+
+        # a lost animal keeps its label when found again
+        assigner.assign(start[:2] + velocity[:2] * 4000, features[:2], 4000)
+        out = assigner.assign(start + velocity * 4100, features, 4100)
+        self.assertEqual([l for l, _ in out], labels)
+
+    def test_recycled_labels(self):
+        # more animals than SMALLINT labels come and go: the labels of forgotten identities are used again
+        assigner = _EagerIdentityAssigner(max_distance=20, min_sd=3, acceleration_sd=20, feature_sd=[.1],
+                                          max_lost_duration=1000)
+        positions = np.array([(x, y) for x in range(0, 1000, 50) for y in range(0, 1000, 50)], np.float64)
+        features = np.ones((len(positions), 1))
+        labels = set()
+        n_frames = 2 ** 15 // len(positions) + 2
+        for i in range(n_frames):
+            # new animals in each frame, far from the previous ones, which are forgotten after the next frame
+            labels.update([l for l, _ in assigner.assign(positions + [1000 * i, 0], features, 1500 * i)])
+        self.assertGreater(n_frames * len(positions), 2 ** 15)
+        self.assertEqual(labels, set(range(2 * len(positions))))
+
+        # when all labels are used, the identity lost for the longest time is forgotten
+        assigner = _SmallLabelsIdentityAssigner(max_distance=20, min_sd=3, acceleration_sd=20, feature_sd=[.1])
+        for t in range(0, 2000, 100):
+            out = assigner.assign([[t, 0.]], [[1.]], t)
+            self.assertLessEqual(out[0][0], 9)
+        self.assertEqual(len(assigner.identities), 10)
+        self.assertEqual(min([idt.last_t for idt in assigner.identities]), 1000)
+
+
+class TestMultiFlyTracker(unittest.TestCase):
+
+    def test_stable_labels(self):
+        # five animals in one tube. Animals that touch can swap labels, so the tube is large enough for them to seldom touch
+        arena = SyntheticArena(resolution=(960, 720), n_rows=1, n_cols=1, n_animals_per_roi=5)
+        roi = arena.rois[0]
+        tracker = MultiFlyTracker(roi)
+        ox, oy = roi.offset
+        all_labels = set()
+        animal_labels = [[] for _ in range(5)]
+        for t in range(0, 30000, 100):
+            frame, positions = arena.frame(t / 1000.)
+            points = [p for p in tracker.track(t, frame) if not p["is_inferred"]]
+            all_labels.update([p["label"] for p in points])
+            # the background is learnt first
+            if t < 10000 or len(points) == 0:
+                continue
+            for k, (x, y) in enumerate(positions[0]):
+                dist = [np.hypot(p["x"] + ox - x, p["y"] + oy - y) for p in points]
+                if min(dist) < 8:
+                    animal_labels[k].append(points[int(np.argmin(dist))]["label"])
+
+        self.assertLessEqual(len(all_labels), 7)
+        for labels in animal_labels:
+            self.assertGreater(len(labels), 100)
+            most_common = max(set(labels), key=labels.count)
+            self.assertGreater(labels.count(most_common), .9 * len(labels))
+
+
+class TestPositionHistory(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        history = PositionHistory(10)
+        self.assertEqual(len(history.since(0)), 0)
+        self.assertIsNone(history.velocity(1000))
+        # two animals, every 100ms, moving at 10 and -20 px/s along x
+        for t in range(0, 1500, 100):
+            history.append(t, [DataPoint([XPosVariable(t // 100), YPosVariable(5), Label(0)]),
+                               DataPoint([XPosVariable(100 - t // 50), YPosVariable(5), Label(1)])])
+        self.assertEqual(len(history), 10)
+
+        last = history.last(3)
+        np.testing.assert_array_equal(last["t"], [1300, 1400, 1400])
+        np.testing.assert_array_equal(last["x"], [74, 14, 72])
+        self.assertEqual(last["xy_dist_log10x1000"][0], 0)
+        self.assertEqual(len(history.last(100)), 10)
+
+        np.testing.assert_array_equal(history.since(1200)["t"], [1200, 1200, 1300, 1300, 1400, 1400])
+        np.testing.assert_array_equal(history.since(0)["t"], np.repeat(range(1000, 1500, 100), 2))
+        self.assertEqual(len(history.since(2000)), 0)
+
+        np.testing.assert_allclose(history.velocity(300, label=0), (10, 0))
+        np.testing.assert_allclose(history.velocity(300, label=1), (-20, 0))
+        self.assertIsNone(history.velocity(0, label=1))
+
+
+class TestAdaptiveBGModel(unittest.TestCase):
+    _arena_kwargs = {"resolution": (640, 480), "n_rows": 3, "n_cols": 1}
+
+    def test_windowed_mode(self):
+        full = benchmark_tracker(AdaptiveBGModel, self._arena_kwargs, duration=30)
+        windowed = benchmark_tracker(AdaptiveBGModel, self._arena_kwargs, duration=30,
+                                     tracker_kwargs={"full_search_interval": 1000})
+        self.assertGreater(windowed["detections_per_animal"], .9 * full["detections_per_animal"])
+        self.assertLess(windowed["mean_error_px"], 1.5 * full["mean_error_px"] + .5)
+
+    def _track_tube(self, tracker_kwargs, hide=False, distractor=False):
+        """
+        Track an animal moving back and forth along a tube, at 60 px/s, from 10 frames per second.
+        After 20s, it is either hidden in two frames out of ten, or joined by a second animal moving the other way.
+
+        :return: the errors of inferred positions when the animal is hidden,
+            and the errors of the detected positions, with respect to the first animal
+        """
+        rng = np.random.RandomState(1)
+        w, h = 400, 80
+        # a fresh object model, that is ready after few frames
+        fg_model = AdaptiveBGModel.fg_model
+        AdaptiveBGModel.fg_model = ObjectModel(history_length=100)
+        try:
+            tracker = AdaptiveBGModel(ROI(np.array([[0, 0], [w - 1, 0], [w - 1, h - 1], [0, h - 1]]), 1),
+                                      **tracker_kwargs)
+            inferred_errors, detected_errors = [], []
+            for i in range(600):
+                t = i * 100
+                animals = [(_back_and_forth(t, 30, 60), 20)]
+                is_hidden = hide and i > 200 and i % 10 in (1, 2)
+                if is_hidden:
+                    animals = []
+                if distractor and i > 200:
+                    animals.append((_back_and_forth(t, 370, -60), 60))
+
+                frame = np.full((h, w), 200, np.uint8)
+                for x, y in animals:
+                    cv2.ellipse(frame, (int(x * 16), int(y * 16)), (12 * 16, 5 * 16), 0, 0, 360, 60, -1, cv2.LINE_AA, 4)
+                frame = np.clip(frame + rng.normal(0, 4, frame.shape), 0, 255).astype(np.uint8)
+
+                points = tracker.track(t, frame)
+                if i <= 200 or len(points) == 0:
+                    continue
+                error = np.hypot(points[0]["x"] - _back_and_forth(t, 30, 60), points[0]["y"] - 20)
+                if is_hidden:
+                    inferred_errors.append(error)
+                elif not points[0]["is_inferred"]:
+                    detected_errors.append(error)
+            return np.array(inferred_errors), np.array(detected_errors)
+        finally:
+            AdaptiveBGModel.fg_model = fg_model
+
+    def test_motion_model_inference(self):
+        last_position, _ = self._track_tube({}, hide=True)
+        predicted, _ = self._track_tube({"motion_model_noise": .3}, hide=True)
+        self.assertEqual(len(predicted), 80)
+        # the last position is, on average, 1.5 frames (i.e. 9 px) behind
+        self.assertGreater(np.mean(last_position), 6)
+        self.assertLess(np.mean(predicted), 2)
+
+    def test_motion_model_candidates(self):
+        _, default = self._track_tube({}, distractor=True)
+        _, with_model = self._track_tube({"motion_model_noise": .3}, distractor=True)
+        self.assertGreater(len(with_model), 350)
+        # without motion model, the position is the centre of mass of both animals
+        self.assertLess(np.mean(default < 5), .1)
+        # with it, the first animal is followed, including when both animals cross
+        self.assertGreater(np.mean(with_model < 5), .95)
+
+    def test_motion_gating(self):
+        arena = SyntheticArena(noise_sd=0, lighting_drift=0, **self._arena_kwargs)
+        trackers = [AdaptiveBGModel(r, motion_gate_threshold=5) for r in arena.rois]
+        t = 0
+        for t in range(0, 10000, 100):
+            frame, _ = arena.frame(t / 1000.)
+            for tr in trackers:
+                tr.track(t, frame)
+
+        # animals resting from the start are never detected
+        trackers = [tr for tr in trackers if len(tr.positions) > 0]
+        self.assertGreater(len(trackers), 0)
+
+        # the frame does not change anymore, so it is not analysed again
+        n_skipped = [tr.n_skipped_frames for tr in trackers]
+        for i in range(10):
+            t += 100
+            for tr in trackers:
+                points = tr.track(t, frame)
+                self.assertTrue(tr.last_frame_skipped)
+                self.assertEqual(points[0]["is_inferred"], 1)
+                self.assertEqual(points[0]["x"], tr.positions[-2][0]["x"])
+        self.assertEqual([tr.n_skipped_frames for tr in trackers], [n + 10 for n in n_skipped])
+
+
+class TestConnectedComponentsTracker(unittest.TestCase):
+    _arena_kwargs = {"resolution": (640, 480), "n_rows": 3, "n_cols": 1}
+
+    def test_same_as_contours(self):
+        contours = benchmark_tracker(AdaptiveBGModel, self._arena_kwargs, duration=30)
+        components = benchmark_tracker(ConnectedComponentsTracker, self._arena_kwargs, duration=30)
+        self.assertGreater(components["detections_per_animal"], .9 * contours["detections_per_animal"])
+        self.assertLess(components["mean_error_px"], 1.5 * contours["mean_error_px"] + .5)
+
+
+class TestBatchedAdaptiveBGModel(unittest.TestCase):
+    _arena_kwargs = {"resolution": (640, 480), "n_rows": 3, "n_cols": 2}
+
+    def test_same_as_adaptive_bg_model(self):
+        arena = SyntheticArena(**self._arena_kwargs)
+        # both classes start with an empty object model
+        fg_models = AdaptiveBGModel.fg_model, BatchedAdaptiveBGModel.fg_model
+        AdaptiveBGModel.fg_model, BatchedAdaptiveBGModel.fg_model = ObjectModel(), ObjectModel()
+        try:
+            trackers = [AdaptiveBGModel(r) for r in arena.rois]
+            batch = ROIBatch()
+            batched_trackers = [BatchedAdaptiveBGModel(r, batch=batch) for r in arena.rois]
+            n_points = 0
+            for t in range(0, 20000, 100):
+                frame, _ = arena.frame(t / 1000.)
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+                for tr, btr in zip(trackers, batched_trackers):
+                    points, batched_points = tr.track(t, frame), btr.track(t, frame)
+                    self.assertEqual([dict(p) for p in points], [dict(p) for p in batched_points])
+                    n_points += len(points)
+            self.assertGreater(n_points, 0)
+        finally:
+            AdaptiveBGModel.fg_model, BatchedAdaptiveBGModel.fg_model = fg_models
@@ -12,10 +12,10 @@ except:
 
 
 import numpy as np
-from scipy import ndimage
 from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance, WidthVariable, HeightVariable, PhiVariable, Label
-from ethoscope.core.data_point import DataPoint
+from ethoscope.core.data_point import DataPointSchema
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
+from ethoscope.utils.img_proc import grey_image
 
 import logging
 
@@ -43,6 +43,11 @@ class ObjectModel(object):
         self._mask_img_buff = None
         self._img_buff_shape = np.array([0,0])
 
+        # running sum of the features in the ring buffer, updated (in O(n_features)) when a row is written
+        self._ring_buff_sum = np.zeros(len(self._features_header), dtype=np.float64)
+        # the means and mean absolute deviations of the features, lazily computed after each update
+        self._stats = None
+
         self._last_updated_time = 0
         # If the model is not updated for this duration, it is reset. Patches #39
         self._max_unupdated_duration = 1 *  60 * 1000.0 #ms
@@ -56,37 +61,78 @@ class ObjectModel(object):
 
 
     def update(self, img, contour,time):
+        return self.update_features(self.compute_features(img,contour), time)
+
+    def update_features(self, features, time):
+        """
+        Add the features of a detected object (i.e. as computed by :meth:`compute_features`) to the model.
+
+        :param features: the features of the object
+        :type features: :class:`~numpy.ndarray`
+        :param time: the time of the frame, in ms
+        :type time: int
+        """
         self._last_updated_time = time
-        self._ring_buff[self._ring_buff_idx] = self.compute_features(img,contour)
+
+        # the overwritten row leaves the window (it is a row of zeros until the buffer is full)
+        self._ring_buff_sum -= self._ring_buff[self._ring_buff_idx]
+        self._ring_buff[self._ring_buff_idx] = features
+        self._ring_buff_sum += self._ring_buff[self._ring_buff_idx]
+        self._stats = None
 
         self._ring_buff_idx += 1
 
         if self._ring_buff_idx == self._history_length:
             self._is_ready = True
             self._ring_buff_idx = 0
+            # exact sum, once per cycle, so that rounding errors do not accumulate
+            self._ring_buff_sum = np.sum(self._ring_buff, 0, dtype=np.float64)
 
 
         return self._ring_buff[self._ring_buff_idx]
 
-    def distance(self, features,time):
-        if time - self._last_updated_time > self._max_unupdated_duration:
-            logging.warning("FG model not updated for too long. Resetting.")
-            self.__init__(self._history_length)
-            return 0
+    def _statistics(self):
+        if self._stats is not None:
+            return self._stats
 
         if not self._is_ready:
             last_row = self._ring_buff_idx + 1
         else:
             last_row = self._history_length
 
-        means = np.mean(self._ring_buff[:last_row ], 0)
+        means = self._ring_buff_sum / last_row
 
+        # the mean absolute deviation depends on the current mean, so it cannot be updated incrementally.
+        # it is computed at most once per update, and shared by all the candidates scored in between
         np.subtract(self._ring_buff[:last_row], means, self._std_buff[:last_row])
         np.abs(self._std_buff[:last_row], self._std_buff[:last_row])
 
         stds = np.mean(self._std_buff[:last_row], 0)
+        self._stats = means, stds
+        return self._stats
+
+    def distances(self, features, time):
+        """
+        The distance (i.e. the mean of the minus log10 likelihoods of each feature) of several candidate objects to the model.
+
+        :param features: the features of each candidate, one row per candidate (see :meth:`compute_features`)
+        :type features: :class:`~numpy.ndarray`
+        :param time: the time of the frame, in ms
+        :type time: int
+        :return: the distance of each candidate
+        :rtype: :class:`~numpy.ndarray`
+        """
+        features = np.asarray(features, dtype=np.float64).reshape(-1, len(self._features_header))
+        out = np.zeros(features.shape[0])
+
+        if time - self._last_updated_time > self._max_unupdated_duration:
+            logging.warning("FG model not updated for too long. Resetting.")
+            self.__init__(self._history_length)
+            return out
+
+        means, stds = self._statistics()
         if (stds == 0).any():
-            return 0
+            return out
 
         a = 1 / (stds* self._sqrt_2_pi)
 
@@ -94,11 +140,13 @@ class ObjectModel(object):
 
         likelihoods =  a * b
 
-        if np.any(likelihoods==0):
-            return 0
-        #print features, means
-        logls = np.sum(np.log10(likelihoods)) / len(likelihoods)
-        return -1.0 * logls
+        valid = np.all(likelihoods != 0, 1)
+        logls = np.sum(np.log10(likelihoods[valid]), 1) / likelihoods.shape[1]
+        out[valid] = -1.0 * logls
+        return out
+
+    def distance(self, features,time):
+        return self.distances(features, time)[0]
 
 
     def compute_features(self, img, contour):
@@ -114,9 +162,7 @@ class ObjectModel(object):
 
         sub_mask = self._mask_img_buff[0 : h, 0 : w]
 
-        sub_grey = self._roi_img_buff[ 0 : h, 0: w]
-
-        cv2.cvtColor(img[y : y + h, x : x + w, :],cv2.COLOR_BGR2GRAY,sub_grey)
+        sub_grey = grey_image(img[y : y + h, x : x + w], self._roi_img_buff[ 0 : h, 0: w])
         sub_mask.fill(0)
 
         cv2.drawContours(sub_mask,[contour],-1, 255,-1,offset=(-x,-y))
@@ -170,8 +216,11 @@ class BackgroundModel(object):
         self._bg_mean = None
         # self._bg_sd = None
 
-        self._buff_alpha_matrix = None
-        self._buff_invert_alpha_mat = None
+        # the pixels that are updated (i.e. not foreground)
+        self._buff_update_mask = None
+        # the mean background, as uint8. it is only converted when the background has changed
+        self._bg_mean_uint8 = None
+        self._bg_mean_uint8_is_valid = False
         # the time stamp of the frame las used to update
         self.last_t = 0
 
@@ -179,6 +228,21 @@ class BackgroundModel(object):
     def bg_img(self):
         return self._bg_mean
 
+    @property
+    def bg_img_uint8(self):
+        """
+        :return: The mean background, truncated to uint8 (as ``bg_img.astype(np.uint8)``). The array is reused.
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if self._bg_mean is None:
+            return None
+        if not self._bg_mean_uint8_is_valid:
+            if self._bg_mean_uint8 is None:
+                self._bg_mean_uint8 = np.empty(self._bg_mean.shape, np.uint8)
+            np.copyto(self._bg_mean_uint8, self._bg_mean, casting="unsafe")
+            self._bg_mean_uint8_is_valid = True
+        return self._bg_mean_uint8
+
     def increase_learning_rate(self):
         self._current_half_life  /=  self._increment
 
@@ -186,7 +250,7 @@ class BackgroundModel(object):
         self._current_half_life  *=  self._increment
 
 
-    def update(self, img_t, t, fg_mask=None):
+    def _learning_rate(self, t):
         dt = float(t - self.last_t)
         if dt < 0:
             # raise EthoscopeException("Negative time interval between two consecutive frames")
@@ -195,56 +259,92 @@ class BackgroundModel(object):
         # clip the half life to possible value:
         self._current_half_life = np.clip(self._current_half_life, self._min_half_life, self._max_half_life)
 
-        # ensure preallocated buffers exist. otherwise, initialise them
-        if self._bg_mean is None:
-            self._bg_mean = img_t.astype(np.float32)
-            # self._bg_sd = np.zeros_like(img_t)
-            # self._bg_sd.fill(128)
-
-        if self._buff_alpha_matrix is None:
-            self._buff_alpha_matrix = np.ones_like(img_t,dtype = np.float32)
-
         # the learning rate, alpha, is an exponential function of half life
         # it correspond to how much the present frame should account for the background
 
         lam =  np.log(2)/self._current_half_life
         # how much the current frame should be accounted for
-        alpha = 1 - np.exp(-lam * dt)
+        return 1 - np.exp(-lam * dt)
 
-        # set-p a matrix of learning rate. it is 0 where foreground map is true
-        self._buff_alpha_matrix.fill(alpha)
-        if fg_mask is not None:
-            cv2.dilate(fg_mask,None,fg_mask)
-            cv2.subtract(self._buff_alpha_matrix, self._buff_alpha_matrix, self._buff_alpha_matrix, mask=fg_mask)
+    def update(self, img_t, t, fg_mask=None):
+        alpha = self._learning_rate(t)
 
+        # ensure preallocated buffers exist. otherwise, initialise them
+        if self._bg_mean is None:
+            self._bg_mean = img_t.astype(np.float32)
+            # self._bg_sd = np.zeros_like(img_t)
+            # self._bg_sd.fill(128)
 
-        if self._buff_invert_alpha_mat is None:
-            self._buff_invert_alpha_mat = 1 - self._buff_alpha_matrix
+        # bg = alpha * img + (1 - alpha) * bg, in place, and only outside the (dilated) foreground mask, if any
+        if fg_mask is None:
+            cv2.accumulateWeighted(img_t, self._bg_mean, alpha)
         else:
-            np.subtract(1, self._buff_alpha_matrix, self._buff_invert_alpha_mat)
-
-        np.multiply(self._buff_alpha_matrix, img_t, self._buff_alpha_matrix)
-        np.multiply(self._buff_invert_alpha_mat, self._bg_mean, self._buff_invert_alpha_mat)
-        np.add(self._buff_alpha_matrix, self._buff_invert_alpha_mat, self._bg_mean)
+            cv2.dilate(fg_mask,None,fg_mask)
+            if self._buff_update_mask is None:
+                self._buff_update_mask = np.empty_like(fg_mask)
+            cv2.compare(fg_mask, 0, cv2.CMP_EQ, self._buff_update_mask)
+            cv2.accumulateWeighted(img_t, self._bg_mean, alpha, self._buff_update_mask)
 
+        self._bg_mean_uint8_is_valid = False
         self.last_t = t
 
 
 class AdaptiveBGModel(BaseTracker):
     _description = {"overview": "The default tracker for fruit flies. One animal per ROI.",
-                    "arguments": []}
+                    "arguments": [
+                        {"type": "number", "min": 0, "max": 60000, "step": 100, "name": "full_search_interval",
+                         "description": "If not 0, animals are searched in a small window around their predicted position, "
+                                        "and in the whole ROI (which updates the background) at least every this many milliseconds",
+                         "default": 0},
+                        {"type": "number", "min": 0, "max": 255, "step": 1, "name": "motion_gate_threshold",
+                         "description": "If not 0, frames in which a ROI did not change more than this (in grey levels) "
+                                        "are not analysed, and the animal is reported as not moving",
+                         "default": 0},
+                        {"type": "number", "min": 0, "max": 100, "step": 0.1, "name": "motion_model_noise",
+                         "description": "If not 0, the motion of animals is modelled, with random accelerations of this magnitude "
+                                        "(in ROI lengths/s^2, e.g. 1). Their predicted position is used to tell them apart from "
+                                        "other objects, and when they are not found",
+                         "default": 0}
+                    ]}
 
     fg_model = ObjectModel()
 
-    def __init__(self, roi, data=None):
+    # the variables of the data points found by this tracker
+    _data_point_schema = DataPointSchema.get([XPosVariable, YPosVariable, WidthVariable, HeightVariable, PhiVariable,
+                                              XYDistance])
+
+    def __init__(self, roi, data=None, full_search_interval=0, motion_gate_threshold=0, motion_model_noise=0):
         """
         An adaptive background subtraction model to find position of one animal in one roi.
 
+        In windowed mode (i.e. ``full_search_interval > 0``), the animal is searched only in a window around the position
+        predicted from its last two detections. The window is sized from the expected size of the animal and its recent velocity.
+        The whole ROI is searched instead when the animal was not detected (unambiguously) in the previous frame,
+        when the window search fails (no, several or invalid objects, or an object touching the window edge),
+        and at least every ``full_search_interval`` milliseconds.
+        The background model is only updated during full searches, so it stays up to date over the whole ROI
+        (its learning rate accounts for the time elapsed since its last update).
+
         TODO more description here
         :param roi:
         :param data:
+        :param full_search_interval: The maximal time, in ms, between two searches in the whole ROI. 0 disables the windowed mode.
+        :type full_search_interval: int
+        :param motion_gate_threshold: see :class:`~ethoscope.trackers.trackers.BaseTracker`. 0 disables motion gating.
+        :type motion_gate_threshold: float
+        :param motion_model_noise: see :class:`~ethoscope.trackers.trackers.BaseTracker`. 0 disables the motion model.
+            Otherwise, the predicted position of the animal also centres the search window,
+            and, when there are several objects, the one that is picked is the most likely given both its features and its position.
+        :type motion_model_noise: float
         :return:
         """
+        self._full_search_interval = full_search_interval
+        self._last_full_search_t = None
+        # the time and position of the last (unambiguous) detections, in the ROI
+        self._last_detections = deque(maxlen=2)
+        # the scaling factor of the last full pre-processing
+        self._scale = None
+
         self._previous_shape=None
         self._object_expected_size = 0.05 # proportion of the roi main axis
         self._max_area = (5 * self._object_expected_size) ** 2
@@ -266,7 +366,7 @@ class AdaptiveBGModel(BaseTracker):
         self._buff_fg_diff = None
         self._old_sum_fg = 0
 
-        super(AdaptiveBGModel, self).__init__(roi, data)
+        super(AdaptiveBGModel, self).__init__(roi, data, motion_gate_threshold, motion_model_noise)
 
     def _pre_process_input_minimal(self, img, mask, t, darker_fg=True):
         blur_rad = int(self._object_expected_size * np.max(img.shape) / 2.0)
@@ -275,13 +375,13 @@ class AdaptiveBGModel(BaseTracker):
             blur_rad += 1
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = np.empty(img.shape[0:2], np.uint8)
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey = grey_image(img, self._buff_grey)
         # cv2.imshow("dbg",self._buff_grey)
-        cv2.GaussianBlur(self._buff_grey,(blur_rad,blur_rad),1.2, self._buff_grey)
+        cv2.GaussianBlur(grey,(blur_rad,blur_rad),1.2, self._buff_grey)
         if darker_fg:
             cv2.subtract(255, self._buff_grey, self._buff_grey)
 
@@ -289,6 +389,7 @@ class AdaptiveBGModel(BaseTracker):
         mean = cv2.mean(self._buff_grey, mask)
 
         scale = 128. / mean[0]
+        self._scale = scale
 
         cv2.multiply(self._buff_grey, scale, dst = self._buff_grey)
 
@@ -305,7 +406,7 @@ class AdaptiveBGModel(BaseTracker):
 
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = np.empty(img.shape[0:2], np.uint8)
             self._buff_grey_blurred = np.empty_like(self._buff_grey)
             # self._buff_grey_blurred = np.empty_like(self._buff_grey)
             if mask is None:
@@ -316,9 +417,9 @@ class AdaptiveBGModel(BaseTracker):
             self._buff_convolved_mask  = (1/255.0 *  mask_conv.astype(np.float32))
 
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey = grey_image(img, self._buff_grey)
 
-        hist = cv2.calcHist([self._buff_grey], [0], None, [256], [0,255]).ravel()
+        hist = cv2.calcHist([grey], [0], None, [256], [0,255]).ravel()
         hist = np.convolve(hist, [1] * 3)
         mode =  np.argmax(hist)
 
@@ -335,7 +436,7 @@ class AdaptiveBGModel(BaseTracker):
 
         # cv2.GaussianBlur(self._buff_grey,(5,5), 1.5,self._buff_grey)
 
-        cv2.multiply(self._buff_grey, scale, dst = self._buff_grey)
+        cv2.multiply(grey, scale, dst = self._buff_grey)
 
 
         cv2.bitwise_and(self._buff_grey, mask, self._buff_grey)
@@ -353,15 +454,195 @@ class AdaptiveBGModel(BaseTracker):
 
 
     def _find_position(self, img, mask,t):
-
+        if self._full_search_interval > 0:
+            window = self._search_window(img.shape[0:2], t)
+            if window is not None:
+                try:
+                    return self._track_window(img, mask, t, window)
+                except NoPositionError:
+                    # lost or ambiguous within the window, we search the whole ROI
+                    pass
+
+        self._last_full_search_t = t
         grey = self._pre_process_input_minimal(img, mask, t)
         # grey = self._pre_process_input(img, mask, t)
         try:
             return self._track(img, grey, mask, t)
         except NoPositionError:
+            self._last_detections.clear()
             self._bg_model.update(grey, t)
             raise NoPositionError
 
+    def _unchanged_positions(self, t):
+        points = super(AdaptiveBGModel, self)._unchanged_positions(t)
+        # the animal did not move: the distance is the one of a null displacement (see `_locate`)
+        w_im = max(self._roi.rectangle[2:4])
+        no_motion = XYDistance(int(round(log10(1. / float(w_im)) * 1000)))
+        for p in points:
+            if XYDistance.header_name in p:
+                p.append(no_motion)
+        return points
+
+    def _search_window(self, shape, t):
+        if self._last_full_search_t is None or t - self._last_full_search_t >= self._full_search_interval:
+            return None
+        if len(self._last_detections) == 0:
+            return None
+
+        t1, x1, y1 = self._last_detections[-1]
+        vx, vy = 0.0, 0.0
+        if len(self._last_detections) == 2:
+            t0, x0, y0 = self._last_detections[0]
+            if t1 > t0:
+                vx, vy = (x1 - x0) / float(t1 - t0), (y1 - y0) / float(t1 - t0)
+
+        dt = t - t1
+        if self._motion_model is not None and self._motion_model.is_ready:
+            pred_x, pred_y, sd = self._motion_model.predict(t)
+            half_size = 2 * self._object_expected_size * max(shape) + 3 * sd
+        else:
+            pred_x, pred_y = x1 + vx * dt, y1 + vy * dt
+            half_size = 2 * self._object_expected_size * max(shape) + abs(vx + 1j * vy) * dt
+
+        h_im, w_im = shape
+        left, right = int(max(0, pred_x - half_size)), int(min(w_im, pred_x + half_size + 1))
+        top, bottom = int(max(0, pred_y - half_size)), int(min(h_im, pred_y + half_size + 1))
+        if right - left < 3 or bottom - top < 3:
+            return None
+        return left, top, right, bottom
+
+    def _track_window(self, img, mask, t, window):
+        bg = self._bg_model.bg_img_uint8
+        if bg is None or self._scale is None:
+            raise NoPositionError
+
+        left, top, right, bottom = window
+        h_im, w_im = img.shape[0:2]
+
+        # same pre-processing as `_pre_process_input_minimal`, on the window, plus a margin, so that the blur is identical
+        blur_rad = int(self._object_expected_size * np.max(img.shape) / 2.0)
+        if blur_rad % 2 == 0:
+            blur_rad += 1
+        margin = blur_rad // 2
+        m_left, m_top = max(0, left - margin), max(0, top - margin)
+        m_right, m_bottom = min(w_im, right + margin), min(h_im, bottom + margin)
+
+        grey = grey_image(img[m_top:m_bottom, m_left:m_right])
+        grey = cv2.GaussianBlur(grey, (blur_rad, blur_rad), 1.2)
+        cv2.subtract(255, grey, grey)
+        # the lighting is normalised as in the last full search
+        cv2.multiply(grey, self._scale, dst=grey)
+        grey = grey[top - m_top: bottom - m_top, left - m_left: right - m_left]
+        if mask is not None:
+            grey = cv2.bitwise_and(grey, mask[top:bottom, left:right])
+
+        fg = cv2.subtract(grey, bg[top:bottom, left:right])
+        cv2.threshold(fg, 20, 255, cv2.THRESH_TOZERO, dst=fg)
+        fg_backup = np.copy(fg)
+
+        n_fg_pix = cv2.countNonZero(fg)
+        if n_fg_pix == 0 or n_fg_pix / (1.0 * h_im * w_im) > self._max_area:
+            raise NoPositionError
+
+        if CV_VERSION == 3:
+            _, contours, hierarchy = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        else:
+            contours, hierarchy = cv2.findContours(fg, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        if len(contours) != 1:
+            raise NoPositionError
+        hull = cv2.approxPolyDP(contours[0], 1.2, True)
+        if hull.shape[0] < 3:
+            raise NoPositionError
+
+        # the animal may extend beyond the window
+        x, y, w, h = cv2.boundingRect(hull)
+        if (x == 0 and left > 0) or (y == 0 and top > 0) or \
+                (x + w == right - left and right < w_im) or (y + h == bottom - top and bottom < h_im):
+            raise NoPositionError
+
+        sub_img = img[top:bottom, left:right]
+        distance = self.fg_model.distance(self.fg_model.compute_features(sub_img, hull), t)
+        if distance > self._max_m_log_lik:
+            raise NoPositionError
+
+        x, y, w, h, angle, xy_dist = self._locate(hull, fg, fg_backup, (h_im, w_im), (left, top))
+
+        self._bg_model.decrease_learning_rate()
+        self.fg_model.update(sub_img, hull, t)
+        self._last_detections.append((t, x, y))
+        self._previous_shape = hull + np.array([left, top], dtype=hull.dtype)
+        return [self._data_point(x, y, w, h, angle, xy_dist)]
+
+    def _combined_distances(self, distances, positions, t):
+        """
+        Combine the distances of candidate objects to the object model (see :meth:`ObjectModel.distances`)
+        with the distances of their positions to the one predicted by the motion model, if any
+        (see :meth:`~ethoscope.trackers.trackers.KalmanMotionModel.distances`). x and y count as two more features.
+        """
+        if self._motion_model is None or not self._motion_model.is_ready:
+            return distances
+        n_features = len(self.fg_model.features_header)
+        return (n_features * distances + 2 * self._motion_model.distances(positions, t)) / (n_features + 2.)
+
+    def _locate(self, hull, fg, fg_backup, roi_shape, offset=(0, 0)):
+        """
+        The position (centre of mass), size and orientation of a detected object, in the ROI,
+        and its (log) distance to the previous position.
+        ``hull``, ``fg`` and ``fg_backup`` may be a window of the ROI, at ``offset``. ``fg`` is overwritten.
+        The centre of mass is the one of all the foreground, unless a motion model is used,
+        in which case it is restricted to the object.
+        """
+        (x,y) ,(w,h), angle  = cv2.minAreaRect(hull)
+
+        if w < h:
+            angle -= 90
+            w,h = h,w
+        angle = angle % 180
+
+        h_im = min(roi_shape)
+        w_im = max(roi_shape)
+        max_h = 2*h_im
+        if w>max_h or h>max_h:
+            raise NoPositionError
+
+        cv2.ellipse(fg ,((x,y), (int(w*1.5),int(h*1.5)),angle),255,-1)
+
+        #todo center mass just on the ellipse area
+        if self._motion_model is not None:
+            # the motion model needs the position of this object, not the one of all the foreground
+            ellipse = np.zeros_like(fg_backup)
+            cv2.ellipse(ellipse, ((x, y), (int(w * 1.5), int(h * 1.5)), angle), 255, -1)
+            cv2.bitwise_and(fg_backup, ellipse, fg_backup)
+        cv2.bitwise_and(fg_backup, fg, fg_backup)
+
+        # the position is the centre of mass of the foreground, within the ellipse
+        moments = cv2.moments(fg_backup)
+        if moments["m00"] == 0:
+            raise NoPositionError
+        x, y = moments["m10"] / moments["m00"], moments["m01"] / moments["m00"]
+        x, y = x + offset[0], y + offset[1]
+
+        pos = x +1.0j*y
+        pos /= w_im
+
+        xy_dist = round(log10(1./float(w_im) + abs(pos - self._old_pos))*1000)
+        self._old_pos = pos
+        return x, y, w, h, angle, xy_dist
+
+    def _data_point(self, x, y, w, h, angle, xy_dist):
+        return self._data_point_schema.data_point(round(x), round(y), round(w), round(h), round(angle), xy_dist)
+
+
+    def _foreground(self, grey):
+        """
+        Subtract the background from a pre-processed image, in ``self._buff_fg``.
+        Pixels that are not at least 20 grey levels darker than the background are set to 0.
+        """
+        bg = self._bg_model.bg_img_uint8
+        cv2.subtract(grey, bg, self._buff_fg)
+        cv2.threshold(self._buff_fg,20,255,cv2.THRESH_TOZERO, dst=self._buff_fg)
+        return self._buff_fg
 
     def _track(self, img,  grey, mask,t):
 
@@ -374,17 +655,14 @@ class AdaptiveBGModel(BaseTracker):
    #         self._old_sum_fg = 0
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
-        cv2.subtract(grey, bg, self._buff_fg)
-
-        cv2.threshold(self._buff_fg,20,255,cv2.THRESH_TOZERO, dst=self._buff_fg)
+        self._foreground(grey)
 
         # cv2.bitwise_and(self._buff_fg_backup,self._buff_fg,dst=self._buff_fg_diff)
         # sum_fg = cv2.countNonZero(self._buff_fg)
 
         self._buff_fg_backup = np.copy(self._buff_fg)
 
-        n_fg_pix = np.count_nonzero(self._buff_fg)
+        n_fg_pix = cv2.countNonZero(self._buff_fg)
         prop_fg_pix  = n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
         is_ambiguous = False
 
@@ -425,7 +703,9 @@ class AdaptiveBGModel(BaseTracker):
             elif len(hulls) > 1:
                 is_ambiguous = True
             cluster_features = [self.fg_model.compute_features(img, h) for h in hulls]
-            all_distances = [self.fg_model.distance(cf,t) for cf in cluster_features]
+            all_distances = self.fg_model.distances(cluster_features, t)
+            centres = [(x + w / 2., y + h / 2.) for x, y, w, h in [cv2.boundingRect(h) for h in hulls]]
+            all_distances = self._combined_distances(all_distances, centres, t)
             good_clust = np.argmin(all_distances)
 
             hull = hulls[good_clust]
@@ -444,37 +724,13 @@ class AdaptiveBGModel(BaseTracker):
             raise NoPositionError
 
 
-        (x,y) ,(w,h), angle  = cv2.minAreaRect(hull)
-
-        if w < h:
-            angle -= 90
-            w,h = h,w
-        angle = angle % 180
-
-        h_im = min(grey.shape)
-        w_im = max(grey.shape)
-        max_h = 2*h_im
-        if w>max_h or h>max_h:
-            raise NoPositionError
-
-        cv2.ellipse(self._buff_fg ,((x,y), (int(w*1.5),int(h*1.5)),angle),255,-1)
-
-        #todo center mass just on the ellipse area
-        cv2.bitwise_and(self._buff_fg_backup, self._buff_fg,self._buff_fg_backup)
-
-        y,x = ndimage.measurements.center_of_mass(self._buff_fg_backup)
-
-        pos = x +1.0j*y
-        pos /= w_im
-
-        xy_dist = round(log10(1./float(w_im) + abs(pos - self._old_pos))*1000)
+        x, y, w, h, angle, xy_dist = self._locate(hull, self._buff_fg, self._buff_fg_backup, grey.shape)
 
         # cv2.bitwise_and(self._buff_fg_diff,self._buff_fg,dst=self._buff_fg_diff)
         # sum_diff = cv2.countNonZero(self._buff_fg_diff)
         # xor_dist = (sum_fg  + self._old_sum_fg - 2*sum_diff)  / float(sum_fg  + self._old_sum_fg)
         # xor_dist *=1000.
         # self._old_sum_fg = sum_fg
-        self._old_pos = pos
 
 
         if mask is not None:
@@ -483,28 +739,15 @@ class AdaptiveBGModel(BaseTracker):
         if is_ambiguous:
             self._bg_model.increase_learning_rate()
             self._bg_model.update(grey, t)
+            self._last_detections.clear()
         else:
             self._bg_model.decrease_learning_rate()
             self._bg_model.update(grey, t, self._buff_fg)
+            self._last_detections.append((t, x, y))
 
         self.fg_model.update(img, hull,t)
 
-        x_var = XPosVariable(int(round(x)))
-        y_var = YPosVariable(int(round(y)))
-        distance = XYDistance(int(xy_dist))
-        #xor_dist = XorDistance(int(xor_dist))
-        w_var = WidthVariable(int(round(w)))
-        h_var = HeightVariable(int(round(h)))
-        phi_var = PhiVariable(int(round(angle)))
-        # mlogl =   mLogLik(int(distance*1000))
-
-        out = DataPoint([x_var, y_var, w_var, h_var,
-                         phi_var,
-                         #mlogl,
-                         distance,
-                         #xor_dist
-                        #Label(0)
-                         ])
+        out = self._data_point(x, y, w, h, angle, xy_dist)
 
 
         self._previous_shape=np.copy(hull)
@@ -0,0 +1,153 @@
+__author__ = 'quentin'
+
+from math import log10, sqrt, atan2, degrees
+
+import cv2
+import numpy as np
+
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel, ObjectModel
+from ethoscope.trackers.trackers import NoPositionError
+from ethoscope.utils.img_proc import grey_image
+
+
+class ConnectedComponentsTracker(AdaptiveBGModel):
+    _description = {"overview": "A faster variant of the default tracker, based on connected components. One animal per ROI.",
+                    "arguments": [
+                        {"type": "number", "min": 0, "max": 255, "step": 1, "name": "motion_gate_threshold",
+                         "description": "If not 0, frames in which a ROI did not change more than this (in grey levels) "
+                                        "are not analysed, and the animal is reported as not moving",
+                         "default": 0},
+                        {"type": "number", "min": 0, "max": 100, "step": 0.1, "name": "motion_model_noise",
+                         "description": "If not 0, the motion of animals is modelled, with random accelerations of this magnitude "
+                                        "(in ROI lengths/s^2, e.g. 1). Their predicted position is used to tell them apart from "
+                                        "other objects, and when they are not found",
+                         "default": 0}
+                    ]}
+
+    # the features of this tracker are not exactly the ones of `AdaptiveBGModel`, so it has its own object model
+    fg_model = ObjectModel()
+
+    def __init__(self, roi, data=None, motion_gate_threshold=0, motion_model_noise=0):
+        """
+        The same adaptive background subtraction model as :class:`~ethoscope.trackers.adaptive_bg_tracker.AdaptiveBGModel`,
+        in which foreground objects are found by labelling connected components, in a single pass,
+        rather than with contours. Labelling is restricted to the bounding box of all foreground pixels
+        (i.e. typically, a small part of the ROI).
+        The area, bounding box, orientation, size and (intensity weighted) centre of mass
+        of each object are computed from its statistics and image moments,
+        which are only computed within its bounding box.
+
+        The recorded variables (x, y, w, h, phi and xy_dist) are the same, but their values can slightly differ:
+        ``w`` and ``h`` are the axes of the ellipse that has the same moments as the object,
+        rather than the sides of its minimal bounding rectangle, and the centre of mass only uses the pixels of the object.
+
+        :param roi:
+        :param data:
+        :param motion_gate_threshold: see :class:`~ethoscope.trackers.trackers.BaseTracker`. 0 disables motion gating.
+        :type motion_gate_threshold: float
+        :param motion_model_noise: see :class:`~ethoscope.trackers.adaptive_bg_tracker.AdaptiveBGModel`. 0 disables the motion model.
+        :type motion_model_noise: float
+        :return:
+        """
+        super(ConnectedComponentsTracker, self).__init__(roi, data, motion_gate_threshold=motion_gate_threshold,
+                                                         motion_model_noise=motion_model_noise)
+
+    def _object_properties(self, img, fg, labels, stats, i, offset):
+        """
+        The features (see :meth:`~ethoscope.trackers.adaptive_bg_tracker.ObjectModel.compute_features`) and the
+        geometry of a connected component, from its moments, within its bounding box.
+        ``img``, ``fg`` and ``labels`` are the part of the ROI, at ``offset``, that was labelled.
+        """
+        x, y, w, h, area = stats[i]
+        component = cv2.compare(labels[y: y + h, x: x + w], int(i), cv2.CMP_EQ)
+
+        m = cv2.moments(component, True)
+        mu20, mu02, mu11 = m["mu20"] / m["m00"], m["mu02"] / m["m00"], m["mu11"] / m["m00"]
+        delta = sqrt(4 * mu11 ** 2 + (mu20 - mu02) ** 2)
+        # the axes of the ellipse with the same second order moments
+        major = 4 * sqrt(max((mu20 + mu02 + delta) / 2, 0))
+        minor = 4 * sqrt(max((mu20 + mu02 - delta) / 2, 0))
+        angle = degrees(0.5 * atan2(2 * mu11, mu20 - mu02)) % 180
+
+        # the centre of mass of the component, weighted by the foreground intensity
+        weighted = cv2.moments(cv2.bitwise_and(fg[y: y + h, x: x + w], component))
+        x_com = offset[0] + x + weighted["m10"] / weighted["m00"]
+        y_com = offset[1] + y + weighted["m01"] / weighted["m00"]
+
+        mean_col = cv2.mean(grey_image(img[y: y + h, x: x + w]), component)[0]
+        features = np.array([log10(area + 1.0), minor + 1, mean_col + 1])
+        return features, (x_com, y_com, major, minor, angle)
+
+    def _track(self, img,  grey, mask,t):
+
+        if self._bg_model.bg_img is None:
+            self._buff_fg = np.empty_like(grey)
+            self._old_pos = 0.0 +0.0j
+            raise NoPositionError
+
+        self._foreground(grey)
+
+        n_fg_pix = cv2.countNonZero(self._buff_fg)
+        prop_fg_pix  = n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
+        is_ambiguous = False
+
+        if prop_fg_pix > self._max_area or prop_fg_pix == 0:
+            self._bg_model.increase_learning_rate()
+            raise NoPositionError
+
+        # we only label the region that contains foreground pixels
+        bx, by, bw, bh = cv2.boundingRect(self._buff_fg)
+        fg = self._buff_fg[by: by + bh, bx: bx + bw]
+        sub_img = img[by: by + bh, bx: bx + bw]
+        n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(fg, connectivity=8, ltype=cv2.CV_32S)
+
+        # label 0 is the background. As contours with less than three vertices, objects that are points or lines are ignored
+        valid = [i for i in range(1, n_labels)
+                 if stats[i, cv2.CC_STAT_WIDTH] > 1 and stats[i, cv2.CC_STAT_HEIGHT] > 1]
+
+        if n_labels > 2:
+            if not self.fg_model.is_ready:
+                raise NoPositionError
+            if len(valid) < 1:
+                raise NoPositionError
+            elif len(valid) > 1:
+                is_ambiguous = True
+            properties = [self._object_properties(sub_img, fg, labels, stats, i, (bx, by)) for i in valid]
+            all_distances = self.fg_model.distances([f for f, _ in properties], t)
+            all_distances = self._combined_distances(all_distances, [g[0:2] for _, g in properties], t)
+            good_clust = np.argmin(all_distances)
+            features, geometry = properties[good_clust]
+            distance = all_distances[good_clust]
+        else:
+            if len(valid) == 0:
+                self._bg_model.increase_learning_rate()
+                raise NoPositionError
+            features, geometry = self._object_properties(sub_img, fg, labels, stats, valid[0], (bx, by))
+            distance = self.fg_model.distance(features, t)
+
+        if distance > self._max_m_log_lik:
+            self._bg_model.increase_learning_rate()
+            raise NoPositionError
+
+        x, y, w, h, angle = geometry
+        h_im = min(grey.shape)
+        w_im = max(grey.shape)
+        max_h = 2*h_im
+        if w>max_h or h>max_h:
+            raise NoPositionError
+
+        pos = (x +1.0j*y) / w_im
+        xy_dist = round(log10(1./float(w_im) + abs(pos - self._old_pos))*1000)
+        self._old_pos = pos
+
+        if is_ambiguous:
+            self._bg_model.increase_learning_rate()
+            self._bg_model.update(grey, t)
+        else:
+            # the animal, and its surroundings, are not learnt as background
+            cv2.ellipse(self._buff_fg, ((x, y), (int(w * 1.5), int(h * 1.5)), angle), 255, -1)
+            self._bg_model.decrease_learning_rate()
+            self._bg_model.update(grey, t, self._buff_fg)
+
+        self.fg_model.update_features(features, t)
+        return [self._data_point(x, y, w, h, angle, xy_dist)]
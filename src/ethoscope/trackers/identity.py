@@ -0,0 +1,305 @@
+__author__ = 'quentin'
+
+import heapq
+import numpy as np
+
+from ethoscope.trackers.trackers import KalmanMotionModel
+
+
+def linear_assignment(cost):
+    """
+    Solve the linear assignment problem: assign each row of a cost matrix to a different column,
+    so that the sum of the costs is minimal.
+    This is the Hungarian algorithm, as successive shortest augmenting paths with dual potentials,
+    in O(n_rows^2 * n_cols) time.
+
+    :param cost: the cost of each (row, column) pair. There must not be more rows than columns.
+    :type cost: :class:`~numpy.ndarray`
+    :return: the column assigned to each row
+    :rtype: :class:`~numpy.ndarray`
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    n, m = cost.shape
+    if n > m:
+        raise ValueError("The cost matrix cannot have more rows than columns")
+
+    # 1-based indices. column 0 is a virtual column, from which augmenting paths start
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of_col = np.zeros(m + 1, np.int)
+    way = np.zeros(m + 1, np.int)
+
+    for i in range(1, n + 1):
+        row_of_col[0] = i
+        j0 = 0
+        min_v = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, np.bool)
+        while True:
+            used[j0] = True
+            i0 = row_of_col[j0]
+            free = ~used
+            free[0] = False
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < min_v[1:])
+            min_v[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, min_v, np.inf)
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+
+            used_cols = np.nonzero(used)[0]
+            u[row_of_col[used_cols]] += delta
+            v[used_cols] -= delta
+            min_v[free] -= delta
+            j0 = j1
+            if row_of_col[j0] == 0:
+                break
+
+        # augment along the path
+        while j0 != 0:
+            j1 = way[j0]
+            row_of_col[j0] = row_of_col[j1]
+            j0 = j1
+
+    out = np.empty(n, np.int)
+    for j in range(1, m + 1):
+        if row_of_col[j] != 0:
+            out[row_of_col[j] - 1] = j - 1
+    return out
+
+
+class _Identity(object):
+    def __init__(self, x, y, features, t, motion_model):
+        # identities are labelled once they have been detected enough times
+        self.label = None
+        self.motion_model = motion_model
+        self.motion_model.update(x, y, t)
+        self.features = np.array(features, dtype=np.float64)
+        self.x, self.y = x, y
+        self.first_t = t
+        self.last_t = t
+        self.n_detections = 1
+
+    def update(self, x, y, features, t, feature_smoothing):
+        self.motion_model.update(x, y, t)
+        self.features += feature_smoothing * (np.asarray(features) - self.features)
+        self.x, self.y = x, y
+        self.last_t = t
+        self.n_detections += 1
+
+
+class IdentityAssigner(object):
+    # the cost, in (squared) standard deviations, of leaving an identity or a detection unassigned
+    _unassigned_cost = 4.5
+    # how fast the features of an identity follow the ones of its detections
+    _feature_smoothing = .3
+    # identities detected fewer times than this have no label, and are dropped as soon as they are lost (they were probably noise)
+    _min_detections = 3
+    # labels are stored as SMALLINT
+    _max_label = 2 ** 15 - 1
+
+    def __init__(self, max_distance, min_sd, acceleration_sd, feature_sd, max_lost_duration=5 * 60 * 1000):
+        """
+        Link the objects detected in successive frames, so that each animal keeps the same label.
+
+        Each identity has a motion model (see :class:`~ethoscope.trackers.trackers.KalmanMotionModel`),
+        which predicts its position, and the (smoothed) features of its last detections (e.g. its size).
+        In each frame, detections are assigned to identities so that the total cost is minimal (see :func:`linear_assignment`).
+        The cost of a pair is half the squared distance, in standard deviations, between the detection and the identity,
+        for the position and each feature. Leaving an identity or a detection unassigned has a fixed cost.
+        Detections that are not assigned get a new identity.
+        An identity is only labelled once it has been detected ``_min_detections`` times, so short lived objects
+        (e.g. fragments of an animal) do not use labels. The labels of forgotten identities are reused,
+        so labels stay small, and within ``_max_label``, whatever the duration of the experiment.
+
+        Only pairs closer than ``max_distance`` (and than three standard deviations) are considered (gating).
+        They are found from the detections sorted by x, so gating is O(n log n).
+        The gated pairs define a sparse graph, and the assignment is solved independently in each of its connected components,
+        which stay small even when there are many animals.
+
+        :param max_distance: the maximal distance, in pixels, between an identity and a detection assigned to it
+        :type max_distance: float
+        :param min_sd: the minimal standard deviation of the predicted positions, in pixels (e.g. half the size of animals)
+        :type min_sd: float
+        :param acceleration_sd: the standard deviation of the random accelerations of animals, in pixels/s^2
+        :type acceleration_sd: float
+        :param feature_sd: the standard deviation of each feature
+        :type feature_sd: list(float)
+        :param max_lost_duration: the time, in ms, after which an identity that is not detected anymore is forgotten
+        :type max_lost_duration: int
+        """
+        self._max_distance = float(max_distance)
+        self._min_sd = float(min_sd)
+        self._acceleration_sd = acceleration_sd
+        self._feature_sd = np.array(feature_sd, dtype=np.float64)
+        self._max_lost_duration = max_lost_duration
+        self._identities = []
+        self._next_label = 0
+        # a heap of the labels of forgotten identities
+        self._free_labels = []
+        self._last_t = None
+
+    @property
+    def identities(self):
+        return self._identities
+
+    def _new_identity(self, x, y, features, t):
+        motion_model = KalmanMotionModel(self._acceleration_sd, self._min_sd / 2., max_extrapolation=500)
+        identity = _Identity(x, y, features, t, motion_model)
+        self._identities.append(identity)
+        return identity
+
+    def _new_label(self):
+        # the smallest label that is not used
+        if len(self._free_labels) > 0:
+            return heapq.heappop(self._free_labels)
+        if self._next_label <= self._max_label:
+            self._next_label += 1
+            return self._next_label - 1
+        # all labels are used: the identity that was lost for the longest time is forgotten
+        oldest = min([idt for idt in self._identities if idt.label is not None], key=lambda idt: idt.last_t)
+        self._identities.remove(oldest)
+        return oldest.label
+
+    def _forget_lost(self, t):
+        kept = []
+        for idt in self._identities:
+            if idt.last_t == self._last_t or \
+                    (idt.n_detections >= self._min_detections and t - idt.last_t <= self._max_lost_duration):
+                kept.append(idt)
+            elif idt.label is not None:
+                heapq.heappush(self._free_labels, idt.label)
+        self._identities = kept
+
+    def _gated_pairs(self, predictions, positions):
+        # all (identity, detection) pairs within the gate of the identity
+        order = np.argsort(positions[:, 0], kind="mergesort")
+        sorted_x = positions[order, 0]
+        pairs_i, pairs_j = [], []
+        for i, (x, y, sd) in enumerate(predictions):
+            radius = min(3 * sd, self._max_distance)
+            lo = np.searchsorted(sorted_x, x - radius, "left")
+            hi = np.searchsorted(sorted_x, x + radius, "right")
+            candidates = order[lo:hi]
+            sq_dist = (positions[candidates, 0] - x) ** 2 + (positions[candidates, 1] - y) ** 2
+            candidates = candidates[sq_dist <= radius ** 2]
+            pairs_i.extend([i] * len(candidates))
+            pairs_j.extend(candidates)
+        return np.array(pairs_i, np.int), np.array(pairs_j, np.int)
+
+    def _components(self, n_identities, n_detections, pairs_i, pairs_j):
+        # connected components (union-find) of the bipartite graph of the gated pairs. detections are nodes n_identities + j
+        parent = range(n_identities + n_detections)
+
+        def find(a):
+            while parent[a] != a:
+                parent[a] = parent[parent[a]]
+                a = parent[a]
+            return a
+
+        for i, j in zip(pairs_i, pairs_j):
+            ri, rj = find(i), find(n_identities + j)
+            if ri != rj:
+                parent[ri] = rj
+
+        components = {}
+        for k, (i, j) in enumerate(zip(pairs_i, pairs_j)):
+            components.setdefault(find(i), []).append(k)
+        return components.values()
+
+    def _solve_component(self, ids, dets, costs):
+        n_i, n_d = len(ids), len(dets)
+        big = 1e9
+        if n_i == 1 or n_d == 1:
+            # a single pair, at most, can be assigned: the cheapest one, if it costs less than leaving both unassigned
+            r, c = np.unravel_index(np.argmin(costs), costs.shape)
+            if costs[r, c] < 2 * self._unassigned_cost:
+                return [(ids[r], dets[c])]
+            return []
+
+        # square problem: identities and detections, each with a "dummy" partner meaning unassigned
+        full = np.full((n_i + n_d, n_d + n_i), big)
+        full[:n_i, :n_d] = costs
+        full[:n_i, n_d:][np.diag_indices(n_i)] = self._unassigned_cost
+        full[n_i:, :n_d][np.diag_indices(n_d)] = self._unassigned_cost
+        full[n_i:, n_d:] = 0
+        cols = linear_assignment(full)
+        return [(ids[r], dets[c]) for r, c in enumerate(cols[:n_i]) if c < n_d and costs[r, c] < big]
+
+    def _match(self, identities, predictions, positions, features):
+        # the optimal assignment of detections to identities, as pairs of indices, within each connected component
+        pairs_i, pairs_j = self._gated_pairs(predictions, positions)
+        if len(pairs_i) == 0:
+            return []
+
+        pred = np.array(predictions)[pairs_i]
+        sq_dist = (positions[pairs_j, 0] - pred[:, 0]) ** 2 + (positions[pairs_j, 1] - pred[:, 1]) ** 2
+        id_features = np.array([identities[i].features for i in pairs_i])
+        feature_dev = (features[pairs_j] - id_features) / self._feature_sd
+        pair_costs = .5 * (sq_dist / pred[:, 2] ** 2 + np.sum(feature_dev ** 2, 1))
+
+        matches = []
+        for component in self._components(len(identities), len(positions), pairs_i, pairs_j):
+            ids = sorted(set(pairs_i[component]))
+            dets = sorted(set(pairs_j[component]))
+            costs = np.full((len(ids), len(dets)), 1e9)
+            costs[np.searchsorted(ids, pairs_i[component]), np.searchsorted(dets, pairs_j[component])] = pair_costs[component]
+            matches.extend(self._solve_component(ids, dets, costs))
+        return matches
+
+    def assign(self, positions, features, t):
+        """
+        Assign detected objects to identities (creating new identities for new objects), and update the identities.
+        Identities detected in the previous frame are assigned first. The ones that were lost are then assigned
+        the remaining detections. Therefore, the wide gates of lost identities do not merge components.
+
+        :param positions: the x and y position of each detection
+        :type positions: :class:`~numpy.ndarray`
+        :param features: the features of each detection (e.g. log area), as many as ``feature_sd``
+        :type features: :class:`~numpy.ndarray`
+        :param t: the time, in ms
+        :type t: int
+        :return: the label of each detection (``None`` whilst its identity has not been detected ``_min_detections`` times),
+            and its previous position (``None`` for new identities)
+        :rtype: list((int, (float, float)))
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        features = np.asarray(features, dtype=np.float64).reshape(len(positions), -1)
+        self._forget_lost(t)
+
+        identities = self._identities
+        recent = [i for i, idt in enumerate(identities) if idt.last_t == self._last_t]
+        lost = [i for i, idt in enumerate(identities) if idt.last_t != self._last_t]
+
+        matches = []
+        remaining = np.arange(len(positions))
+        for group in (recent, lost):
+            if len(group) == 0 or len(remaining) == 0:
+                continue
+            predictions = [identities[i].motion_model.predict(t) for i in group]
+            predictions = [(x, y, max(sd, self._min_sd)) for x, y, sd in predictions]
+            group_matches = self._match([identities[i] for i in group], predictions,
+                                        positions[remaining], features[remaining])
+            matches.extend([(group[i], remaining[j]) for i, j in group_matches])
+            matched = set([remaining[j] for _, j in group_matches])
+            remaining = np.array([j for j in remaining if j not in matched], np.int)
+
+        assigned = [None] * len(positions)
+        previous = [None] * len(positions)
+        for i, j in matches:
+            idt = identities[i]
+            previous[j] = (idt.x, idt.y)
+            idt.update(positions[j, 0], positions[j, 1], features[j], t, self._feature_smoothing)
+            assigned[j] = idt
+
+        for j in range(len(positions)):
+            if assigned[j] is None:
+                assigned[j] = self._new_identity(positions[j, 0], positions[j, 1], features[j], t)
+
+        # labels are given once all identities are updated, as giving a label may forget an identity
+        for idt in assigned:
+            if idt.label is None and idt.n_detections >= self._min_detections:
+                idt.label = self._new_label()
+        self._last_t = t
+        return [(idt.label, prev) for idt, prev in zip(assigned, previous)]
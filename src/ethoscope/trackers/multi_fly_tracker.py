@@ -6,11 +6,12 @@ import cv2
 CV_VERSION = int(cv2.__version__.split(".")[0])
 
 import numpy as np
-from scipy import ndimage
 from ethoscope.core.variables import XPosVariable, YPosVariable, XYDistance, WidthVariable, HeightVariable, PhiVariable, Label
-from ethoscope.core.data_point import DataPoint
+from ethoscope.core.data_point import DataPointSchema
+from ethoscope.trackers.identity import IdentityAssigner
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
 from ethoscope.utils.debug import EthoscopeException
+from ethoscope.utils.img_proc import grey_image
 import logging
 
 
@@ -21,18 +22,29 @@ class ForegroundModel(object):
 
 
 class MultiFlyTracker(BaseTracker):
-    _description = {"overview": "An experimental tracker to monitor several animals per ROI.",
-                    "arguments": []}
-
-
-
-    def __init__(self, roi, data=None):
+    _description = {"overview": "An experimental tracker to monitor several animals per ROI, each with its own label.",
+                    "arguments": [
+                        {"type": "number", "min": 0.01, "max": 1, "step": 0.01, "name": "max_displacement",
+                         "description": "The maximal distance an animal can move between two frames, "
+                                        "relative to the longest side of the ROI",
+                         "default": 0.25}
+                    ]}
+
+    # the variables of the data points found by this tracker
+    _data_point_schema = DataPointSchema.get([XPosVariable, YPosVariable, WidthVariable, HeightVariable, PhiVariable,
+                                              XYDistance, Label])
+
+    def __init__(self, roi, data=None, max_displacement=0.25):
         """
-        An adaptive background subtraction model to find position of one animal in one roi.
+        An adaptive background subtraction model to find position of several animals in one roi.
+        Objects are linked from frame to frame (see :class:`~ethoscope.trackers.identity.IdentityAssigner`),
+        so that each animal has a stable ``label``, and its ``xy_dist`` is the distance to its own previous position.
 
         TODO more description here
         :param roi:
         :param data:
+        :param max_displacement: The maximal distance an animal can move between two frames, relative to the longest side of the ROI.
+        :type max_displacement: float
         :return:
         """
         self._previous_shape=None
@@ -58,6 +70,15 @@ class MultiFlyTracker(BaseTracker):
 
         super(MultiFlyTracker, self).__init__(roi, data)
 
+        axis = roi.longest_axis
+        # the minimal area of an animal, in pixels
+        self._min_area = (self._object_expected_size * axis / 4.) ** 2
+        # features: log10 of the area and of the length of objects
+        self._identity_assigner = IdentityAssigner(max_distance=max_displacement * axis,
+                                                   min_sd=self._object_expected_size * axis / 2.,
+                                                   acceleration_sd=axis,
+                                                   feature_sd=[.15, .1])
+
     def _pre_process_input_minimal(self, img, mask, t, darker_fg=True):
         blur_rad = int(self._object_expected_size * np.max(img.shape) / 2.0)
 
@@ -65,13 +86,13 @@ class MultiFlyTracker(BaseTracker):
             blur_rad += 1
 
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = np.empty(img.shape[0:2], np.uint8)
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey = grey_image(img, self._buff_grey)
         # cv2.imshow("dbg",self._buff_grey)
-        cv2.GaussianBlur(self._buff_grey,(blur_rad,blur_rad),1.2, self._buff_grey)
+        cv2.GaussianBlur(grey,(blur_rad,blur_rad),1.2, self._buff_grey)
         if darker_fg:
             cv2.subtract(255, self._buff_grey, self._buff_grey)
 
@@ -110,7 +131,7 @@ class MultiFlyTracker(BaseTracker):
    #         self._old_sum_fg = 0
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
+        bg = self._bg_model.bg_img_uint8
         cv2.subtract(grey, bg, self._buff_fg)
 
         cv2.threshold(self._buff_fg,20,255,cv2.THRESH_TOZERO, dst=self._buff_fg)
@@ -120,7 +141,7 @@ class MultiFlyTracker(BaseTracker):
 
         self._buff_fg_backup = np.copy(self._buff_fg)
 
-        n_fg_pix = np.count_nonzero(self._buff_fg)
+        n_fg_pix = cv2.countNonZero(self._buff_fg)
         prop_fg_pix  = n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
         is_ambiguous = False
 
@@ -156,7 +177,7 @@ class MultiFlyTracker(BaseTracker):
             raise NoPositionError
 
 
-        out_pos = []
+        objects = []
         for vc in valid_contours:
             (x,y) ,(w,h), angle  = cv2.minAreaRect(vc)
 
@@ -170,40 +191,35 @@ class MultiFlyTracker(BaseTracker):
             max_h = 2*h_im
             if w>max_h or h>max_h:
                 continue
-            pos = x +1.0j*y
-            pos /= w_im
-
-            # fixme some matching needed here
-            #xy_dist = round(log10(1./float(w_im) + abs(pos - self._old_pos))*1000)
+            # thin fragments (e.g. the edges of an animal that is being learnt as background) are not animals
+            area = cv2.contourArea(vc)
+            if area < self._min_area:
+                continue
 
             cv2.ellipse(self._buff_fg ,((x,y), (int(w*1.5),int(h*1.5)),angle),255,-1)
+            objects.append((x, y, w, h, angle, [log10(area + 1.0), log10(w + 1.0)]))
 
+        if len(objects) == 0:
+            self._bg_model.increase_learning_rate()
+            raise NoPositionError
 
-            x_var = XPosVariable(int(round(x)))
-            y_var = YPosVariable(int(round(y)))
-            # distance = XYDistance(int(xy_dist))
-            #xor_dist = XorDistance(int(xor_dist))
-            w_var = WidthVariable(int(round(w)))
-            h_var = HeightVariable(int(round(h)))
-            phi_var = PhiVariable(int(round(angle)))
-            # mlogl =   mLogLik(int(distance*1000))
-
-            out = DataPoint([x_var, y_var, w_var, h_var,
-                             phi_var,
-                             #mlogl,
-                             # distance,
-                             #xor_dist
-                            #Label(0)
-                             ])
+        labels = self._identity_assigner.assign([o[0:2] for o in objects], [o[5] for o in objects], t)
 
+        out_pos = []
+        for (x, y, w, h, angle, _), (label, previous) in zip(objects, labels):
+            if label is None:
+                # not detected for long enough to be an animal
+                continue
+            w_im = max(grey.shape)
+            if previous is None:
+                # a new animal: the distance is the one of a null displacement
+                xy_dist = round(log10(1./float(w_im))*1000)
+            else:
+                xy_dist = round(log10(1./float(w_im) + abs((x - previous[0]) + 1.0j * (y - previous[1])) / w_im)*1000)
 
+            out = self._data_point_schema.data_point(round(x), round(y), round(w), round(h), round(angle), xy_dist, label)
             out_pos.append(out)
 
-
-        if len(out_pos) == 0:
-            self._bg_model.increase_learning_rate()
-            raise NoPositionError
-
         # accurate measurment for multi animal tracking:
         #cv2.ellipse(self._buff_fg ,((x,y), (int(w*1.5),int(h*1.5)),angle),255,-1)
         #
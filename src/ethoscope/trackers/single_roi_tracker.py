@@ -1,6 +1,7 @@
 __author__ = 'quentin'
 
 from collections import deque
+import logging
 import cv2
 
 try:
@@ -14,7 +15,7 @@ from ethoscope.core.variables import XPosVariable, YPosVariable, WidthVariable,
 from ethoscope.core.data_point import DataPoint
 from ethoscope.trackers.adaptive_bg_tracker import BackgroundModel
 from ethoscope.trackers.trackers import BaseTracker, NoPositionError
-from ethoscope.utils.img_proc import merge_blobs
+from ethoscope.utils.img_proc import merge_blobs, grey_image
 
 
 class AdaptiveBGModelOneObject(BaseTracker):
@@ -40,13 +41,13 @@ class AdaptiveBGModelOneObject(BaseTracker):
 
     def _pre_process_input_minimal(self, img, mask, t, darker_fg=True):
         if self._buff_grey is None:
-            self._buff_grey = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+            self._buff_grey = np.empty(img.shape[0:2], np.uint8)
             if mask is None:
                 mask = np.ones_like(self._buff_grey) * 255
 
-        cv2.cvtColor(img,cv2.COLOR_BGR2GRAY, self._buff_grey)
+        grey = grey_image(img, self._buff_grey)
 
-        cv2.erode(self._buff_grey, self._erode_kern, dst=self._buff_grey)
+        cv2.erode(grey, self._erode_kern, dst=self._buff_grey)
 
         if darker_fg:
             cv2.subtract(255, self._buff_grey, self._buff_grey)
@@ -87,25 +88,25 @@ class AdaptiveBGModelOneObject(BaseTracker):
             self._buff_fg = np.empty_like(grey)
             raise NoPositionError
 
-        bg = self._bg_model.bg_img.astype(np.uint8)
+        bg = self._bg_model.bg_img_uint8
         cv2.subtract(grey, bg, self._buff_fg)
 
         #fixme magic number
         cv2.threshold(self._buff_fg,15,255,cv2.THRESH_BINARY, dst=self._buff_fg)
 
 
-        n_fg_pix = np.count_nonzero(self._buff_fg)
+        n_fg_pix = cv2.countNonZero(self._buff_fg)
         prop_fg_pix  = n_fg_pix / (1.0 * grey.shape[0] * grey.shape[1])
         is_ambiguous = False
 
         if  prop_fg_pix > self._max_area:
             self._bg_model.increase_learning_rate()
-            print "too big"
+            logging.debug("too big")
             raise NoPositionError
 
         if  prop_fg_pix == 0:
             self._bg_model.increase_learning_rate()
-            print "no pixs"
+            logging.debug("no pixs")
             raise NoPositionError
         # show(self._buff_fg,100)
         if CV_VERSION == 3:
@@ -115,7 +116,7 @@ class AdaptiveBGModelOneObject(BaseTracker):
 
         if len(contours) == 0:
             self._bg_model.increase_learning_rate()
-            print "No contours"
+            logging.debug("No contours")
             raise NoPositionError
 
 
@@ -126,11 +127,11 @@ class AdaptiveBGModelOneObject(BaseTracker):
             hulls = merge_blobs(hulls)
 
             hulls = [h for h in hulls if h.shape[0] >= 3]
-            print "before exclusion", len(hulls)
+            logging.debug("before exclusion: %i" % len(hulls))
 
             hulls = self._exclude_incorrect_hull(hulls)
 
-            print "after exclusion", len(hulls)
+            logging.debug("after exclusion: %i" % len(hulls))
 
             if len(hulls) == 0:
                 raise NoPositionError
@@ -207,4 +208,4 @@ class AdaptiveBGModelOneObject(BaseTracker):
         out = DataPoint([x_var, y_var, w_var, h_var, phi_var])
 
 
-        return out
\ No newline at end of file
+        return [out]
\ No newline at end of file
@@ -2,7 +2,11 @@ __author__ = 'quentin'
 
 from collections import deque
 
+import cv2
+import numpy as np
+
 from ethoscope.utils.description  import DescribedObject
+from ethoscope.utils.img_proc import grey_image
 from ethoscope.core.variables import *
 
 
@@ -12,27 +16,283 @@ class NoPositionError(Exception):
     """
     pass
 
+class KalmanMotionModel(object):
+    def __init__(self, acceleration_sd, measurement_sd, max_extrapolation=500, max_unupdated_duration=60 * 1000):
+        """
+        A constant velocity motion model of one animal, as a Kalman filter.
+        The x and y coordinates are independent, with the same noise, so they share the same covariance matrix.
+        The state of each coordinate is its position and velocity.
+        Between two positions, the velocity changes randomly (white noise acceleration).
+
+        :param acceleration_sd: the standard deviation of the random acceleration, in pixels/s^2
+        :type acceleration_sd: float
+        :param measurement_sd: the standard deviation of the error of the measured positions, in pixels
+        :type measurement_sd: float
+        :param max_extrapolation: the maximal time, in ms, over which the velocity is extrapolated (positions do not change beyond)
+        :type max_extrapolation: int
+        :param max_unupdated_duration: if the model is not updated for this duration, in ms, it is reset
+        :type max_unupdated_duration: int
+        """
+        self._acceleration_var = float(acceleration_sd) ** 2
+        self._measurement_var = float(measurement_sd) ** 2
+        self._max_extrapolation = max_extrapolation
+        self._max_unupdated_duration = max_unupdated_duration
+        # positions further than this many standard deviations from the prediction reset the model
+        self._max_innovation = 4.
+        self.reset()
+
+    def reset(self):
+        # rows: position and velocity; columns: x and y
+        self._state = None
+        self._cov = None
+        self._last_t = None
+        self._n_updates = 0
+
+    @property
+    def is_ready(self):
+        """
+        :return: Whether the velocity was estimated (i.e. at least two positions were used)
+        :rtype: bool
+        """
+        return self._n_updates > 1
+
+    def _predicted(self, t):
+        # the state, and its covariance, at time t (in ms), given the positions up to the last update
+        dt = max(t - self._last_t, 0) / 1000.
+        transition = np.array([[1., dt], [0., 1.]])
+        noise = self._acceleration_var * np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]])
+        cov = np.dot(np.dot(transition, self._cov), transition.T) + noise
+        # the uncertainty keeps growing, but the velocity is only extrapolated for a limited time
+        transition[0, 1] = min(dt, self._max_extrapolation / 1000.)
+        state = np.dot(transition, self._state)
+        return state, cov
+
+    def update(self, x, y, t):
+        """
+        Add the measured position of the animal.
+
+        :param x: the x position, in pixels
+        :type x: float
+        :param y: the y position, in pixels
+        :type y: float
+        :param t: the time, in ms
+        :type t: int
+        """
+        if self._last_t is not None and t - self._last_t > self._max_unupdated_duration:
+            self.reset()
+
+        if self._state is not None:
+            x_pred, y_pred, sd = self.predict(t)
+            # a position that the model cannot explain (e.g. another object was detected): we start again from it
+            if abs(x - x_pred) > self._max_innovation * sd or abs(y - y_pred) > self._max_innovation * sd:
+                self.reset()
+
+        if self._state is None:
+            # the velocity is unknown until the second position
+            self._state = np.array([[x, y], [0., 0.]])
+            self._cov = np.diag([self._measurement_var, 1e6 * self._measurement_var])
+        else:
+            state, cov = self._predicted(t)
+            innovation_var = cov[0, 0] + self._measurement_var
+            gain = cov[:, 0] / innovation_var
+            self._state = state + np.outer(gain, np.array([x, y]) - state[0])
+            self._cov = cov - np.outer(gain, cov[0, :])
+
+        self._last_t = t
+        self._n_updates += 1
+
+    def predict(self, t):
+        """
+        The predicted position of the animal.
+
+        :param t: the time, in ms
+        :type t: int
+        :return: the predicted x and y positions, and the standard deviation of the prediction (for each coordinate), in pixels
+        :rtype: (float, float, float)
+        """
+        state, cov = self._predicted(t)
+        return state[0, 0], state[0, 1], np.sqrt(cov[0, 0] + self._measurement_var)
+
+    def distances(self, positions, t):
+        """
+        The distance (i.e. the mean of the minus log10 likelihoods of x and y) of candidate positions to the predicted one.
+        It has the same scale as :meth:`~ethoscope.trackers.adaptive_bg_tracker.ObjectModel.distances`.
+
+        :param positions: the x and y coordinates of each candidate, one row per candidate
+        :type positions: :class:`~numpy.ndarray`
+        :param t: the time, in ms
+        :type t: int
+        :return: the distance of each candidate
+        :rtype: :class:`~numpy.ndarray`
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        x, y, sd = self.predict(t)
+        sq_dev = (positions - np.array([x, y])) ** 2
+        m_log_liks = (sq_dev / (2 * sd ** 2)) * np.log10(np.e) + np.log10(sd * np.sqrt(2 * np.pi))
+        return np.mean(m_log_liks, 1)
+
+
+class PositionHistory(object):
+    # the variables of data points that are kept, and the value used when a data point does not have them
+    _columns = [("x", np.float64, 0), ("y", np.float64, 0), ("xy_dist_log10x1000", np.int32, 0),
+                ("is_inferred", np.bool_, False), ("label", np.int32, 0)]
+
+    def __init__(self, capacity):
+        """
+        The last positions of the animals of a ROI, in a preallocated ring buffer (a structured numpy array),
+        so that memory does not grow with the frame rate or the number of animals.
+        There is one row per data point, with its time (``t``, in ms), ``x``, ``y``, ``xy_dist_log10x1000``,
+        ``is_inferred`` and ``label``. When the buffer is full, the oldest rows are overwritten.
+        Queries return rows in chronological order.
+
+        :param capacity: the maximal number of rows (i.e. data points) kept
+        :type capacity: int
+        """
+        self._dtype = np.dtype([("t", np.int64)] + [(name, dtype) for name, dtype, _ in self._columns])
+        self._data = np.zeros(capacity, self._dtype)
+        self._capacity = capacity
+        # the total number of rows ever appended
+        self._n_appended = 0
+
+    def __len__(self):
+        return min(self._n_appended, self._capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, t, points):
+        """
+        Add the data points found at a given time.
+
+        :param t: the time, in ms
+        :type t: int
+        :param points: the data points
+        :type points: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        """
+        for p in points:
+            self._data[self._n_appended % self._capacity] = (t,) + tuple([p.get(name, default)
+                                                                          for name, _, default in self._columns])
+            self._n_appended += 1
+
+    def _rows(self, n):
+        # the last n rows, in chronological order
+        n = min(n, len(self))
+        start = (self._n_appended - n) % self._capacity
+        if start + n <= self._capacity:
+            return self._data[start: start + n].copy()
+        return np.concatenate((self._data[start:], self._data[:start + n - self._capacity]))
+
+    def last(self, n):
+        """
+        :param n: the number of rows
+        :type n: int
+        :return: the last ``n`` rows (or fewer, if there are not as many)
+        :rtype: :class:`~numpy.ndarray`
+        """
+        return self._rows(n)
+
+    def since(self, t):
+        """
+        :param t: the time, in ms
+        :type t: int
+        :return: the rows from time ``t`` (included)
+        :rtype: :class:`~numpy.ndarray`
+        """
+        n = len(self)
+        if n == 0:
+            return self._data[:0].copy()
+        # times are increasing from the oldest row, so we search in both parts of the buffer
+        oldest = self._n_appended % self._capacity if self._n_appended > self._capacity else 0
+        newer_part = self._data["t"][:oldest]
+        older_part = self._data["t"][oldest:n]
+        n_after = (len(newer_part) - np.searchsorted(newer_part, t, "left") +
+                   len(older_part) - np.searchsorted(older_part, t, "left"))
+        return self._rows(n_after)
+
+    def velocity(self, duration, label=None):
+        """
+        The mean velocity of an animal over the last ``duration`` ms, from its first and last positions within this window.
+
+        :param duration: the duration of the window, in ms
+        :type duration: int
+        :param label: the label of the animal. ``None`` uses all rows (i.e. when there is one animal)
+        :type label: int
+        :return: the velocity along x and y, in pixels/s, or ``None`` when there are not two positions at different times
+        :rtype: (float, float)
+        """
+        if len(self) == 0:
+            return None
+        rows = self.since(self._data["t"][(self._n_appended - 1) % self._capacity] - duration)
+        if label is not None:
+            rows = rows[rows["label"] == label]
+        if len(rows) < 2 or rows["t"][-1] == rows["t"][0]:
+            return None
+        dt = (rows["t"][-1] - rows["t"][0]) / 1000.
+        return (rows["x"][-1] - rows["x"][0]) / dt, (rows["y"][-1] - rows["y"][0]) / dt
+
+
 class BaseTracker(DescribedObject):
     # data_point = None
-    def __init__(self, roi,data=None):
+    # the side, in pixels, of the blocks of pixels averaged to compute the change score of motion gating
+    _motion_gate_block_size = 4
+
+    # the standard deviation of the measured positions, relative to the longest axis of the ROI
+    _motion_model_measurement_sd = 0.005
+
+    # the number of data points kept in the position history (i.e. about 200s at 20 frames per second, for one animal)
+    _history_capacity = 4096
+
+    def __init__(self, roi,data=None, motion_gate_threshold=0, motion_model_noise=0):
         """
         Template class for video trackers.
         A video tracker locate animal in a ROI.
         Derived class must implement the ``_find_position`` method.
 
+        Optionally, frames in which the ROI did not change since the last analysed frame are skipped (motion gating).
+        The change score is the largest absolute difference, in grey levels, between the means of small blocks of pixels
+        of the ROI and the ones of the last analysed frame. When it is below ``motion_gate_threshold``,
+        ``_find_position`` is not called. Instead, the last positions are reported again, as inferred
+        (see :meth:`~ethoscope.trackers.trackers.BaseTracker._unchanged_positions`).
+
+        Optionally, the motion of the animal (when there is one animal per ROI) is modelled by a Kalman filter
+        (see :class:`~ethoscope.trackers.trackers.KalmanMotionModel`). Then, when the animal is not found,
+        the inferred position is the one predicted from its last positions and velocity, rather than the last position.
+        Derived classes can also use the prediction (``self._motion_model``) to search and disambiguate animals.
+
+        The last data points are kept as :class:`~ethoscope.core.data_point.DataPoint` only for the two last frames
+        (see :attr:`~ethoscope.trackers.trackers.BaseTracker.positions`). Older positions are kept,
+        as numpy arrays, in a :class:`~ethoscope.trackers.trackers.PositionHistory` (see :attr:`~ethoscope.trackers.trackers.BaseTracker.history`).
+
         :param roi: The Region Of Interest the the tracker will use to locate the animal.
         :type roi: :class:`~ethoscope.rois.roi_builders.ROI`
         :param data: An optional data set. For instance, it can be used for pre-trained algorithms
+        :param motion_gate_threshold: The change score under which a frame is skipped. 0 disables motion gating.
+        :type motion_gate_threshold: float
+        :param motion_model_noise: The standard deviation of the random acceleration of the animal, in ROI lengths/s^2,
+            in the motion model. 0 disables the motion model.
+        :type motion_model_noise: float
 
         :return:
         """
-        self._positions = deque()
-        self._times =deque()
+        self._positions = deque(maxlen=2)
+        self._times =deque(maxlen=2)
+        self._history = PositionHistory(self._history_capacity)
         self._data = data
         self._roi = roi
         self._last_non_inferred_time = 0
         self._last_time_point = 0
-        self._max_history_length = 250 * 1000  # in milliseconds
+
+        self._motion_gate_threshold = motion_gate_threshold
+        self._motion_gate_reference = None
+        self._motion_gate_current = None
+        self._last_frame_skipped = False
+        self._n_skipped_frames = 0
+
+        self._motion_model = None
+        if motion_model_noise > 0:
+            self._motion_model = KalmanMotionModel(motion_model_noise * roi.longest_axis,
+                                                   self._motion_model_measurement_sd * roi.longest_axis)
 
         # self._max_history_length = 500   # in milliseconds
         # if self.data_point is None:
@@ -52,6 +312,20 @@ class BaseTracker(DescribedObject):
 
         sub_img, mask = self._roi.apply(img)
         self._last_time_point = t
+        self._last_frame_skipped = False
+
+        if self._motion_gate_threshold > 0 and self._roi_is_unchanged(sub_img):
+            points = self._unchanged_positions(t)
+            if len(points) > 0:
+                self._last_frame_skipped = True
+                self._n_skipped_frames += 1
+                for p in points:
+                    p.append(IsInferredVariable(True))
+                self._update_history(t, points)
+                return points
+            # there is no position to report, so we analyse the frame anyway
+            self._motion_gate_reference = self._motion_gate_current
+
         try:
 
             points = self._find_position(sub_img,mask,t)
@@ -67,6 +341,9 @@ class BaseTracker(DescribedObject):
             for p in points:
                 p.append(IsInferredVariable(False))
 
+            if self._motion_model is not None and len(points) == 1:
+                self._motion_model.update(points[0]["x"], points[0]["y"], t)
+
         except NoPositionError:
             if len(self._positions) == 0:
                 return []
@@ -79,14 +356,42 @@ class BaseTracker(DescribedObject):
                 for p in points:
                     p.append(IsInferredVariable(True))
 
-        self._positions.append(points)
-        self._times.append(t)
+        self._update_history(t, points)
+        return points
 
+    def _roi_is_unchanged(self, sub_img):
+        # the mean grey level of each block of pixels, compared to the one of the last analysed frame
+        h, w = sub_img.shape[0:2]
+        size = (max(1, w // self._motion_gate_block_size), max(1, h // self._motion_gate_block_size))
+        self._motion_gate_current = cv2.resize(grey_image(sub_img), size, interpolation=cv2.INTER_AREA)
 
-        if len(self._times) > 2 and (self._times[-1] - self._times[0]) > self._max_history_length:
-            self._positions.popleft()
-            self._times.popleft()
-        return points
+        if self._motion_gate_reference is not None:
+            score = cv2.minMaxLoc(cv2.absdiff(self._motion_gate_current, self._motion_gate_reference))[1]
+            if score < self._motion_gate_threshold:
+                return True
+
+        self._motion_gate_reference = self._motion_gate_current
+        return False
+
+    def _unchanged_positions(self, t):
+        """
+        The positions reported for a frame skipped by motion gating (i.e. the ROI has not changed).
+        By default, copies of the last positions. They are marked as inferred (``is_inferred``) by ``track``.
+        Derived classes can override this, for instance, to report that animals did not move.
+
+        :param t: time in ms
+        :type t: int
+        :return: The positions of the animals at time ``t``
+        :rtype: list(:class:`~ethoscope.core.data_point.DataPoint`)
+        """
+        if len(self._positions) == 0:
+            return []
+        return [p.copy() for p in self._positions[-1]]
+
+    def _update_history(self, t, points):
+        self._positions.append(points)
+        self._times.append(t)
+        self._history.append(t, points)
 
     def _infer_position(self, t, max_time=30 * 1000):
         if len(self._times) == 0:
@@ -94,18 +399,35 @@ class BaseTracker(DescribedObject):
         if t - self._last_non_inferred_time  > max_time:
             return []
 
-        return self._positions[-1]
+        if self._motion_model is None or not self._motion_model.is_ready or len(self._positions[-1]) != 1:
+            return self._positions[-1]
+
+        # the position predicted by the motion model, within the ROI
+        x, y, _ = self._motion_model.predict(t)
+        _, _, w, h = self._roi.rectangle
+        point = self._positions[-1][0].copy()
+        point.append(XPosVariable(int(round(min(max(x, 0), w - 1)))))
+        point.append(YPosVariable(int(round(min(max(y, 0), h - 1)))))
+        return [point]
 
 
     @property
     def positions(self):
         """
-        :return: The last few positions found by the tracker.\
-            Positions are kept for a certain duration defined by the ``_max_history_length`` attribute.
+        :return: The positions found by the tracker in the two last frames.\
+            For older positions, use :attr:`~ethoscope.trackers.trackers.BaseTracker.history`.
         :rtype: :class:`~collection.deque`
         """
         return self._positions
 
+    @property
+    def history(self):
+        """
+        :return: The last positions found by the tracker, up to ``_history_capacity`` data points.
+        :rtype: :class:`~ethoscope.trackers.trackers.PositionHistory`
+        """
+        return self._history
+
     def xy_pos(self, i):
         return self._positions[i][0]
 
@@ -118,6 +440,22 @@ class BaseTracker(DescribedObject):
         """
         return self._last_time_point
 
+    @property
+    def last_frame_skipped(self):
+        """
+        :return: Whether the last frame was skipped by motion gating (i.e. positions were not computed, as the ROI did not change).
+        :rtype: bool
+        """
+        return self._last_frame_skipped
+
+    @property
+    def n_skipped_frames(self):
+        """
+        :return: The number of frames skipped by motion gating so far.
+        :rtype: int
+        """
+        return self._n_skipped_frames
+
     @property
     def times(self):
         """
@@ -3,6 +3,23 @@ import cv2
 import numpy as np
 import itertools
 
+
+def grey_image(img, dst=None):
+    """
+    Get a single channel (greyscale) version of an image.
+    Images that already have a single channel are returned as they are (i.e. neither converted nor copied).
+
+    :param img: A BGR or a greyscale image
+    :type img: :class:`~numpy.ndarray`
+    :param dst: An optional preallocated array where a BGR image is converted.
+    :type dst: :class:`~numpy.ndarray`
+    :return: The greyscale image
+    :rtype: :class:`~numpy.ndarray`
+    """
+    if len(img.shape) == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst)
+
 def merge_blobs(contours, prop = .5):
     """
     Merge together contour according to their position and size.
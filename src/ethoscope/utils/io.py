@@ -1,5 +1,7 @@
 __author__ = 'quentin'
+import cPickle
 import multiprocessing
+import Queue
 import time, datetime
 import traceback
 import logging
@@ -8,21 +10,166 @@ import cv2
 import tempfile
 import os
 
+from ethoscope.utils.row_ring import SharedRowRing, RowBlockNotice
 
-class AsyncMySQLWriter(multiprocessing.Process):
 
-    def __init__(self, db_credentials, queue, erase_old_db=True):
+class BaseAsyncSQLWriter(multiprocessing.Process):
+    # a transaction is committed once it has this many rows...
+    _max_rows_per_commit = 1000
+    # ...or once its first command is this old, in seconds
+    _max_commit_delay = 1.0
+
+    def __init__(self, queue, row_ring=None):
+        """
+        Template class for processes executing the SQL commands sent by a :class:`~ethoscope.utils.io.ResultWriter`.
+        Derived classes must implement ``_get_connection``, and may implement ``_initialise_db``.
+
+        Messages are ``(command, args)`` tuples, where ``args`` is either ``None``, the parameters of the command,
+        a list of parameters (i.e. a batch of rows, inserted with ``executemany``),
+        or a :class:`~ethoscope.utils.row_ring.RowBlockNotice` (i.e. a batch of rows in ``row_ring``), or ``"DONE"``, to stop.
+        Messages can have a third element: the time (in ms, since the start of the experiment) of their data.
+        Commands are grouped in transactions: all the available messages are executed,
+        and the transaction is committed once it has ``_max_rows_per_commit`` rows,
+        or when its first command is ``_max_commit_delay`` seconds old (or when the writer stops).
+        The writer waits for messages with a timeout, rather than by polling.
+
+        The numbers of commits and rows are shared with the parent process (see :attr:`~ethoscope.utils.io.BaseAsyncSQLWriter.stats`).
+
+        :param queue: the queue of messages
+        :type queue: :class:`~multiprocessing.JoinableQueue`
+        :param row_ring: the shared memory ring in which batches of rows are sent
+        :type row_ring: :class:`~ethoscope.utils.row_ring.SharedRowRing`
+        """
+        self._queue = queue
+        self._row_ring = row_ring
+        self._n_commits = multiprocessing.Value("l", 0)
+        self._n_committed_rows = multiprocessing.Value("l", 0)
+        self._start_time = multiprocessing.Value("d", 0)
+        self._last_commit_time = multiprocessing.Value("d", 0)
+        self._last_committed_t = multiprocessing.Value("l", 0)
+        super(BaseAsyncSQLWriter, self).__init__()
+
+    @property
+    def stats(self):
+        """
+        :return: The counters of this writer: the number of commits and of rows committed,
+            the number of commits per second (since the writer started), the mean number of rows per commit,
+            and the time (in ms) of the last data committed.
+        :rtype: dict
+        """
+        n_commits, n_rows = self._n_commits.value, self._n_committed_rows.value
+        duration = self._last_commit_time.value - self._start_time.value
+        return {"n_commits": n_commits,
+                "n_rows": n_rows,
+                "commits_per_s": n_commits / duration if duration > 0 else 0.,
+                "rows_per_commit": n_rows / float(n_commits) if n_commits > 0 else 0.,
+                "last_committed_t": self._last_committed_t.value}
+
+    def _get_connection(self):
+        raise NotImplementedError
+
+    def _initialise_db(self):
+        pass
+
+    def _execute(self, cursor, command, args):
+        # executes one message, and returns its number of rows
+        if args is None:
+            cursor.execute(command)
+        elif isinstance(args, RowBlockNotice):
+            # a batch of rows in shared memory
+            cursor.executemany(command, self._row_ring.rows(args))
+            return args.n_rows
+        elif isinstance(args, list):
+            # a batch of rows, inserted with the same statement
+            cursor.executemany(command, args)
+            return len(args)
+        else:
+            cursor.execute(command, args)
+        return 1
+
+    def _commit(self, db, n_rows, last_t):
+        db.commit()
+        self._n_commits.value += 1
+        self._n_committed_rows.value += n_rows
+        self._last_commit_time.value = time.time()
+        if last_t is not None:
+            self._last_committed_t.value = last_t
+
+    def run(self):
+
+        db = None
+        command = None
+        try:
+            self._start_time.value = time.time()
+            self._initialise_db()
+            db = self._get_connection()
+            c = db.cursor()
+            # the number of rows, the time of the first command and the time of the last data, of the current transaction
+            n_rows = 0
+            first_command_time = None
+            last_t = None
+            do_run = True
+            while do_run:
+                if first_command_time is None:
+                    timeout = self._max_commit_delay
+                else:
+                    timeout = max(first_command_time + self._max_commit_delay - time.time(), 0)
+                try:
+                    msg = self._queue.get(timeout=timeout)
+                except Queue.Empty:
+                    msg = None
+
+                if msg == 'DONE':
+                    do_run = False
+                elif msg is not None:
+                    command, args = msg[0:2]
+                    if len(msg) > 2:
+                        last_t = msg[2]
+                    try:
+                        n_rows += self._execute(c, command, args)
+                    except Exception as e:
+                        logging.error("Failed to run SQL command:\n%s" % str(command))
+                        raise e
+                    if first_command_time is None:
+                        first_command_time = time.time()
+
+                if first_command_time is not None and (not do_run or n_rows >= self._max_rows_per_commit or
+                                                       time.time() - first_command_time >= self._max_commit_delay):
+                    self._commit(db, n_rows, last_t)
+                    n_rows = 0
+                    first_command_time = None
+                    last_t = None
+
+        except KeyboardInterrupt as e:
+            logging.warning("DB async process interrupted with KeyboardInterrupt")
+            raise e
+
+        except Exception as e:
+            logging.error("DB async process stopped with an exception")
+            raise e
+
+        finally:
+            logging.info("Closing async SQL writer")
+            while not self._queue.empty():
+                self._queue.get()
+
+            self._queue.close()
+            if db is not None:
+                db.close()
+
+
+class AsyncMySQLWriter(BaseAsyncSQLWriter):
+
+    def __init__(self, db_credentials, queue, erase_old_db=True, row_ring=None):
         self._db_name = db_credentials["name"]
         self._db_user_name = db_credentials["user"]
         self._db_user_pass = db_credentials["password"]
         self._erase_old_db = erase_old_db
 
-        self._queue = queue
-
         # if erase_old_db:
         #     self._delete_my_sql_db()
         #     self._create_mysql_db()
-        super(AsyncMySQLWriter,self).__init__()
+        super(AsyncMySQLWriter,self).__init__(queue, row_ring)
 
 
     def _delete_my_sql_db(self):
@@ -91,63 +238,10 @@ class AsyncMySQLWriter(multiprocessing.Process):
                   db=self._db_name)
         return db
 
-    def run(self):
-
-        db = None
-        do_run = True
-        try:
-            if self._erase_old_db:
-                self._delete_my_sql_db()
-                self._create_mysql_db()
-
-            db = self._get_connection()
-            while do_run:
-                try:
-                    msg = self._queue.get()
-
-                    if (msg == 'DONE'):
-                        do_run=False
-                        continue
-
-                    command, args = msg
-
-
-                    c = db.cursor()
-                    if args is None:
-                        c.execute(command)
-                    else:
-                        c.execute(command, args)
-
-                    db.commit()
-
-                except:
-                    do_run = False
-                    try:
-                        logging.error("Failed to run mysql command:\n%s" % command)
-                    except:
-                        logging.error("Did not retrieve queue value")
-
-                finally:
-                    if self._queue.empty():
-                        #we sleep iff we have an empty queue. this way, we don't over use a cpu
-                        time.sleep(.1)
-
-        except KeyboardInterrupt as e:
-            logging.warning("DB async process interrupted with KeyboardInterrupt")
-            raise e
-
-        except Exception as e:
-            logging.error("DB async process stopped with an exception")
-            raise e
-
-        finally:
-            logging.info("Closing async mysql writer")
-            while not self._queue.empty():
-                self._queue.get()
-
-            self._queue.close()
-            if db is not None:
-                db.close()
+    def _initialise_db(self):
+        if self._erase_old_db:
+            self._delete_my_sql_db()
+            self._create_mysql_db()
 
 class ImgToMySQLHelper(object):
     _table_name = "IMG_SNAPSHOTS"
@@ -298,14 +392,110 @@ class DAMFileHelper(object):
 
         return out
 
+class MessageSpool(object):
+    def __init__(self, directory=None):
+        """
+        A first-in first-out queue of messages, on disk. Messages are pickled, one after the other, in a temporary file,
+        which is only created when the first message is added, and emptied once all messages were read.
+
+        :param directory: the directory of the temporary file. ``None`` means the default temporary directory
+        :type directory: str
+        """
+        self._directory = directory
+        self._path = None
+        self._writer = None
+        self._reader = None
+        self._n_messages = 0
+        # the next message, once read
+        self._head = None
+
+    def __len__(self):
+        return self._n_messages
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def size(self):
+        """
+        :return: The size, in bytes, of the messages not read yet.
+        :rtype: int
+        """
+        if self._writer is None:
+            return 0
+        return self._writer.tell() - self._reader.tell()
+
+    def append(self, message):
+        if self._writer is None:
+            fd, self._path = tempfile.mkstemp(prefix="ethoscope_spool_", suffix=".pkl", dir=self._directory)
+            self._writer = os.fdopen(fd, "wb")
+            self._reader = open(self._path, "rb")
+        cPickle.dump(message, self._writer, cPickle.HIGHEST_PROTOCOL)
+        self._n_messages += 1
+
+    def peek(self):
+        """
+        :return: The oldest message (it stays in the spool)
+        """
+        if self._n_messages == 0:
+            raise IndexError("The spool is empty")
+        if self._head is None:
+            self._writer.flush()
+            self._head = cPickle.load(self._reader)
+        return self._head
+
+    def pop(self):
+        """
+        :return: The oldest message (it is removed from the spool)
+        """
+        out = self.peek()
+        self._head = None
+        self._n_messages -= 1
+        if self._n_messages == 0:
+            # all messages were read, so the file can be reused from the start
+            self._writer.seek(0)
+            self._writer.truncate()
+            self._reader.seek(0)
+        return out
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._reader.close()
+        try:
+            os.remove(self._path)
+        except OSError:
+            logging.error("Could not remove spool file: %s" % self._path)
+        self._writer, self._reader = None, None
+
+
 class ResultWriter(object):
     # _flush_every_ns = 30 # flush every 10s of data
-    _max_insert_string_len = 1000
+    # rows are buffered, per ROI, and inserted together once there are this many
+    _max_insert_rows = 30
     _async_writing_class = AsyncMySQLWriter
-    _null = 0
+    # the parameter placeholder of the database module (see PEP 249)
+    _placeholder = "%s"
+    # the maximal number of messages waiting for the database writer. Beyond, they are spooled on disk
+    _max_queue_size = 1000
+    # the directory of the spool file. None means the default temporary directory
+    _spool_dir = None
+    # the shared memory blocks in which rows are sent to the database writer: their number, and their number of columns
+    _n_row_blocks = 64
+    _max_row_columns = 32
+    # the fields of the tables that do not depend on the variables
+    _table_fields = {"ROI_MAP": "roi_idx SMALLINT, roi_value SMALLINT, x SMALLINT,y SMALLINT,w SMALLINT,h SMALLINT",
+                     "VAR_MAP": "var_name CHAR(100), sql_type CHAR(100), functional_type CHAR(100)",
+                     "IMG_SNAPSHOTS": "id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY , t INT, img LONGBLOB",
+                     "METADATA": "field CHAR(100), value VARCHAR(3000)",
+                     "START_EVENTS": "id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY, t INT, event CHAR(100)"}
     def __init__(self, db_credentials, rois, metadata=None, make_dam_like_table=True, take_frame_shots=False, erase_old_db=True, *args, **kwargs):
-        self._queue = multiprocessing.JoinableQueue()
-        self._async_writer = self._async_writing_class(db_credentials, self._queue, erase_old_db)
+        self._queue = multiprocessing.JoinableQueue(self._max_queue_size)
+        self._spool = MessageSpool(self._spool_dir)
+        self._row_ring = SharedRowRing(self._max_insert_rows, self._max_row_columns, self._n_row_blocks)
+        self._async_writer = self._async_writing_class(db_credentials, self._queue, erase_old_db, self._row_ring)
         self._async_writer.start()
         self._last_t, self._last_flush_t, self._last_dam_t = [0] * 3
 
@@ -327,6 +517,7 @@ class ResultWriter(object):
             self._shot_saver = None
 
         self._insert_dict = {}
+        self._insert_commands = {}
         if self._metadata is None:
             self._metadata  = {}
 
@@ -335,25 +526,24 @@ class ResultWriter(object):
             self._create_all_tables()
         else:
             event = "crash_recovery"
-            command = "INSERT INTO START_EVENTS VALUES %s" % str((self._null, int(time.time()), event))
-            self._write_async_command(command)
+            self._write_async_command(self._insert_command("START_EVENTS", ["t", "event"]), (int(time.time()), event))
 
         logging.info("Result writer initialised")
     def _create_all_tables(self):
         logging.info("Creating master table 'ROI_MAP'")
-        self._create_table("ROI_MAP", "roi_idx SMALLINT, roi_value SMALLINT, x SMALLINT,y SMALLINT,w SMALLINT,h SMALLINT")
+        self._create_table("ROI_MAP", self._table_fields["ROI_MAP"])
 
+        command = self._insert_command("ROI_MAP", ["roi_idx", "roi_value", "x", "y", "w", "h"])
         for r in self._rois:
             fd = r.get_feature_dict()
-            command = "INSERT INTO ROI_MAP VALUES %s" % str((fd["idx"], fd["value"], fd["x"], fd["y"], fd["w"], fd["h"]))
-            self._write_async_command(command)
+            self._write_async_command(command, (fd["idx"], fd["value"], fd["x"], fd["y"], fd["w"], fd["h"]))
 
 
         logging.info("Creating variable map table 'VAR_MAP'")
-        self._create_table("VAR_MAP", "var_name CHAR(100), sql_type CHAR(100), functional_type CHAR(100)")
+        self._create_table("VAR_MAP", self._table_fields["VAR_MAP"])
 
         if self._shot_saver is not None:
-            self._create_table("IMG_SNAPSHOTS", "id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY , t INT, img LONGBLOB")
+            self._create_table("IMG_SNAPSHOTS", self._table_fields["IMG_SNAPSHOTS"])
 
 
         logging.info("Creating 'CSV_DAM_ACTIVITY' table")
@@ -363,18 +553,17 @@ class ResultWriter(object):
 
 
         logging.info("Creating 'METADATA' table")
-        self._create_table("METADATA", "field CHAR(100), value VARCHAR(3000)")
+        self._create_table("METADATA", self._table_fields["METADATA"])
 
         logging.info("Creating 'START_EVENTS' table")
-        self._create_table("START_EVENTS", "id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY, t INT, event CHAR(100)")
+        self._create_table("START_EVENTS", self._table_fields["START_EVENTS"])
         event = "graceful_start"
-        command = "INSERT INTO START_EVENTS VALUES %s" % str((self._null, int(time.time()), event))
-        self._write_async_command(command)
+        self._write_async_command(self._insert_command("START_EVENTS", ["t", "event"]), (int(time.time()), event))
 
 
+        command = self._insert_command("METADATA", ["field", "value"])
         for k,v in self.metadata.items():
-            command = "INSERT INTO METADATA VALUES %s" % str((k, v))
-            self._write_async_command(command)
+            self._write_async_command(command, (k, str(v)))
         while not self._queue.empty():
             logging.info("waiting for queue to be processed")
             time.sleep(.1)
@@ -383,6 +572,24 @@ class ResultWriter(object):
     def metadata(self):
         return self._metadata
 
+    @property
+    def stats(self):
+        """
+        :return: The health of the database writer: its commit counters (see :attr:`~ethoscope.utils.io.BaseAsyncSQLWriter.stats`),
+            the number of messages in its queue (``queue_depth``), the number and size (in bytes) of the messages spooled on disk
+            (``spool_n_messages`` and ``spool_size``), and its lag, in ms (``lag``):
+            the time of the last data written, minus the time of the last data committed.
+        :rtype: dict
+        """
+        out = self._async_writer.stats
+        out.update({"queue_depth": self._queue.qsize(),
+                    "queue_capacity": self._max_queue_size,
+                    "spool_n_messages": len(self._spool),
+                    "spool_size": self._spool.size,
+                    "last_t": self._last_t,
+                    "lag": max(self._last_t - out["last_committed_t"], 0)})
+        return out
+
     def write(self, t, roi, data_rows):
 
         #fixme
@@ -390,8 +597,8 @@ class ResultWriter(object):
 
         if not self._var_map_initialised:
             for r in self._rois:
-                self._initialise(r, dr)
-            self._initialise_var_map(dr)
+                self._initialise(r, dr.schema)
+            self._initialise_var_map(dr.schema)
 
         self._add(t, roi, data_rows)
         self._last_t = t
@@ -402,6 +609,7 @@ class ResultWriter(object):
             self._dam_file_helper.input_roi_data(t, roi, dr)
 
     def flush(self, t, img=None):
+        self._replay_spool()
         if self._dam_file_helper is not None:
             out = self._dam_file_helper.flush(t)
             for c in out:
@@ -413,9 +621,9 @@ class ResultWriter(object):
                 self._write_async_command(*c_args)
 
         for k, v in self._insert_dict.items():
-            if len(v) > self._max_insert_string_len:
-                self._write_async_command(v)
-                self._insert_dict[k] = ""
+            if len(v) >= self._max_insert_rows:
+                self._write_async_rows(self._insert_commands[k], v, v[-1][0])
+                self._insert_dict[k] = []
 
         return False
 
@@ -423,37 +631,30 @@ class ResultWriter(object):
 
     def _add(self, t, roi, data_rows):
         t = int(round(t))
-        roi_id = roi.idx
+        rows = self._insert_dict.setdefault(roi.idx, [])
 
         for dr in data_rows:
-            tp = (0, t) + tuple(dr.values())
+            rows.append((t,) + dr.to_tuple())
 
-            if roi_id not in self._insert_dict  or self._insert_dict[roi_id] == "":
-                command = 'INSERT INTO ROI_%i VALUES %s' % (roi_id, str(tp))
-                self._insert_dict[roi_id] = command
-            else:
-                self._insert_dict[roi_id] += ("," + str(tp))
-
-    def _initialise_var_map(self,  data_row):
+    def _initialise_var_map(self,  schema):
         logging.info("Filling 'VAR_MAP' with values")
         # we recreate var map so we do not have duplicate entries
         self._write_async_command("DELETE FROM VAR_MAP")
 
-        for dt in data_row.values():
-            command = "INSERT INTO VAR_MAP VALUES %s"% str((dt.header_name, dt.sql_data_type, dt.functional_type))
-            self._write_async_command(command)
+        command = self._insert_command("VAR_MAP", ["var_name", "sql_type", "functional_type"])
+        for var in schema.var_map():
+            self._write_async_command(command, var)
         self._var_map_initialised = True
 
 
 
-    def _initialise(self, roi, data_row):
+    def _initialise(self, roi, schema):
         # We make a new dir to store results
-        fields = ["id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY" ,"t INT"]
-        for dt in data_row.values():
-            fields.append("%s %s" % (dt.header_name, dt.sql_data_type))
-        fields = ", ".join(fields)
+        fields = self._roi_table_fields(schema.sql_fields())
         table_name = "ROI_%i" % roi.idx
         self._create_table(table_name, fields)
+        # the id is set by the database
+        self._insert_commands[roi.idx] = self._insert_command(table_name, ("t",) + schema.header_names)
 
 
     def __enter__(self):
@@ -462,12 +663,14 @@ class ResultWriter(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         logging.info("Closing result writer...")
         for k, v in self._insert_dict.items():
-            self._write_async_command(v)
-            self._insert_dict[k] = ""
+            if len(v) > 0:
+                self._write_async_rows(self._insert_commands[k], v, v[-1][0])
+            self._insert_dict[k] = []
 
         try:
-            command = "INSERT INTO METADATA VALUES %s" % str(("stop_date_time", str(int(time.time()))))
-            self._write_async_command(command)
+            command = self._insert_command("METADATA", ["field", "value"])
+            self._write_async_command(command, ("stop_date_time", str(int(time.time()))))
+            self._replay_spool(block=True)
             while not self._queue.empty():
                 logging.info("waiting for queue to be processed")
                 time.sleep(.1)
@@ -485,14 +688,83 @@ class ResultWriter(object):
             logging.info("Joining thread")
             self._async_writer.join()
             logging.info("Joined OK")
+            logging.info("Database writer statistics: %s" % str(self.stats))
+            self._spool.close()
 
     def close(self):
         pass
 
-    def _write_async_command(self, command, args=None):
+    def _write_async_command(self, command, args=None, t=None):
         if not self._async_writer.is_alive():
             raise Exception("Async database writer has stopped unexpectedly")
-        self._queue.put((command, args))
+        message = (command, args) if t is None else (command, args, t)
+
+        # messages are sent in order, so they are spooled as long as older ones are
+        self._replay_spool()
+        if len(self._spool) == 0:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except Queue.Full:
+                self._spool.append(message)
+                logging.warning("The database writer is lagging. Spooling data to %s" % self._spool.path)
+                return
+        self._spool.append(message)
+
+    def _replay_spool(self, block=False):
+        # sends the spooled messages, in order, as long as there is room in the queue
+        while len(self._spool) > 0:
+            try:
+                self._queue.put(self._spool.peek(), block, 1)
+            except Queue.Full:
+                if not block:
+                    return
+                if not self._async_writer.is_alive():
+                    raise Exception("Async database writer has stopped unexpectedly")
+                continue
+            self._spool.pop()
+            if len(self._spool) == 0:
+                logging.info("The database writer caught up. Spool replayed")
+
+    def _write_async_rows(self, command, rows, t=None):
+        """
+        Send a batch of (integer) rows to insert in the same table. They are inserted with a single (parameterised) statement.
+        Rows are copied in shared memory blocks (see :class:`~ethoscope.utils.row_ring.SharedRowRing`),
+        and only the notices of the blocks are sent through the queue.
+        When no block is free, or rows are too wide, rows are sent through the queue.
+
+        :param command: the insert statement (see ``_insert_command``)
+        :type command: str
+        :param rows: the values of each row
+        :type rows: list(tuple)
+        :param t: the time of the last row, in ms
+        :type t: int
+        """
+        block_size = self._row_ring.block_size
+        for i in range(0, len(rows), block_size):
+            block = rows[i: i + block_size]
+            # the time is the one of the last block
+            block_t = t if i + block_size >= len(rows) else None
+            notice = None
+            if len(block[0]) <= self._row_ring.max_n_columns:
+                notice = self._row_ring.put(block)
+            if notice is None:
+                self._write_async_command(command, list(block), block_t)
+            else:
+                self._write_async_command(command, notice, block_t)
+
+    @staticmethod
+    def _roi_table_fields(sql_fields):
+        # the fields of a ROI table, from the SQL definition of the variables
+        fields = ["id INT  NOT NULL AUTO_INCREMENT PRIMARY KEY" ,"t INT"]
+        fields.extend(sql_fields)
+        return ", ".join(fields)
+
+    @classmethod
+    def _insert_command(cls, table_name, columns):
+        # a parameterised insert statement
+        return "INSERT INTO %s (%s) VALUES (%s)" % (table_name, ", ".join(columns),
+                                                   ", ".join([cls._placeholder] * len(columns)))
 
     def _create_table(self, name, fields, engine="InnoDB"):
         command = "CREATE TABLE IF NOT EXISTS %s (%s) ENGINE %s KEY_BLOCK_SIZE=16" % (name, fields, engine)
@@ -511,17 +783,16 @@ class ResultWriter(object):
     def __setstate__(self, state):
         self.__init__(**state["args"])
 
-class AsyncSQLiteWriter(multiprocessing.Process):
+class AsyncSQLiteWriter(BaseAsyncSQLWriter):
     _pragmas = {"temp_store": "MEMORY",
                 "journal_mode": "OFF",
                 "locking_mode":  "EXCLUSIVE"}
 
-    def __init__(self, db_name, queue, erase_old_db=True):
+    def __init__(self, db_name, queue, erase_old_db=True, row_ring=None):
         self._db_name = db_name
-        self._queue = queue
         self._erase_old_db =  erase_old_db
 
-        super(AsyncSQLiteWriter,self).__init__()
+        super(AsyncSQLiteWriter,self).__init__(queue, row_ring)
         if erase_old_db:
             try:
                 os.remove(self._db_name)
@@ -543,90 +814,20 @@ class AsyncSQLiteWriter(multiprocessing.Process):
         return db
 
 
-    def run(self):
-
-        db = None
-        do_run = True
-        try:
-            db = self._get_connection()
-            while do_run:
-                try:
-                    msg = self._queue.get()
-
-                    if (msg == 'DONE'):
-                        do_run=False
-                        continue
-
-                    command, args = msg
-
-
-                    c = db.cursor()
-                    if args is None:
-                        c.execute(command)
-                    else:
-                        c.execute(command, args)
-
-                    db.commit()
-
-                except:
-                    do_run=False
-                    try:
-                        logging.error("Failed to run mysql command:\n%s" % command)
-                    except:
-                        logging.error("Did not retrieve queue value")
-
-                finally:
-                    if self._queue.empty():
-                        #we sleep iff we have an empty queue. this way, we don't over use a cpu
-                        time.sleep(.1)
-
-        except KeyboardInterrupt as e:
-            logging.warning("DB async process interrupted with KeyboardInterrupt")
-            raise e
-
-        except Exception as e:
-            logging.error("DB async process stopped with an exception")
-            raise e
-
-        finally:
-            logging.info("Closing async mysql writer")
-            while not self._queue.empty():
-                self._queue.get()
-
-            self._queue.close()
-            if db is not None:
-                db.close()
-
-class Null(object):
-    def __repr__(self):
-        return "NULL"
-    def __str__(self):
-        return "NULL"
-
 class SQLiteResultWriter(ResultWriter):
     _async_writing_class = AsyncSQLiteWriter
-    _null= Null()
+    _placeholder = "?"
+
+    @staticmethod
+    def _create_table_command(name, fields):
+        fields = fields.replace("NOT NULL", "")
+        return "CREATE TABLE IF NOT EXISTS %s (%s)" % (name,fields)
+
     def __init__(self, db_credentials, rois, metadata=None, make_dam_like_table=False, take_frame_shots=False, *args, **kwargs):
         super(SQLiteResultWriter, self).__init__(db_credentials, rois, metadata,make_dam_like_table, take_frame_shots, *args, **kwargs)
 
 
     def _create_table(self, name, fields, engine=None):
-
-        fields = fields.replace("NOT NULL", "")
-        command = "CREATE TABLE IF NOT EXISTS %s (%s)" % (name,fields)
+        command = self._create_table_command(name, fields)
         logging.info("Creating database table with: " + command)
         self._write_async_command(command)
-
-    def _add(self, t, roi, data_rows):
-        t = int(round(t))
-        roi_id = roi.idx
-
-        for dr in data_rows:
-            # here we use NULL because SQLite does not support '0' for auto index
-            tp = (self._null, t) + tuple(dr.values())
-
-            if roi_id not in self._insert_dict  or self._insert_dict[roi_id] == "":
-                command = 'INSERT INTO ROI_%i VALUES %s' % (roi_id, str(tp))
-                self._insert_dict[roi_id] = command
-            else:
-                self._insert_dict[roi_id] += ("," + str(tp))
@@ -0,0 +1,500 @@
+__author__ = 'quentin'
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+from ethoscope.utils.io import BaseAsyncSQLWriter, ResultWriter, SQLiteResultWriter, AsyncSQLiteWriter
+from ethoscope.utils.row_ring import RowBlockNotice
+
+# the first bytes of a segment, followed by the length of its (JSON) header
+_MAGIC = "ETHOLOG1"
+_HEADER_LENGTH = struct.Struct("<I")
+# the binary type of variables, by SQL type. Records are little endian, without padding
+_SQL_FORMATS = {"BOOLEAN": "b", "SMALLINT": "h", "INT": "i"}
+_NUMPY_TYPES = {"b": "<i1", "h": "<i2", "i": "<i4", "q": "<i8"}
+# an entry of the time index: the first record of an interval of records, its number of records,
+# and the minimal and maximal time of its records
+_INDEX_ENTRY = struct.Struct("<qqqq")
+_INDEX_DTYPE = np.dtype([("first", "<i8"), ("n", "<i8"), ("t_min", "<i8"), ("t_max", "<i8")])
+
+
+def _segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, "segment_*.etlog")))
+
+
+def _index_path(segment_path):
+    return os.path.splitext(segment_path)[0] + ".etidx"
+
+
+def _data_offset(header_length):
+    # records start on a multiple of 8 bytes
+    return -(-(len(_MAGIC) + _HEADER_LENGTH.size + header_length) // 8) * 8
+
+
+def _read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError("Not a result log segment: %s" % path)
+        header_length, = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+        header = json.loads(f.read(header_length))
+    return header, _data_offset(header_length)
+
+
+class SegmentedResultLog(object):
+
+    def __init__(self, directory, max_segment_size=64 * 1024 ** 2, index_interval=1024):
+        """
+        The writing side of a result log: a directory of append-only segments of fixed-width binary records.
+        The log has the same tables as a result database (see :class:`~ethoscope.utils.io.ResultWriter`).
+        The rows of the ``ROI_*`` tables are records, whilst the other tables (e.g. ``VAR_MAP``, ``ROI_MAP``
+        and ``METADATA``) are small, and stored in the header of each segment.
+        A new segment is started when the current one is larger than ``max_segment_size``, or when these tables change.
+        Each segment has a sparse time index, in a separate file, with the time range of each interval of
+        ``index_interval`` records.
+        Segments are only appended to, so that a crash cannot corrupt data that were committed.
+        If the directory already has segments, the log continues after them.
+
+        It is used like a database connection (it is its own cursor) by :class:`~ethoscope.utils.result_log.AsyncResultLogWriter`.
+
+        :param directory: the directory of the log
+        :type directory: str
+        :param max_segment_size: the size, in bytes, beyond which a new segment is started
+        :type max_segment_size: int
+        :param index_interval: the number of records per entry of the time index
+        :type index_interval: int
+        """
+        self._directory = directory
+        self._max_segment_size = max_segment_size
+        self._index_interval = index_interval
+        # the tables stored in headers, by name: their columns and rows
+        self._tables = {}
+        self._segment_idx = 0
+
+        paths = _segment_paths(directory)
+        if len(paths) > 0:
+            header, _ = _read_header(paths[-1])
+            self._tables = header["tables"]
+            self._segment_idx = header["segment"] + 1
+
+        self._tables_changed = False
+        self._data_file = None
+        self._index_file = None
+        self._columns = None
+        self._record_struct = None
+        self._n_records = 0
+        # the first record, and the time range, of the current interval of the index
+        self._interval_first = 0
+        self._interval_t = None
+
+    def cursor(self):
+        return self
+
+    def insert_rows(self, table_name, columns, rows):
+        table = self._tables.setdefault(table_name, {"columns": list(columns), "rows": []})
+        table["rows"].extend([list(r) for r in rows])
+        self._tables_changed = True
+
+    def replace_rows(self, table_name, columns, rows):
+        self._tables[table_name] = {"columns": list(columns), "rows": [list(r) for r in rows]}
+        self._tables_changed = True
+
+    def append_results(self, roi_idx, columns, rows):
+        """
+        Append the rows of a ROI table as records.
+
+        :param roi_idx: the index of the ROI
+        :type roi_idx: int
+        :param columns: the columns of the rows: ``t``, then the variables, in the order of ``VAR_MAP``
+        :type columns: tuple(str)
+        :param rows: the rows
+        :type rows: list(tuple(int))
+        """
+        if (self._data_file is None or self._tables_changed or
+                self._data_file.tell() >= self._max_segment_size or self._columns != list(columns)):
+            self._open_segment(columns)
+
+        pack = self._record_struct.pack
+        self._data_file.write("".join([pack(roi_idx, *r) for r in rows]))
+
+        t_min, t_max = min(r[0] for r in rows), max(r[0] for r in rows)
+        if self._interval_t is None:
+            self._interval_t = [t_min, t_max]
+        else:
+            self._interval_t = [min(self._interval_t[0], t_min), max(self._interval_t[1], t_max)]
+        self._n_records += len(rows)
+        if self._n_records - self._interval_first >= self._index_interval:
+            self._write_index_entry()
+
+    def _record_format(self, columns):
+        try:
+            var_map = self._tables["VAR_MAP"]["rows"]
+        except KeyError:
+            raise ValueError("VAR_MAP must be written before results")
+        sql_types = dict([(r[0], r[1]) for r in var_map])
+        if list(columns[1:]) != [r[0] for r in var_map]:
+            raise ValueError("The columns of results, %s, do not match VAR_MAP" % str(columns))
+        # the roi index and the time, then the variables
+        return "<hi" + "".join([_SQL_FORMATS.get(sql_types[c], "q") for c in columns[1:]])
+
+    def _open_segment(self, columns):
+        self._close_segment()
+        if columns is not None:
+            self._columns = list(columns)
+            self._record_struct = struct.Struct(self._record_format(columns))
+
+        path = os.path.join(self._directory, "segment_%06i.etlog" % self._segment_idx)
+        header = json.dumps({"segment": self._segment_idx,
+                             "record_columns": None if self._columns is None else ["roi_idx"] + self._columns,
+                             "record_format": None if self._record_struct is None else self._record_struct.format,
+                             "tables": self._tables})
+        self._data_file = open(path, "wb")
+        self._data_file.write(_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+        self._data_file.write("\0" * (_data_offset(len(header)) - self._data_file.tell()))
+        self._index_file = open(_index_path(path), "wb")
+
+        self._segment_idx += 1
+        self._tables_changed = False
+        self._n_records = 0
+        self._interval_first = 0
+        self._interval_t = None
+
+    def _write_index_entry(self):
+        if self._n_records == self._interval_first:
+            return
+        self._index_file.write(_INDEX_ENTRY.pack(self._interval_first, self._n_records - self._interval_first,
+                                                 self._interval_t[0], self._interval_t[1]))
+        self._interval_first = self._n_records
+        self._interval_t = None
+
+    def commit(self):
+        # the records are on disk before the index entries that refer to them
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _close_segment(self):
+        if self._data_file is None:
+            return
+        self._write_index_entry()
+        self.commit()
+        self._data_file.close()
+        self._index_file.close()
+        self._data_file, self._index_file = None, None
+
+    def close(self):
+        # the last changes of the tables (e.g. the stop time, in METADATA) are in the header of a last segment
+        if self._tables_changed:
+            self._open_segment(None)
+        self._close_segment()
+
+
+class AsyncResultLogWriter(BaseAsyncSQLWriter):
+    # see SegmentedResultLog
+    _max_segment_size = 64 * 1024 ** 2
+    _index_interval = 1024
+
+    def __init__(self, directory, queue, erase_old_db=True, row_ring=None):
+        """
+        A process writing the messages of a :class:`~ethoscope.utils.result_log.ResultLogWriter`
+        in a :class:`~ethoscope.utils.result_log.SegmentedResultLog`.
+        Committing a transaction writes the records to disk (i.e. ``fsync``).
+
+        :param directory: the directory of the log. It is made if it does not exist
+        :type directory: str
+        :param queue: the queue of messages
+        :type queue: :class:`~multiprocessing.JoinableQueue`
+        :param erase_old_db: whether to remove the segments already in the directory
+        :type erase_old_db: bool
+        :param row_ring: the shared memory ring in which batches of rows are sent
+        :type row_ring: :class:`~ethoscope.utils.row_ring.SharedRowRing`
+        """
+        self._directory = directory
+        super(AsyncResultLogWriter, self).__init__(queue, row_ring)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if erase_old_db:
+            for p in _segment_paths(directory):
+                os.remove(p)
+                if os.path.exists(_index_path(p)):
+                    os.remove(_index_path(p))
+
+    def _get_connection(self):
+        return SegmentedResultLog(self._directory, self._max_segment_size, self._index_interval)
+
+    def _execute(self, log, command, args):
+        # commands are (kind, table_name, columns) tuples (see ResultLogWriter._insert_command)
+        kind, table_name, columns = command
+        if isinstance(args, RowBlockNotice):
+            rows = self._row_ring.rows(args)
+        elif isinstance(args, list):
+            rows = args
+        else:
+            rows = [args]
+
+        if table_name.startswith("ROI_") and table_name != "ROI_MAP":
+            log.append_results(int(table_name[4:]), columns, rows)
+        elif kind == "replace":
+            log.replace_rows(table_name, columns, rows)
+        else:
+            log.insert_rows(table_name, columns, rows)
+        return len(rows)
+
+
+class ResultLogWriter(ResultWriter):
+    _async_writing_class = AsyncResultLogWriter
+
+    def __init__(self, db_credentials, rois, metadata=None, make_dam_like_table=False, take_frame_shots=False, *args, **kwargs):
+        """
+        A result writer that appends results to a binary log (see :class:`~ethoscope.utils.result_log.SegmentedResultLog`),
+        rather than to a database. This is faster, and more robust to crashes, than a database.
+        The log has the same tables as the database of a :class:`~ethoscope.utils.io.SQLiteResultWriter`.
+        It can be read without conversion, with :class:`~ethoscope.utils.result_log.ResultLogReader`,
+        or converted to a SQLite file, with :func:`~ethoscope.utils.result_log.convert_result_log`.
+        DAM-like tables and frame snapshots are not supported.
+        It is meant for offline tracking and analysis: devices still write to their MySQL database,
+        which is what the node backs up.
+
+        :param db_credentials: the directory of the log
+        :type db_credentials: str
+        :param rois: the ROIs
+        :type rois: list(:class:`~ethoscope.core.roi.ROI`)
+        :param metadata: the metadata of the experiment
+        :type metadata: dict
+        """
+        if make_dam_like_table or take_frame_shots:
+            raise NotImplementedError("Result logs do not store DAM-like tables or frame snapshots")
+        super(ResultLogWriter, self).__init__(db_credentials, rois, metadata, make_dam_like_table, take_frame_shots,
+                                              *args, **kwargs)
+
+    def _create_table(self, name, fields, engine=None):
+        # the layout of the log does not depend on table definitions
+        pass
+
+    @classmethod
+    def _insert_command(cls, table_name, columns):
+        return "insert", table_name, tuple(columns)
+
+    def _initialise_var_map(self, schema):
+        logging.info("Writing variable map")
+        command = "replace", "VAR_MAP", ("var_name", "sql_type", "functional_type")
+        self._write_async_command(command, schema.var_map())
+        self._var_map_initialised = True
+
+
+class ResultLogSegment(object):
+    def __init__(self, path):
+        """
+        A segment of a result log, for reading. Its records are memory mapped, rather than loaded.
+
+        :param path: the path to the segment
+        :type path: str
+        """
+        self._path = path
+        self._header, self._data_offset = _read_header(path)
+        self._records = None
+        self._index = None
+
+        columns = self._header["record_columns"]
+        if columns is None:
+            self._dtype = None
+        else:
+            formats = self._header["record_format"][1:]
+            self._dtype = np.dtype([(str(c), _NUMPY_TYPES[f]) for c, f in zip(columns, formats)])
+
+    @property
+    def header(self):
+        return self._header
+
+    @property
+    def tables(self):
+        return self._header["tables"]
+
+    @property
+    def dtype(self):
+        """
+        :return: The type of records (``None`` if the segment has no record).
+        :rtype: :class:`~numpy.dtype`
+        """
+        return self._dtype
+
+    @property
+    def records(self):
+        """
+        :return: All the complete records of the segment, as a read-only, memory mapped, structured array
+        :rtype: :class:`~numpy.memmap`
+        """
+        if self._records is None:
+            n = 0
+            if self._dtype is not None:
+                n = (os.path.getsize(self._path) - self._data_offset) // self._dtype.itemsize
+            if n > 0:
+                self._records = np.memmap(self._path, dtype=self._dtype, mode="r", offset=self._data_offset, shape=(n,))
+            else:
+                self._records = np.zeros(0, dtype=self._dtype)
+        return self._records
+
+    @property
+    def index(self):
+        """
+        :return: The time index: the first record, the number of records,
+            and the time range of each interval of records (``first``, ``n``, ``t_min`` and ``t_max``)
+        :rtype: :class:`~numpy.ndarray`
+        """
+        if self._index is None:
+            path = _index_path(self._path)
+            n = os.path.getsize(path) // _INDEX_DTYPE.itemsize if os.path.exists(path) else 0
+            self._index = np.fromfile(path, dtype=_INDEX_DTYPE, count=n) if n > 0 else np.zeros(0, _INDEX_DTYPE)
+        return self._index
+
+    def select(self, roi_idx=None, start=None, end=None):
+        """
+        :param roi_idx: the index of a ROI. ``None`` means all ROIs
+        :type roi_idx: int
+        :param start: the start of a time range, in ms. ``None`` means the start of the segment
+        :type start: int
+        :param end: the end of the time range, in ms (excluded). ``None`` means the end of the segment
+        :type end: int
+        :return: The records of a ROI within a time range. Only the intervals of records in the time range are read.
+        :rtype: :class:`~numpy.ndarray`
+        """
+        records = self.records
+        if start is None and end is None:
+            chunks = [records]
+        else:
+            index = self.index
+            keep = np.ones(len(index), dtype=bool)
+            if start is not None:
+                keep &= index["t_max"] >= start
+            if end is not None:
+                keep &= index["t_min"] < end
+            chunks = [records[e["first"]: e["first"] + e["n"]] for e in index[keep]]
+            # records after the last entry of the index (e.g. after a crash) are not indexed
+            n_indexed = index["first"][-1] + index["n"][-1] if len(index) > 0 else 0
+            chunks.append(records[n_indexed:])
+        out = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+        mask = np.ones(len(out), dtype=bool)
+        if roi_idx is not None:
+            mask &= out["roi_idx"] == roi_idx
+        if start is not None:
+            mask &= out["t"] >= start
+        if end is not None:
+            mask &= out["t"] < end
+        return out[mask]
+
+
+class ResultLogReader(object):
+    def __init__(self, directory):
+        """
+        Read a result log (see :class:`~ethoscope.utils.result_log.ResultLogWriter`) without conversion.
+
+        >>> from ethoscope.utils.result_log import ResultLogReader
+        >>> log = ResultLogReader("/tmp/my_log")
+        >>> print log.metadata["machine_id"]
+        >>> # the positions of the animal in ROI 3, during the first hour
+        >>> records = log.select(3, 0, 3600 * 1000)
+        >>> print records["x"], records["y"]
+
+        :param directory: the directory of the log
+        :type directory: str
+        """
+        self._segments = [ResultLogSegment(p) for p in _segment_paths(directory)]
+        if len(self._segments) == 0:
+            raise ValueError("No result log in %s" % directory)
+
+    @property
+    def segments(self):
+        return self._segments
+
+    @property
+    def tables(self):
+        """
+        :return: The tables other than ROI tables, by name, as dictionaries of ``columns`` and ``rows``
+        :rtype: dict
+        """
+        # the last segment has all the changes of the tables
+        return self._segments[-1].tables
+
+    def _table_rows(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            return []
+        return [dict(zip(table["columns"], r)) for r in table["rows"]]
+
+    @property
+    def metadata(self):
+        return dict([(r["field"], r["value"]) for r in self._table_rows("METADATA")])
+
+    @property
+    def roi_map(self):
+        return self._table_rows("ROI_MAP")
+
+    @property
+    def var_map(self):
+        return self._table_rows("VAR_MAP")
+
+    def select(self, roi_idx=None, start=None, end=None):
+        """
+        :return: The records of a ROI within a time range, in all segments
+            (see :meth:`~ethoscope.utils.result_log.ResultLogSegment.select`)
+        :rtype: :class:`~numpy.ndarray`
+        """
+        out = [s.select(roi_idx, start, end) for s in self._segments if s.dtype is not None]
+        if len(out) == 0:
+            raise ValueError("The result log has no record")
+        return np.concatenate(out)
+
+
+def convert_result_log(directory, db_file):
+    """
+    Convert a result log to a SQLite file, with the same tables as the one of a :class:`~ethoscope.utils.io.SQLiteResultWriter`.
+    An existing file is replaced.
+
+    :param directory: the directory of the log
+    :type directory: str
+    :param db_file: the path of the SQLite file
+    :type db_file: str
+    """
+    log = ResultLogReader(directory)
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        c = conn.cursor()
+        for k, v in AsyncSQLiteWriter._pragmas.items():
+            c.execute("PRAGMA %s = %s" % (str(k), str(v)))
+
+        tables = log.tables
+        for name in ("ROI_MAP", "VAR_MAP", "METADATA", "START_EVENTS"):
+            c.execute(SQLiteResultWriter._create_table_command(name, ResultWriter._table_fields[name]))
+            if name in tables:
+                command = SQLiteResultWriter._insert_command(name, tables[name]["columns"])
+                c.executemany(command, tables[name]["rows"])
+
+        var_map = tables.get("VAR_MAP", {"rows": []})["rows"]
+        if len(var_map) > 0:
+            columns = ["t"] + [r[0] for r in var_map]
+            sql_fields = ["%s %s" % (r[0], r[1]) for r in var_map]
+            roi_idxs = [r["roi_idx"] for r in log.roi_map]
+            for roi_idx in roi_idxs:
+                c.execute(SQLiteResultWriter._create_table_command("ROI_%i" % roi_idx,
+                                                                   ResultWriter._roi_table_fields(sql_fields)))
+
+            for segment in log.segments:
+                records = segment.records
+                if len(records) == 0:
+                    continue
+                for roi_idx in roi_idxs:
+                    roi_records = records[records["roi_idx"] == roi_idx]
+                    rows = np.column_stack([roi_records[col] for col in columns]).tolist()
+                    c.executemany(SQLiteResultWriter._insert_command("ROI_%i" % roi_idx, columns), rows)
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,135 @@
+__author__ = 'quentin'
+
+import ctypes
+import itertools
+import multiprocessing
+import struct
+
+import numpy as np
+
+
+class RowBlockNotice(object):
+    __slots__ = ("slot", "n_rows", "n_columns")
+
+    def __init__(self, slot, n_rows, n_columns):
+        """
+        A small message telling the consumer of a :class:`~ethoscope.utils.row_ring.SharedRowRing`
+        that a block of rows is ready in a slot.
+
+        :param slot: the index of the slot
+        :type slot: int
+        :param n_rows: the number of rows in the block
+        :type n_rows: int
+        :param n_columns: the number of columns of the rows
+        :type n_columns: int
+        """
+        self.slot = slot
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+
+    def __reduce__(self):
+        return RowBlockNotice, (self.slot, self.n_rows, self.n_columns)
+
+
+class SharedRowRing(object):
+
+    def __init__(self, block_size, max_n_columns, n_slots=64):
+        """
+        A ring of preallocated blocks of integer rows in shared memory, to pass rows from one producer process
+        (e.g. a :class:`~ethoscope.utils.io.ResultWriter`) to one consumer process
+        (e.g. a :class:`~ethoscope.utils.io.BaseAsyncSQLWriter`) without pickling them through a pipe.
+        Each slot holds up to ``block_size * max_n_columns`` 64 bit integers.
+        A block of ``n`` rows of ``m`` columns is stored as a contiguous ``(n, m)`` array at the start of its slot.
+
+        The producer copies a batch of rows in the next free slot (:meth:`~ethoscope.utils.row_ring.SharedRowRing.put`),
+        and sends the returned :class:`~ethoscope.utils.row_ring.RowBlockNotice` to the consumer (e.g. through a queue).
+        The consumer reads the rows (:meth:`~ethoscope.utils.row_ring.SharedRowRing.rows`), which frees the slot.
+        Notices must be read in the order the blocks were put.
+        The ring must be made before the consumer process is started, so that both processes share it.
+
+        :param block_size: the maximal number of rows per block
+        :type block_size: int
+        :param max_n_columns: the maximal number of columns of rows
+        :type max_n_columns: int
+        :param n_slots: the number of slots in the ring
+        :type n_slots: int
+        """
+        if n_slots < 1:
+            raise ValueError("A row ring needs at least one slot")
+        self._block_size = block_size
+        self._max_n_columns = max_n_columns
+        self._n_slots = n_slots
+
+        self._slot_size = max_n_columns * block_size
+        self._buffer = multiprocessing.RawArray(ctypes.c_longlong, n_slots * self._slot_size)
+        self._free_slots = multiprocessing.Semaphore(n_slots)
+        # the binary format of blocks, by number of values
+        self._structs = {}
+
+        # Each of these indices is only used by one side (producer or consumer), in its own process
+        self._write_idx = 0
+        self._read_idx = 0
+        self._blocks = None
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    @property
+    def max_n_columns(self):
+        return self._max_n_columns
+
+    def _slots(self):
+        # numpy views are made lazily, in the process that uses them
+        if self._blocks is None:
+            self._blocks = np.frombuffer(self._buffer, dtype=np.int64).reshape((self._n_slots, self._slot_size))
+        return self._blocks
+
+    def put(self, rows):
+        """
+        Copy a batch of rows in the next free slot, if there is one. To be called by the producer process.
+
+        :param rows: the rows. They must all have the same number of (integer) values
+        :type rows: list(tuple(int))
+        :return: the notice to send to the consumer, or ``None`` if no slot is free (the rows are not in the ring)
+        :rtype: :class:`~ethoscope.utils.row_ring.RowBlockNotice`
+        """
+        n_rows = len(rows)
+        n_columns = len(rows[0])
+        if n_rows > self._block_size or n_columns > self._max_n_columns:
+            raise ValueError("Blocks have at most %i rows of %i columns. Got %i rows of %i columns" %
+                             (self._block_size, self._max_n_columns, n_rows, n_columns))
+
+        if not self._free_slots.acquire(False):
+            return None
+
+        n_values = n_rows * n_columns
+        try:
+            block_struct = self._structs[n_values]
+        except KeyError:
+            block_struct = struct.Struct("=%iq" % n_values)
+            self._structs[n_values] = block_struct
+
+        slot = self._write_idx % self._n_slots
+        # this converts and copies all values at once, without intermediate array
+        block_struct.pack_into(self._buffer, slot * self._slot_size * 8, *itertools.chain.from_iterable(rows))
+        self._write_idx += 1
+        return RowBlockNotice(slot, n_rows, n_columns)
+
+    def rows(self, notice):
+        """
+        Read a block of rows, and free its slot. To be called by the consumer process.
+
+        :param notice: the notice of the block (it must be the oldest block not read yet)
+        :type notice: :class:`~ethoscope.utils.row_ring.RowBlockNotice`
+        :return: the rows
+        :rtype: list(list(int))
+        """
+        if notice.slot != self._read_idx % self._n_slots:
+            raise ValueError("Blocks must be read in order. Expected slot %i, got %i" %
+                             (self._read_idx % self._n_slots, notice.slot))
+        n_values = notice.n_rows * notice.n_columns
+        out = self._slots()[notice.slot, :n_values].reshape(notice.n_rows, notice.n_columns).tolist()
+        self._read_idx += 1
+        self._free_slots.release()
+        return out
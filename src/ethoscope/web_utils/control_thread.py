@@ -124,7 +124,9 @@ class ControlThread(Thread):
                             "last_positions":None,
 
                             "last_time_stamp":0,
-                            "fps":0
+                            "fps":0,
+                            "n_dropped_frames":0,
+                            "n_skipped_roi_frames":0
                             }
     _persistent_state_file = "/var/cache/ethoscope/persistent_state.pkl"
 
@@ -167,10 +169,13 @@ class ControlThread(Thread):
                         "version": version,
                         "db_name":self._db_credentials["name"],
                         "monitor_info": self._default_monitor_info,
+                        # the health of the database writer (see `ethoscope.utils.io.ResultWriter.stats`)
+                        "result_writer_info": {},
                         #"user_options": self._get_user_options(),
                         "experimental_info": {}
                         }
         self._monit = None
+        self._result_writer = None
 
         self._parse_user_options(data)
 
@@ -277,9 +282,14 @@ class ControlThread(Thread):
             self._info["monitor_info"] = {
                             # "last_positions":pos,
                             "last_time_stamp":t,
-                            "fps": f
+                            "fps": f,
+                            "n_dropped_frames": self._monit.n_dropped_frames,
+                            "n_skipped_roi_frames": self._monit.n_skipped_roi_frames
                             }
 
+        if self._result_writer is not None:
+            self._info["result_writer_info"] = self._result_writer.stats
+
         frame = self._drawer.last_drawn_frame
         if frame is not None:
             cv2.imwrite(self._info["last_drawn_img"], frame, [int(cv2.IMWRITE_JPEG_QUALITY), 50])
@@ -412,6 +422,7 @@ class ControlThread(Thread):
                 #cam, rw, rois, TrackerClass, tracker_kwargs, hardware_connection, StimulatorClass, stimulator_kwargs = self._set_tracking_from_scratch()
             
             with rw as result_writer:
+                self._result_writer = result_writer
                 if cam.canbepickled:
                     self._save_pickled_state(cam, rw, rois, TrackerClass, tracker_kwargs, hardware_connection, StimulatorClass, stimulator_kwargs)
                 
@@ -467,6 +478,8 @@ class ControlThread(Thread):
         self._info["time"] = time.time()
         self._info["error"] = error
         self._info["monitor_info"] = self._default_monitor_info
+        self._info["result_writer_info"] = {}
+        self._result_writer = None
 
         if error is not None:
             logging.error("Monitor closed with an error:")
@@ -0,0 +1,230 @@
+"""
+A script to track a whole directory of videos (e.g. the ones mirrored by the video backup tool) offline.
+Videos are analysed in parallel processes, each producing a SQLite result file.
+A job ledger (a json file) records the state of each video, so that an interrupted batch
+resumes where it stopped, without analysing again the videos that are already done.
+
+Example::
+
+    batch_offline_tracking.py -i /ethoscope_videos -o /ethoscope_results_offline -r SleepMonitorWithTargetROIBuilder
+"""
+
+__author__ = 'quentin'
+
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from optparse import OptionParser
+
+from ethoscope.core.monitor import Monitor
+from ethoscope.hardware.input.cameras import MovieVirtualCamera
+from ethoscope.roi_builders.roi_builders import DefaultROIBuilder
+from ethoscope.roi_builders.target_roi_builder import OlfactionAssayROIBuilder, SleepMonitorWithTargetROIBuilder, TargetGridROIBuilder
+from ethoscope.trackers.adaptive_bg_tracker import AdaptiveBGModel
+from ethoscope.trackers.batched_tracker import BatchedAdaptiveBGModel, ROIBatch
+from ethoscope.trackers.connected_components_tracker import ConnectedComponentsTracker
+from ethoscope.trackers.multi_fly_tracker import MultiFlyTracker
+from ethoscope.trackers.single_roi_tracker import AdaptiveBGModelOneObject
+from ethoscope.utils.io import SQLiteResultWriter
+
+ROI_BUILDERS = dict([(c.__name__, c) for c in [DefaultROIBuilder, SleepMonitorWithTargetROIBuilder,
+                                               TargetGridROIBuilder, OlfactionAssayROIBuilder]])
+TRACKERS = dict([(c.__name__, c) for c in [AdaptiveBGModel, BatchedAdaptiveBGModel, ConnectedComponentsTracker,
+                                           MultiFlyTracker, AdaptiveBGModelOneObject]])
+
+
+class JobLedger(object):
+    def __init__(self, path):
+        """
+        A record of the state ("running", "done" or "failed") of each job, saved as a json file after each change.
+
+        :param path: the path to the ledger file. It is loaded if it exists.
+        :type path: str
+        """
+        self._path = path
+        self._jobs = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._jobs = json.load(f)
+
+    def is_done(self, key, options):
+        """
+        :return: whether a job was successfully completed, with the same options, and its result file still exists.
+        :rtype: bool
+        """
+        job = self._jobs.get(key)
+        if job is None or job["status"] != "done" or job["options"] != options:
+            return False
+        return os.path.exists(job["result_file"])
+
+    def update(self, key, **kwargs):
+        job = self._jobs.setdefault(key, {})
+        job.update(kwargs)
+        job["last_update"] = time.time()
+        self._save()
+
+    def _save(self):
+        # we write a new file and rename it, so an interruption cannot leave a corrupted ledger
+        tmp = self._path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._jobs, f, indent=2, sort_keys=True)
+        os.rename(tmp, self._path)
+
+
+class OfflineTrackingJob(multiprocessing.Process):
+    def __init__(self, key, video_file, result_file, options):
+        """
+        A process that builds the ROIs of a video, tracks it and saves the results.
+        Results are written to a temporary file, which is renamed once tracking has completed.
+
+        :param key: the identifier of the job in the ledger
+        :param video_file: the path to the video
+        :param result_file: the path to the result file
+        :param options: the names of the tracker and ROI builder classes, and ``drop_each``
+        :type options: dict
+        """
+        self.key = key
+        self.result_file = result_file
+        self._video_file = video_file
+        self._options = options
+        super(OfflineTrackingJob, self).__init__()
+
+    def run(self):
+        cam = None
+        try:
+            tmp_file = self.result_file + ".tmp"
+            cam = MovieVirtualCamera(self._video_file, drop_each=self._options["drop_each"])
+            rois = ROI_BUILDERS[self._options["roi_builder"]]().build(cam)
+            cam.restart()
+
+            metadata = {"video_file": self._video_file,
+                        "date_time": time.time(),
+                        "frame_width": cam.width,
+                        "frame_height": cam.height,
+                        "selected_options": str(self._options)}
+
+            tracker_class = TRACKERS[self._options["tracker"]]
+            tracker_kwargs = {}
+            if issubclass(tracker_class, BatchedAdaptiveBGModel):
+                tracker_kwargs["batch"] = ROIBatch()
+            monit = Monitor(cam, tracker_class, rois, **tracker_kwargs)
+            with SQLiteResultWriter(tmp_file, rois, metadata) as rw:
+                monit.run(rw)
+            os.rename(tmp_file, self.result_file)
+        except Exception as e:
+            logging.error("Failed to track %s: %s" % (self._video_file, traceback.format_exc(e)))
+            raise e
+        finally:
+            if cam is not None:
+                cam._close()
+
+
+def find_videos(input_dir, extensions):
+    videos = []
+    for root, _, _ in os.walk(input_dir):
+        for ext in extensions:
+            videos += glob.glob(os.path.join(root, "*." + ext))
+    return sorted(videos)
+
+
+def run_batch(input_dir, output_dir, options, extensions, n_processes, ledger_file, force=False):
+    """
+    Track all the videos in a directory, in parallel, skipping the ones the ledger reports as done.
+
+    :return: the number of failed jobs
+    :rtype: int
+    """
+    ledger = JobLedger(ledger_file)
+    jobs = []
+    for v in find_videos(input_dir, extensions):
+        key = os.path.relpath(v, input_dir)
+        if not force and ledger.is_done(key, options):
+            logging.info("Skipping %s (already done)" % key)
+            continue
+        result_file = os.path.abspath(os.path.join(output_dir, os.path.splitext(key)[0] + ".db"))
+        if not os.path.isdir(os.path.dirname(result_file)):
+            os.makedirs(os.path.dirname(result_file))
+        jobs.append(OfflineTrackingJob(key, v, result_file, options))
+
+    logging.info("%i videos to track, in up to %i processes" % (len(jobs), n_processes))
+    n_failed = 0
+    running = []
+    try:
+        while len(jobs) > 0 or len(running) > 0:
+            while len(jobs) > 0 and len(running) < n_processes:
+                job = jobs.pop(0)
+                ledger.update(job.key, status="running", options=options, result_file=job.result_file)
+                job.start()
+                running.append(job)
+
+            for job in list(running):
+                if job.is_alive():
+                    continue
+                job.join()
+                running.remove(job)
+                if job.exitcode == 0:
+                    ledger.update(job.key, status="done")
+                    logging.info("Done: %s" % job.key)
+                else:
+                    n_failed += 1
+                    ledger.update(job.key, status="failed", exit_code=job.exitcode)
+                    logging.error("Failed: %s" % job.key)
+            time.sleep(.5)
+    finally:
+        # interrupted jobs stay "running" in the ledger, so they are analysed again on resume
+        for job in running:
+            job.terminate()
+            job.join()
+    return n_failed
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-i", "--input-dir", dest="input_dir", help="The directory containing the videos (searched recursively)")
+    parser.add_option("-o", "--output-dir", dest="output_dir", help="Where result files are saved. Default: the input directory")
+    parser.add_option("-r", "--roi-builder", dest="roi_builder", default="SleepMonitorWithTargetROIBuilder",
+                      help="One of: %s" % ", ".join(sorted(ROI_BUILDERS.keys())))
+    parser.add_option("-t", "--tracker", dest="tracker", default="AdaptiveBGModel",
+                      help="One of: %s" % ", ".join(sorted(TRACKERS.keys())))
+    parser.add_option("-d", "--drop-each", dest="drop_each", default=1, type="int", help="Only track one frame every `drop_each`")
+    parser.add_option("-e", "--extensions", dest="extensions", default="h264,avi,mp4",
+                      help="Comma separated extensions of the video files")
+    parser.add_option("-j", "--n-processes", dest="n_processes", default=multiprocessing.cpu_count(), type="int",
+                      help="The number of videos analysed simultaneously. Default: the number of cores")
+    parser.add_option("-l", "--ledger", dest="ledger", help="The job ledger file. Default: 'offline_tracking_ledger.json' in the output directory")
+    parser.add_option("-f", "--force", dest="force", default=False, action="store_true",
+                      help="Track all videos again, even if the ledger reports them as done")
+    parser.add_option("-D", "--debug", dest="debug", default=False, action="store_true", help="Set DEBUG mode ON")
+
+    (options, args) = parser.parse_args()
+    option_dict = vars(options)
+
+    logging.getLogger().setLevel(logging.DEBUG if option_dict["debug"] else logging.INFO)
+
+    if option_dict["input_dir"] is None:
+        parser.error("An input directory is required")
+    if option_dict["roi_builder"] not in ROI_BUILDERS:
+        parser.error("Unknown ROI builder: %s" % option_dict["roi_builder"])
+    if option_dict["tracker"] not in TRACKERS:
+        parser.error("Unknown tracker: %s" % option_dict["tracker"])
+
+    output_dir = option_dict["output_dir"] or option_dict["input_dir"]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    ledger_file = option_dict["ledger"] or os.path.join(output_dir, "offline_tracking_ledger.json")
+
+    job_options = {"roi_builder": option_dict["roi_builder"],
+                   "tracker": option_dict["tracker"],
+                   "drop_each": option_dict["drop_each"]}
+
+    n_failed = run_batch(option_dict["input_dir"], output_dir, job_options,
+                         option_dict["extensions"].split(","), option_dict["n_processes"],
+                         ledger_file, option_dict["force"])
+    if n_failed > 0:
+        logging.error("%i videos could not be tracked" % n_failed)
+        sys.exit(1)
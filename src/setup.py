@@ -12,7 +12,7 @@ setup(
     long_description="TODO",
 
     keywords=["behaviour", "video tracking"],
-    scripts=['scripts/device_server.py'],
+    scripts=['scripts/device_server.py', 'scripts/batch_offline_tracking.py'],
 
     classifiers=[
         'Intended Audience :: Science/Research',